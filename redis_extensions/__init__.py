@@ -1,8 +1,16 @@
 import redis
 from redis import *
 
+from redis_extensions.aio import AsyncRedisExtensions
+from redis_extensions.bloom import BloomFilter, RedisBloomFilter, SetBloomCache
+from redis_extensions.captcha import GvcodePool
+from redis_extensions.executor import DelayedExecutor
 from redis_extensions.expires import BaseRedisExpires, RedisExpires
-from redis_extensions.extensions import RedisExtensions, StrictRedisExtensions
+from redis_extensions.extensions import (RedisExtensions, StrictRedisExtensions, delayed_item_key, delayed_lane_key,
+                                         delayed_shard_keys)
+from redis_extensions.locks import AsyncLeaseLock, LeaseLock, ReadWriteLock, Redlock, RedlockLease, Semaphore
+from redis_extensions.metrics import InMemoryLockMetrics, LockMetricsSink
+from redis_extensions.ratelimit import LeasedRateLimiter, RateLimiter, RateLimitResult
 
 
-__all__ = redis.__all__ + ['RedisExtensions', 'StrictRedisExtensions', 'BaseRedisExpires', 'RedisExpires']
+__all__ = redis.__all__ + ['RedisExtensions', 'StrictRedisExtensions', 'BaseRedisExpires', 'RedisExpires', 'LeaseLock', 'AsyncLeaseLock', 'Redlock', 'RedlockLease', 'Semaphore', 'ReadWriteLock', 'LockMetricsSink', 'InMemoryLockMetrics', 'RateLimiter', 'RateLimitResult', 'LeasedRateLimiter', 'BloomFilter', 'RedisBloomFilter', 'SetBloomCache', 'GvcodePool', 'DelayedExecutor', 'AsyncRedisExtensions', 'delayed_shard_keys', 'delayed_item_key', 'delayed_lane_key']
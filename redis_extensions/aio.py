@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import random
+import signal
+import time as mod_time
+from typing import Any, AsyncIterator, Callable, Dict, Iterable, List, Optional, Sequence, Set, Tuple, Union
+
+from redis.asyncio import StrictRedis
+
+from .extensions import (ACK_DELAYED_SCRIPT, CLAIM_DELAYED_SCRIPT, ENQUEUE_DELAYED_SCRIPT, FAIL_DELAYED_SCRIPT,
+                         KEY_PREFIX, NACK_DELAYED_SCRIPT, REQUEUE_INFLIGHT_SCRIPT, _delayed_chunks, _delayed_dedup,
+                         _delayed_identifier, _delayed_lanes, _hash_tag_groups, delayed_item_key, delayed_lane_key,
+                         delayed_shard_keys, logger)
+
+
+class AsyncRedisExtensions(StrictRedis):
+    """
+    ``redis.asyncio`` counterpart of the delay tasks section of ``RedisExtensions``, items are interchangeable.
+
+    Usage::
+
+        r = AsyncRedisExtensions(host='localhost', port=6379, db=0)
+        await r.execute_later('email', 'welcome', {'uid': 1}, delay=60)
+        await r.poll_queue(callbacks={'email': send_email}, concurrency=1000)
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.poll_queue_continue_flag = True
+        self.__wakeups = {}  # type: Dict[Tuple[str, ...], asyncio.Task]
+        self.__scripts = {}
+        super(AsyncRedisExtensions, self).__init__(*args, **kwargs)
+
+    def __script(self, script: str) -> Any:
+        if script not in self.__scripts:
+            self.__scripts[script] = self.register_script(script)
+        return self.__scripts[script]
+
+    # Delay Tasks Section
+    def __queue_key(self, queue: str) -> str:
+        return '{0}queue:{1}'.format(KEY_PREFIX, queue)
+
+    def _inflight_key(self, delayed: str) -> str:
+        return '{0}:inflight'.format(delayed)
+
+    def _wakeup_key(self, delayed: str) -> str:
+        return '{0}:wakeup'.format(delayed)
+
+    def _delayed_keys(self, delayed: str, priorities: Optional[List[int]] = None) -> List[str]:
+        return [delayed, self._inflight_key(delayed), self._wakeup_key(delayed), '{0}:attempts'.format(delayed), '{0}:dead'.format(delayed), '{0}:payload'.format(delayed), '{0}:priority'.format(delayed)] + _delayed_lanes(delayed, priorities, None)[0]
+
+    async def execute_later(self, queue: str, name: str, args: Dict[str, Any] = None, delayed: str = KEY_PREFIX + 'delayed:default', delay: float = 0, short_uuid: bool = False, enable_queue: bool = False, shards: int = 1, compact: bool = False, priority: int = 0, dedup_key: Optional[str] = None, dedup_ttl: Optional[float] = None, dedup_policy: str = 'keep') -> str:
+        """
+        Producer of delay execute.
+        """
+        dedup = _delayed_dedup(dedup_key, dedup_ttl, dedup_policy, delay)
+        identifier = _delayed_identifier(short_uuid, shards, dedup_key if delay > 0 else None)
+        item = json.dumps([identifier, queue, name, args])
+        if delay > 0:
+            keys = self._delayed_keys(delayed_item_key(delayed, shards, identifier))
+            keys.append(delayed_lane_key(keys[0], priority))
+            if dedup_key:
+                keys.append('{0}:dedup:{1}'.format(keys[0], dedup_key))
+            identifier = await self.__script(ENQUEUE_DELAYED_SCRIPT)(keys=keys, args=[mod_time.time() + delay, identifier if compact else item, identifier, item if compact else '', priority] + dedup)
+            # Of the duplicate if deduplicated
+            return identifier.decode('utf-8') if isinstance(identifier, bytes) else identifier
+        else:
+            if enable_queue:
+                await self.rpush(self.__queue_key(queue), item)
+        return identifier
+
+    async def execute_later_many(self, tasks: Iterable[Sequence[Any]], delayed: str = KEY_PREFIX + 'delayed:default', chunk_size: int = 1000, short_uuid: bool = False, enable_queue: bool = False, shards: int = 1, compact: bool = False) -> AsyncIterator[str]:
+        """
+        Bulk producer of delay execute, as ``RedisExtensions.execute_later_many``.
+        """
+        for identifiers, hsets, zadds, rpushes in _delayed_chunks(tasks, delayed, chunk_size, short_uuid, shards, compact):
+            pipe = self.pipeline(transaction=False)
+            for key, mapping in hsets.items():
+                pipe.hset(key, mapping=mapping)
+            for (key, lane), mapping in zadds.items():
+                pipe.zadd(lane, mapping)
+                pipe.lpush(self._wakeup_key(key), 1).ltrim(self._wakeup_key(key), 0, 0)
+            if enable_queue:
+                for queue, items in rpushes.items():
+                    pipe.rpush(self.__queue_key(queue), *items)
+            await pipe.execute()
+            for identifier in identifiers:
+                yield identifier
+
+    async def claim_delayed(self, delayed: str = KEY_PREFIX + 'delayed:default', batch_size: int = 100, inflight: bool = True, with_next_due: bool = False, visibility_timeout: Optional[float] = None, max_attempts: Optional[int] = None, priorities: Optional[List[int]] = None, priority_weights: Optional[Dict[int, float]] = None, priority_aging: Optional[float] = None) -> Union[List[str], Tuple[List[str], Optional[float]]]:
+        if batch_size <= 0:
+            raise ValueError('The batch_size argument should be positive')
+        lanes, weights = _delayed_lanes(delayed, priorities, priority_weights)
+        items, next_due = await self.__script(CLAIM_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed) + lanes, args=[mod_time.time(), batch_size, int(inflight), visibility_timeout or 0, max_attempts or 0, priority_aging or 0] + weights)
+        if with_next_due:
+            return items, next_due and float(next_due)
+        return items
+
+    async def wait_delayed(self, delayed: Union[str, List[str]] = KEY_PREFIX + 'delayed:default', next_due: Optional[float] = None, max_wait: float = 1) -> bool:
+        timeout = max_wait if next_due is None else min(max(next_due - mod_time.time(), 0), max_wait)
+        if timeout <= 0:
+            return False
+        if timeout <= .1:
+            await asyncio.sleep(timeout)
+            return False
+        delayeds = [delayed] if isinstance(delayed, str) else delayed
+        groups = _hash_tag_groups([self._wakeup_key(key) for key in delayeds])
+        if len(groups) == 1:
+            return bool(await self.blpop(groups[0], timeout=timeout - .1))
+        return await self.__wait_wakeups(groups, timeout - .1)
+
+    async def __wait_wakeups(self, groups: List[List[str]], timeout: float) -> bool:
+        # No multi-slot ``BLPOP``, one task per cluster slot at once, as ``RedisExtensions.wait_delayed``
+        end = mod_time.monotonic() + timeout
+        while True:
+            woken = False
+            for group, task in list(self.__wakeups.items()):
+                if task.done():
+                    del self.__wakeups[group]
+                    woken = bool(task.result()) or woken
+            remaining = end - mod_time.monotonic()
+            if woken or remaining <= 0:
+                return woken
+            for keys in groups:
+                if tuple(keys) not in self.__wakeups:
+                    self.__wakeups[tuple(keys)] = asyncio.ensure_future(self.blpop(keys, timeout=remaining))
+            await asyncio.wait([self.__wakeups[tuple(keys)] for keys in groups], timeout=remaining, return_when=asyncio.FIRST_COMPLETED)
+
+    async def __cancel_wakeups(self):
+        tasks, self.__wakeups = list(self.__wakeups.values()), {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def ack_delayed(self, delayed: str, *items: str) -> int:
+        return await self.__script(ACK_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed), args=items)
+
+    async def fail_delayed(self, delayed: str, item: str, max_attempts: Optional[int] = None, backoff: float = 1, backoff_max: float = 3600, priorities: Optional[List[int]] = None) -> int:
+        return await self.__script(FAIL_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed, priorities), args=[item, mod_time.time(), max_attempts or 0, backoff, backoff_max, random.random()])
+
+    async def nack_delayed(self, delayed: str, *items: str, delay: float = 0, priorities: Optional[List[int]] = None) -> int:
+        return await self.__script(NACK_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed, priorities), args=[mod_time.time() + delay] + list(items))
+
+    async def requeue_inflight(self, delayed: str = KEY_PREFIX + 'delayed:default', older_than: float = 0, priorities: Optional[List[int]] = None) -> int:
+        return await self.__script(REQUEUE_INFLIGHT_SCRIPT)(keys=self._delayed_keys(delayed, priorities), args=[mod_time.time() - older_than])
+
+    def stop(self):
+        """
+        Stop ``poll_queue`` gracefully, within ``max_wait`` seconds, e.g. from the host application's signal handlers.
+        """
+        self.poll_queue_continue_flag = False
+
+    async def __consume(self, delayed: str, shards: int, item: str, callback: Optional[Callable], enable_auto_zrem: bool, enable_queue: bool, release_lock_when_error: bool, task_timeout: Optional[float], final_logger: logging.Logger, retry: Optional[Tuple[int, float, float, Optional[List[int]]]], settled: Set[str]):
+        # Items in ``settled`` are never requeued when cancelled
+        identifier, queue, name, args = json.loads(item)
+        delayed = delayed_item_key(delayed, shards, identifier)
+        if callback:
+            try:
+                if asyncio.iscoroutinefunction(callback):
+                    result = callback(name, args)
+                else:
+                    # Blocking callbacks run in the default executor, never block the event loop.
+                    # Not interrupted when cancelled, requeued by ``visibility_timeout`` or when launch instead
+                    settled.add(item)
+                    result = asyncio.get_running_loop().run_in_executor(None, callback, name, args)
+                await asyncio.wait_for(result, task_timeout)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                final_logger.error('Task timed out after {0} seconds: {1}'.format(task_timeout, item) if isinstance(e, asyncio.TimeoutError) else e)
+                if retry and not enable_auto_zrem:
+                    settled.add(item)
+                    await asyncio.shield(self.fail_delayed(delayed, item, *retry))
+                    return
+                if not release_lock_when_error:
+                    return
+        if not enable_auto_zrem:
+            settled.add(item)
+            await asyncio.shield(self.__ack(delayed, queue, item, enable_queue))
+
+    async def __ack(self, delayed: str, queue: str, item: str, enable_queue: bool):
+        # At least once 最少消费一次
+        if await self.ack_delayed(delayed, item) and enable_queue:
+            await self.rpush(self.__queue_key(queue), item)
+
+    async def poll_queue(self, callbacks: Dict[str, Callable] = {}, delayed: str = KEY_PREFIX + 'delayed:default', enable_auto_zrem: bool = False, enable_queue: bool = False, release_lock_when_error: bool = True, delayed_logger: Optional[logging.Logger] = None, batch_size: int = 100, concurrency: int = 100, task_timeout: Optional[float] = None, drain_timeout: Optional[float] = 30, max_wait: float = 1, shards: int = 1, shard_ids: Optional[List[int]] = None, max_attempts: Optional[int] = None, retry_backoff: float = 1, retry_backoff_max: float = 3600, visibility_timeout: Optional[float] = None, priorities: Optional[List[int]] = None, priority_weights: Optional[Dict[int, float]] = None, priority_aging: Optional[float] = None, handle_signals: bool = False):
+        """
+        Consumer of delay execute, runs at most ``concurrency`` callbacks at once in the running event loop.
+
+        Coroutine function callbacks are awaited, others run in the default executor.
+
+        ``enable_auto_zrem``, ``enable_queue``, ``release_lock_when_error`` and ``batch_size`` as ``RedisExtensions.poll_queue``.
+
+        ``task_timeout`` indicates seconds after which a callback is cancelled and handled as failed.
+
+        Stopped by ``stop``, callbacks in flight are waited up to ``drain_timeout`` seconds. When cancelled, coroutine
+        callbacks in flight are cancelled, and their items requeued for at least once. Blocking callbacks can't be
+        interrupted, their items are left in flight, requeued by ``visibility_timeout``.
+
+        ``handle_signals`` if set to True, also stopped by ``SIGTERM``/``SIGINT``, handled by the event loop until returned,
+        instead of handlers of the host application, which are restored then. Off by default, the host application owns signals.
+
+        ``max_wait`` indicates the maximum seconds sleeping when nothing is due, woken up early by ``execute_later``.
+
+        ``shards``, ``shard_ids``, ``max_attempts``, ``retry_backoff``, ``retry_backoff_max``, ``visibility_timeout``,
+        ``priorities``, ``priority_weights`` and ``priority_aging`` as ``RedisExtensions.poll_queue``.
+        """
+        loop = asyncio.get_running_loop()
+        signums = {}  # type: Dict[int, Any]
+        for signum in [signal.SIGINT, signal.SIGTERM] if handle_signals else []:
+            try:
+                previous = signal.getsignal(signum)
+                loop.add_signal_handler(signum, self.stop)
+                signums[signum] = previous
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not main thread, or not supported by the event loop
+                pass
+
+        final_logger = delayed_logger or logger
+        delayeds = delayed_shard_keys(delayed, shards, shard_ids)
+        tasks = {}  # type: Dict[asyncio.Task, str]
+        settled = set()  # type: Set[str]
+        retry = (max_attempts, retry_backoff, retry_backoff_max, priorities) if max_attempts else None
+
+        def consume(item: str) -> asyncio.Task:
+            callback = callbacks.get(json.loads(item)[1])
+            task = asyncio.ensure_future(self.__consume(delayed, shards, item, callback, enable_auto_zrem, enable_queue, release_lock_when_error, task_timeout, final_logger, retry, settled))
+            tasks[task] = item
+            task.add_done_callback(lambda t: settled.discard(tasks.pop(t, None)))
+            return task
+
+        # Round-robin over shards, sleep only when none is due
+        cursor, idles, next_dues = 0, 0, []
+        try:
+            while self.poll_queue_continue_flag:
+                # Backpressure, claim no more than can be started
+                claim_size = min(batch_size, concurrency - len(tasks))
+                if claim_size <= 0:
+                    await asyncio.wait(list(tasks), return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                items, next_due = await self.claim_delayed(delayeds[cursor], batch_size=claim_size, inflight=not enable_auto_zrem, with_next_due=True, visibility_timeout=visibility_timeout, max_attempts=max_attempts, priorities=priorities, priority_weights=priority_weights, priority_aging=priority_aging)
+                cursor = (cursor + 1) % len(delayeds)
+                if not items:
+                    idles += 1
+                    if next_due is not None:
+                        next_dues.append(next_due)
+                    if idles >= len(delayeds):
+                        # Sleep until the head is due, instead of polling
+                        await self.wait_delayed(delayeds, next_due=min(next_dues) if next_dues else None, max_wait=max_wait)
+                        idles, next_dues = 0, []
+                    continue
+                idles, next_dues = 0, []
+                if enable_auto_zrem and enable_queue:
+                    pipe = self.pipeline(transaction=False)
+                    for item in items:
+                        pipe.rpush(self.__queue_key(json.loads(item)[1]), item)
+                    await pipe.execute()
+                for item in items:
+                    consume(item)
+            # Graceful drain
+            if tasks:
+                await asyncio.wait(list(tasks), timeout=drain_timeout)
+        finally:
+            for signum, previous in signums.items():
+                loop.remove_signal_handler(signum)
+                # Handlers of the host application back, instead of the defaults
+                if previous is not None:
+                    signal.signal(signum, previous)
+            await self.__cancel_wakeups()
+            await self.__cancel(delayed, shards, tasks, settled, enable_auto_zrem, priorities)
+
+    async def __cancel(self, delayed: str, shards: int, tasks: Dict[asyncio.Task, str], settled: Set[str], enable_auto_zrem: bool, priorities: Optional[List[int]]):
+        if not tasks:
+            return
+        pending = dict(tasks)  # type: Dict[asyncio.Task, str]
+        # Only items not started, or awaiting coroutine callbacks, are requeued
+        unsettled = {item for item in pending.values() if item not in settled}
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        cancelled = [item for task, item in pending.items() if task.cancelled() and item in unsettled]  # type: List[str]
+        if not cancelled or enable_auto_zrem:
+            return
+        sharded = {}  # type: Dict[str, List[str]]
+        for item in cancelled:
+            sharded.setdefault(delayed_item_key(delayed, shards, json.loads(item)[0]), []).append(item)
+        for key, shard_items in sharded.items():
+            await asyncio.shield(self.nack_delayed(key, *shard_items, priorities=priorities))
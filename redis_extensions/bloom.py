@@ -0,0 +1,267 @@
+import hashlib
+import math
+import threading
+import time as mod_time
+from typing import Any, Iterable, List, Optional, Tuple, Union
+
+from redis.client import NEVER_DECODE
+
+from .extensions import KEY_PREFIX, logger
+
+
+def bloom_size(capacity: int, error_rate: float) -> Tuple[int, int]:
+    """
+    Return ``(bits, hashes)`` of a Bloom filter holding ``capacity`` items at ``error_rate`` false positives.
+    """
+    if capacity <= 0 or not 0 < error_rate < 1:
+        raise ValueError('The capacity argument should be positive and error_rate between 0 and 1')
+    bits = int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+    # Round up to whole bytes, the bitmap is shared with Redis as a string
+    bits = (bits + 7) // 8 * 8
+    return bits, max(int(round(bits / capacity * math.log(2))), 1)
+
+
+def bloom_positions(value: Union[str, bytes, int], bits: int, hashes: int) -> List[int]:
+    # Double hashing, ``h1 + i * h2``, from one md5 digest
+    if not isinstance(value, bytes):
+        value = str(value).encode('utf-8')
+    digest = hashlib.md5(value).digest()
+    h1, h2 = int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+    return [(h1 + i * h2) % bits for i in range(hashes)]
+
+
+class BloomFilter(object):
+    """
+    Process-local Bloom filter, ``in`` returns False when definitely absent, True when probably present.
+
+    Bits are laid out like Redis ``SETBIT`` offsets, so ``to_bytes`` and ``from_bytes`` exchange with ``RedisBloomFilter``.
+    """
+
+    def __init__(self, capacity: int = 100000, error_rate: float = 0.001):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits, self.hashes = bloom_size(capacity, error_rate)
+        self.bitmap = bytearray(self.bits // 8)
+
+    def add(self, *values: Any):
+        for value in values:
+            for pos in bloom_positions(value, self.bits, self.hashes):
+                self.bitmap[pos >> 3] |= 0x80 >> (pos & 7)
+
+    def __contains__(self, value: Any) -> bool:
+        return all(self.bitmap[pos >> 3] & (0x80 >> (pos & 7)) for pos in bloom_positions(value, self.bits, self.hashes))
+
+    def to_bytes(self) -> bytes:
+        return bytes(self.bitmap)
+
+    @classmethod
+    def from_bytes(cls, data: bytes, capacity: int = 100000, error_rate: float = 0.001) -> 'BloomFilter':
+        bloom = cls(capacity=capacity, error_rate=error_rate)
+        # Missing trailing bytes are zero bits, as Redis ``GET`` of a bitmap never set that far
+        bloom.bitmap[:len(data)] = data[:len(bloom.bitmap)]
+        return bloom
+
+
+class RedisBloomFilter(object):
+    """
+    Bloom filter stored as a Redis bitmap, shared across processes.
+
+    Adds and checks of many values are a single ``BITFIELD`` command each.
+
+    Usage::
+
+        bloom = r.bloom_filter('seen', capacity=1000000, error_rate=0.001)
+        bloom.add('a', 'b')
+        'a' in bloom
+    """
+
+    def __init__(self, redis: Any, name: str, capacity: int = 100000, error_rate: float = 0.001):
+        self.redis = redis
+        self.name = name
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.bits, self.hashes = bloom_size(capacity, error_rate)
+        self.key = '{0}bloom:{1}'.format(KEY_PREFIX, name)
+
+    def add(self, *values: Any) -> int:
+        """
+        Add ``values``, return the number of values not probably present before.
+        """
+        if not values:
+            return 0
+        op = self.redis.bitfield(self.key)
+        for value in values:
+            for pos in bloom_positions(value, self.bits, self.hashes):
+                op.set('u1', pos, 1)
+        olds = op.execute()
+        return sum(not all(olds[i * self.hashes:(i + 1) * self.hashes]) for i in range(len(values)))
+
+    def contains_many(self, values: Iterable[Any]) -> List[bool]:
+        values = list(values)
+        if not values:
+            return []
+        items = [('u1', pos) for value in values for pos in bloom_positions(value, self.bits, self.hashes)]
+        bits = self.redis.bitfield_ro(self.key, items[0][0], items[0][1], items=items[1:])
+        return [all(bits[i * self.hashes:(i + 1) * self.hashes]) for i in range(len(values))]
+
+    def __contains__(self, value: Any) -> bool:
+        return self.contains_many([value])[0]
+
+    def snapshot(self) -> BloomFilter:
+        """
+        Return a process-local copy, checked without round trips.
+        """
+        data = self.redis.execute_command('GET', self.key, **{NEVER_DECODE: True}) or b''
+        return BloomFilter.from_bytes(data, capacity=self.capacity, error_rate=self.error_rate)
+
+    def store(self, bloom: BloomFilter, time: Optional[int] = None) -> bool:
+        """
+        Replace the bitmap by a process-local ``bloom`` of the same size, ``time`` indicates expire seconds.
+        """
+        if (bloom.bits, bloom.hashes) != (self.bits, self.hashes):
+            raise ValueError('The bloom filter should have the same capacity and error_rate')
+        return self.redis.set(self.key, bloom.to_bytes(), ex=time)
+
+    def clear(self) -> int:
+        return self.redis.delete(self.key)
+
+
+class SetBloomCache(object):
+    """
+    Process-local Bloom filter snapshot of the Redis set ``key``, for membership checks which are mostly negative.
+
+    ``might_contain`` returns False without a round trip when the member is definitely absent from the snapshot,
+    only probable positives need to be confirmed against Redis.
+
+    The snapshot is rebuilt by ``SSCAN`` every ``refresh_interval`` seconds, lazily on check, in a background thread
+    while the stale one is served. Members added after that are missed until the next rebuild, unless published on
+    ``channel``, which are added to the snapshot immediately.
+
+    ``shared`` indicates a ``RedisBloomFilter`` the snapshot is loaded from if it exists, else stored to after rebuild,
+    so only one process scans the set per ``shared_time`` seconds. Published members are added into it too, by every
+    subscribed process, so snapshots loaded later don't miss them.
+    """
+
+    def __init__(self, redis: Any, key: str, capacity: int = 100000, error_rate: float = 0.001, refresh_interval: float = 60, channel: Optional[str] = None, shared: Optional[RedisBloomFilter] = None, shared_time: Optional[int] = None, scan_count: int = 1000):
+        self.redis = redis
+        self.key = key
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.refresh_interval = refresh_interval
+        self.channel = channel
+        self.shared = shared
+        # Whole seconds of ``SET EX``, at least 1
+        self.shared_time = shared_time or max(int(math.ceil(refresh_interval)), 1)
+        self.scan_count = scan_count
+        self.bloom = None
+        self.refreshed_at = 0
+        # Guards ``bloom`` & ``__pending``, values added without a snapshot or while rebuilding, replayed into the new one
+        self.__lock = threading.Lock()
+        self.__pending = []  # type: List[Any]
+        self.__building = False
+        self.__rebuild = threading.Lock()
+        self.__refreshing = threading.Lock()
+        self.__pubsub = None
+        self.__thread = None
+        if channel:
+            self.__pubsub = redis.pubsub(ignore_subscribe_messages=True)
+            self.__pubsub.subscribe(**{channel: self.__notified})
+            self.__thread = self.__pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def __notified(self, message: dict):
+        self.add(message['data'])
+        if self.shared:
+            self.shared.add(message['data'])
+
+    def __build(self) -> BloomFilter:
+        if self.shared:
+            bloom = self.shared.snapshot()
+            if any(bloom.bitmap):
+                return bloom
+            bloom = BloomFilter(capacity=self.shared.capacity, error_rate=self.shared.error_rate)
+        else:
+            # Grow with the set, keeps the false positive rate below ``error_rate``
+            bloom = BloomFilter(capacity=max(self.capacity, self.redis.scard(self.key) * 2), error_rate=self.error_rate)
+        for member in self.redis.sscan_iter(self.key, count=self.scan_count):
+            bloom.add(member)
+        if self.shared:
+            self.shared.store(bloom, time=self.shared_time)
+        return bloom
+
+    def __stale(self) -> bool:
+        return self.bloom is None or mod_time.monotonic() - self.refreshed_at >= self.refresh_interval
+
+    def refresh(self, force: bool = True) -> BloomFilter:
+        """
+        Rebuild the snapshot now, the previous one is served to other threads meanwhile.
+
+        ``force`` if set to False, will only rebuild if still stale after waiting for another rebuild.
+        """
+        with self.__rebuild:
+            if not force and not self.__stale():
+                return self.bloom
+            with self.__lock:
+                self.__building = True
+            try:
+                bloom = self.__build()
+            except Exception:
+                with self.__lock:
+                    self.__building = False
+                    if self.bloom is not None:
+                        self.__pending = []
+                raise
+            with self.__lock:
+                # Added after the scan missed them, or before it but to a stale shared snapshot
+                bloom.add(*self.__pending)
+                self.__pending, self.__building = [], False
+                self.bloom, self.refreshed_at = bloom, mod_time.monotonic()
+        return bloom
+
+    def __refresh_in_background(self):
+        # At most one rebuild in flight, instead of one per checking thread
+        if not self.__refreshing.acquire(blocking=False):
+            return
+
+        def run():
+            try:
+                self.refresh(force=False)
+            except Exception as e:
+                logger.warning('Refreshing bloom cache of {0} failed: {1}'.format(self.key, e))
+            finally:
+                self.__refreshing.release()
+
+        threading.Thread(target=run, name='bloom-cache-refresh', daemon=True).start()
+
+    def add(self, *values: Any):
+        """
+        Add ``values`` to the local snapshot, call after adding them to the set.
+        """
+        with self.__lock:
+            if self.bloom is None or self.__building:
+                self.__pending.extend(values)
+            if self.bloom is not None:
+                self.bloom.add(*values)
+
+    def might_contain(self, value: Any) -> bool:
+        bloom = self.bloom
+        if bloom is None:
+            try:
+                bloom = self.refresh(force=False)
+            except Exception as e:
+                # Fail open, a missing snapshot just falls through to Redis
+                logger.warning('Refreshing bloom cache of {0} failed: {1}'.format(self.key, e))
+                return True
+        elif self.__stale():
+            # Serve the stale snapshot meanwhile
+            self.__refresh_in_background()
+        return value in bloom
+
+    def close(self):
+        if self.__thread:
+            self.__thread.stop()
+            # Wait for ``get_message`` to return, before closing the connection under it
+            self.__thread.join(timeout=2)
+            self.__thread = None
+        if self.__pubsub:
+            self.__pubsub.close()
+            self.__pubsub = None
@@ -0,0 +1,56 @@
+import threading
+import time as mod_time
+from collections import OrderedDict
+from typing import Any, Callable, Hashable, Optional
+
+
+class LocalCache(object):
+    """
+    Thread-safe process-local LRU cache, entries expire after ``ttl`` seconds.
+    """
+
+    def __init__(self, maxsize: int = 10000, ttl: float = 5):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.__lock = threading.Lock()
+        self.__data = OrderedDict()
+
+    def get(self, key: Hashable, default: Optional[Any] = None) -> Any:
+        with self.__lock:
+            item = self.__data.get(key)
+            if item is None:
+                return default
+            if item[1] <= mod_time.monotonic():
+                del self.__data[key]
+                return default
+            self.__data.move_to_end(key)
+            return item[0]
+
+    def set(self, key: Hashable, value: Any, ttl: Optional[float] = None):
+        with self.__lock:
+            self.__data[key] = (value, mod_time.monotonic() + (self.ttl if ttl is None else ttl))
+            self.__data.move_to_end(key)
+            while len(self.__data) > self.maxsize:
+                self.__data.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, func: Callable[[], Any]) -> Any:
+        """
+        Return the cached value of ``key``, or call ``func`` and cache its result on miss.
+        """
+        marker = object()
+        value = self.get(key, marker)
+        if value is marker:
+            value = func()
+            self.set(key, value)
+        return value
+
+    def delete(self, key: Hashable):
+        with self.__lock:
+            self.__data.pop(key, None)
+
+    def clear(self):
+        with self.__lock:
+            self.__data.clear()
+
+    def __len__(self) -> int:
+        return len(self.__data)
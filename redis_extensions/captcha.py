@@ -0,0 +1,109 @@
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, List, Optional
+
+from .extensions import KEY_PREFIX, logger, render_gvcode
+
+
+class GvcodePool(object):
+    """
+    Background maintainer of the graphic verification codes pool, keeps its size between ``low`` and ``high``.
+
+    Codes are rendered in a ``ProcessPoolExecutor`` of ``workers`` processes, off the request path and the GIL,
+    and added by pipelined ``SADD`` of ``chunk_size`` codes. The pool size is checked every ``interval`` seconds,
+    when below ``low`` it's filled up to ``high``.
+
+    Request handlers then only ``SRANDMEMBER``, by ``gvcode_b64str(name, refresh=False)``.
+
+    Usage::
+
+        pool = r.gvcode_pool(low=1000, high=5000)
+        pool.start()
+        ...
+        pool.stop()
+    """
+
+    def __init__(self, redis: Any, low: int = 100, high: int = 1000, chunk_size: int = 100, workers: Optional[int] = None, interval: float = 1):
+        if not 0 <= low < high:
+            raise ValueError('The low and high arguments should be 0 <= low < high')
+        if chunk_size <= 0:
+            raise ValueError('The chunk_size argument should be positive')
+        self.redis = redis
+        self.low = low
+        self.high = high
+        self.chunk_size = chunk_size
+        self.workers = workers
+        self.interval = interval
+        self.key = '{0}graphic:vcode'.format(KEY_PREFIX)
+        self.__executor = None
+        self.__thread = None
+        self.__stopped = threading.Event()
+
+    def fill(self, num: int) -> int:
+        """
+        Render ``num`` codes in the worker processes and add them into the pool, return the number added.
+        """
+        if num <= 0:
+            return 0
+        executor = self.__executor or ProcessPoolExecutor(max_workers=self.workers)
+        added = 0
+        try:
+            gvcodes = executor.map(render_gvcode, range(num), chunksize=max(num // ((self.workers or 4) * 4), 1))
+            pipe = self.redis.pipeline(transaction=False)
+            chunk = []  # type: List[bytes]
+            for s in gvcodes:
+                chunk.append(s)
+                if len(chunk) >= self.chunk_size:
+                    pipe.sadd(self.key, *chunk)
+                    chunk = []
+                    # Flush every 10 chunks, bounds the pipeline buffer
+                    if len(pipe) >= 10:
+                        added += sum(pipe.execute())
+            if chunk:
+                pipe.sadd(self.key, *chunk)
+            added += sum(pipe.execute())
+        finally:
+            if executor is not self.__executor:
+                executor.shutdown()
+        return added
+
+    def maintain(self) -> int:
+        """
+        Fill up to ``high`` once if the pool is below ``low``, return the number added.
+        """
+        size = self.redis.scard(self.key)
+        if size >= self.low:
+            return 0
+        return self.fill(self.high - size)
+
+    def __run(self):
+        while not self.__stopped.is_set():
+            try:
+                self.maintain()
+            except Exception as e:
+                logger.error('Maintaining gvcode pool failed: {0}'.format(e))
+            self.__stopped.wait(self.interval)
+
+    def start(self) -> 'GvcodePool':
+        if self.__thread:
+            return self
+        self.__stopped.clear()
+        self.__executor = ProcessPoolExecutor(max_workers=self.workers)
+        self.__thread = threading.Thread(target=self.__run, name='gvcode-pool', daemon=True)
+        self.__thread.start()
+        return self
+
+    def stop(self, timeout: Optional[float] = None):
+        self.__stopped.set()
+        if self.__thread:
+            self.__thread.join(timeout)
+            self.__thread = None
+        if self.__executor:
+            self.__executor.shutdown()
+            self.__executor = None
+
+    def __enter__(self) -> 'GvcodePool':
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
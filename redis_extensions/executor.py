@@ -0,0 +1,132 @@
+import time as mod_time
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional
+
+from .extensions import logger
+
+
+class DelayedExecutor(object):
+    """
+    Runs delay execute callbacks of ``poll_queue`` in a pool, so one slow callback doesn't stall other due items.
+
+    ``kind`` indicates ``thread`` for I/O-bound callbacks, ``process`` for CPU-bound callbacks, which should be picklable.
+
+    ``max_workers`` indicates the maximum number of callbacks in flight, claiming pauses when reached.
+
+    ``queue_concurrency`` indicates the maximum number of callbacks in flight per queue, ``max_workers`` if not set.
+
+    ``task_timeout`` indicates seconds after which a running callback is handled as failed. Callbacks can't be
+    interrupted, it keeps its worker until returning.
+
+    ``finish`` is called with ``(item, queue, ok)`` in the polling thread when a callback returned, raised or timed out.
+    """
+
+    def __init__(self, finish: Callable[[str, str, bool], Any], kind: str = 'thread', max_workers: int = 10, queue_concurrency: Optional[Dict[str, int]] = None, task_timeout: Optional[float] = None, final_logger: Optional[Any] = None):
+        if kind not in ('thread', 'process'):
+            raise ValueError('The kind argument should be one of thread, process')
+        if max_workers <= 0:
+            raise ValueError('The max_workers argument should be positive')
+        self.finish = finish
+        self.kind = kind
+        self.max_workers = max_workers
+        self.queue_concurrency = queue_concurrency or {}
+        self.task_timeout = task_timeout
+        self.logger = final_logger or logger
+        self.executor = (ThreadPoolExecutor if kind == 'thread' else ProcessPoolExecutor)(max_workers=max_workers)
+        self.pending = []
+        self.running = {}
+        self.timed_out = set()
+        self.counts = defaultdict(int)
+        # Runs ``wakeup`` of ``wait``, at most one at once
+        self.waker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='delayed-wakeup')
+        self.waking = None  # type: Optional[Future]
+
+    def capacity(self) -> int:
+        """
+        Return the number of items which can be claimed, claimed items wait for a worker otherwise.
+        """
+        return max(self.max_workers - len(self.running) - len(self.pending), 0)
+
+    def submit(self, item: str, queue: str, callback: Callable, name: str, args: Any):
+        self.pending.append((item, queue, callback, name, args))
+        self.__start()
+
+    def __start(self):
+        # In claimed order, items of queues at their concurrency limit wait
+        for entry in list(self.pending):
+            if len(self.running) >= self.max_workers:
+                break
+            item, queue, callback, name, args = entry
+            if self.counts[queue] >= self.queue_concurrency.get(queue, self.max_workers):
+                continue
+            self.pending.remove(entry)
+            self.counts[queue] += 1
+            self.running[self.executor.submit(callback, name, args)] = (item, queue, mod_time.monotonic())
+
+    def poll(self, timeout: float = 0, waking: Optional[Future] = None) -> int:
+        """
+        Finish returned callbacks and start waiting items, wait up to ``timeout`` seconds for one to return, or ``waking``.
+        """
+        futures = list(self.running) + ([waking] if waking else [])
+        if not futures:
+            if timeout:
+                mod_time.sleep(timeout)
+            return 0
+        done, _ = wait(futures, timeout=timeout, return_when=FIRST_COMPLETED)
+        done.discard(waking)
+        for future in done:
+            item, queue, _ = self.running.pop(future)
+            self.counts[queue] -= 1
+            if future in self.timed_out:
+                self.timed_out.discard(future)
+                continue
+            ok = True
+            try:
+                future.result()
+            except Exception as e:
+                self.logger.error(e)
+                ok = False
+            self.finish(item, queue, ok)
+        if self.task_timeout:
+            now = mod_time.monotonic()
+            for future, (item, queue, started) in self.running.items():
+                if future not in self.timed_out and now - started > self.task_timeout:
+                    self.timed_out.add(future)
+                    self.logger.error('Task timed out after {0} seconds: {1}'.format(self.task_timeout, item))
+                    self.finish(item, queue, False)
+        self.__start()
+        return len(done)
+
+    def wait(self, timeout: float, wakeup: Optional[Callable[[], Any]] = None) -> int:
+        """
+        ``poll``, also returns early when ``wakeup``, e.g. a blocking wait for new due items, returns in a helper thread.
+
+        A ``wakeup`` still running from a previous call is waited on again, instead of started twice. ``timeout`` is
+        bounded by ``task_timeout``, so timed out callbacks are still handled in time.
+        """
+        if wakeup and (self.waking is None or self.waking.done()):
+            self.waking = self.waker.submit(wakeup)
+        if self.task_timeout:
+            timeout = min(timeout, self.task_timeout)
+        return self.poll(timeout=timeout, waking=self.waking if wakeup else None)
+
+    def drain(self, timeout: Optional[float] = None, run_pending: bool = False) -> List[str]:
+        """
+        Wait up to ``timeout`` seconds for callbacks in flight, return items never started.
+
+        ``run_pending`` if set to True, will also start the waiting items, else return them.
+        """
+        unstarted = [] if run_pending else [entry[0] for entry in self.pending]
+        if not run_pending:
+            self.pending = []
+        end = None if timeout is None else mod_time.monotonic() + timeout
+        while (self.running or self.pending) and (end is None or mod_time.monotonic() < end):
+            self.poll(timeout=0.1)
+        if self.running or self.pending:
+            self.logger.warning('Drain timed out, {0} running, {1} waiting'.format(len(self.running), len(self.pending)))
+            unstarted.extend(entry[0] for entry in self.pending)
+            self.pending = []
+        self.executor.shutdown(wait=False)
+        self.waker.shutdown(wait=False)
+        return unstarted
@@ -1,23 +1,34 @@
+import base64
+import calendar
 import datetime
+import hashlib
+import hmac
 import importlib
+import io
 import json
 import logging
 import random
 import re
 import signal
 import socket
+import threading
 import time as mod_time
 import uuid
 import warnings
-from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple, Type, Union
+import zlib
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple, Type, Union
 
 import shortuuid
 from redis import StrictRedis
-from redis.client import bool_ok
+from redis.client import NEVER_DECODE, bool_ok
+from redis.commands.core import Script
 from redis.exceptions import DataError, ResponseError, WatchError
 from redis.typing import AnyKeyT, EncodableT, ExpiryT, FieldT, KeyT, ZScoreBoundT
 from TimeConvert import TimeConvert as tc
 
+from .cache import LocalCache
 from .expires import BaseRedisExpires
 
 
@@ -46,8 +57,432 @@ logger.setLevel(logging.INFO)
 
 
 KEY_PREFIX = 'r:'  # Prefix of redis-extensions used key
+DEDUP_POLICIES = ('keep', 'replace', 'earliest', 'latest')  # Policies of ``execute_later`` with a pending duplicate
 WARNING_LOG = '``{0}`` used, may be very very very slow when keys\' amount very large'  # ``r.keys()`` and ``r.scan_iter()`` not support use
 
+# Lua snippet of server time in milliseconds as ``now``, effects replication for writes after ``TIME``
+SERVER_NOW = """
+redis.replicate_commands()
+local t = redis.call('time')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)"""
+
+# Time series counter buckets, minute buckets in a hash per hour, hour buckets in a hash per day, day buckets in a hash per month
+TIMESERIES_GRANULARITIES = {
+    # granularity: (key time part format, field format, bucket step, default ttl)
+    'minute': ('%Y%m%d%H', '%M', datetime.timedelta(minutes=1), 172800),  # 2 days
+    'hour': ('%Y%m%d', '%H', datetime.timedelta(hours=1), 2678400),  # 31 days
+    'day': ('%Y%m', '%d', datetime.timedelta(days=1), 63244800),  # 2 years
+}
+
+# Keys of a delayed queue in scripts: delayed, inflight, wakeup, attempts, dead, payload, priority[, lanes]
+# Members are items, or compact identifiers with items in the payload hash, both can be in the same queue
+# Members of priority lanes other than 0 (``delayed`` itself) are in ``delayed:priority:<priority>``, with their priority
+# in the priority hash, so retried, nacked and requeued ones go back to their lane. Lanes are only touched if passed
+# in KEYS, members of other lanes are left where they are
+DELAYED_MEMBER_FUNCTIONS = """
+local LANES = {}
+local lane_prefix = KEYS[1] .. ':priority:'
+for i = 8, #KEYS do
+    if string.sub(KEYS[i], 1, #lane_prefix) == lane_prefix then
+        LANES[string.sub(KEYS[i], #lane_prefix + 1)] = KEYS[i]
+    end
+end
+local function identifier_of(member)
+    if string.sub(member, 1, 1) == '[' then
+        return cjson.decode(member)[1]
+    end
+    return member
+end
+local function member_of(item)
+    local identifier = cjson.decode(item)[1]
+    if redis.call('hexists', KEYS[6], identifier) == 1 then
+        return identifier
+    end
+    return item
+end
+local function lane_of(member)
+    -- nil if the lane is not passed
+    local priority = redis.call('hget', KEYS[7], identifier_of(member))
+    if priority then
+        return LANES[priority]
+    end
+    return KEYS[1]
+end
+local function wakeup_if_head(lane, member)
+    if redis.call('zrange', lane, 0, 0)[1] == member then
+        redis.call('lpush', KEYS[3], 1)
+        redis.call('ltrim', KEYS[3], 0, 0)
+    end
+end
+local function items_of(members)
+    -- Payloads of compact members in one HMGET, false if missing
+    local identifiers = {}
+    for _, member in ipairs(members) do
+        if string.sub(member, 1, 1) ~= '[' then
+            identifiers[#identifiers + 1] = member
+        end
+    end
+    local payloads = {}
+    if #identifiers > 0 then
+        local values = redis.call('hmget', KEYS[6], unpack(identifiers))
+        for i, identifier in ipairs(identifiers) do
+            payloads[identifier] = values[i]
+        end
+    end
+    local items = {}
+    for _, member in ipairs(members) do
+        local item = member
+        if string.sub(member, 1, 1) ~= '[' then
+            item = payloads[member]
+        end
+        items[#items + 1] = item
+    end
+    return items
+end"""
+
+# KEYS: ..., lane[, dedup]; ARGV: due, member, identifier, payload or '', priority, dedup ttl, dedup policy
+# Enqueue, with the payload of a compact member and the priority of a non-default lane, wake up a sleeping consumer
+# if the member is the new head of its lane. With a dedup key of a member pending or in flight, enqueue nothing, but
+# reschedule it by the policy, or replace it
+# Return: the identifier enqueued or deduplicated to
+ENQUEUE_DELAYED_SCRIPT = DELAYED_MEMBER_FUNCTIONS + """
+local due = tonumber(ARGV[1])
+if KEYS[9] then
+    local existing = redis.call('get', KEYS[9])
+    if existing and redis.call('zscore', KEYS[2], existing) then
+        return identifier_of(existing)
+    end
+    local lane = existing and lane_of(existing)
+    if existing and not lane and not redis.call('zscore', KEYS[5], existing) and redis.call('hexists', KEYS[7], identifier_of(existing)) == 1 then
+        -- Pending in a lane not passed, neither in flight nor dead but with its priority
+        return identifier_of(existing)
+    end
+    local score = lane and redis.call('zscore', lane, existing)
+    if score then
+        local policy = ARGV[7]
+        if policy == 'keep' or (policy == 'earliest' and tonumber(score) <= due) or (policy == 'latest' and tonumber(score) >= due) then
+            return identifier_of(existing)
+        end
+        if policy ~= 'replace' then
+            redis.call('zadd', lane, due, existing)
+            redis.call('pexpire', KEYS[9], ARGV[6])
+            wakeup_if_head(lane, existing)
+            return identifier_of(existing)
+        end
+        local identifier = identifier_of(existing)
+        redis.call('zrem', lane, existing)
+        redis.call('hdel', KEYS[4], identifier)
+        redis.call('hdel', KEYS[6], identifier)
+        redis.call('hdel', KEYS[7], identifier)
+    end
+    redis.call('set', KEYS[9], ARGV[2], 'px', ARGV[6])
+end
+if ARGV[4] ~= '' then
+    redis.call('hset', KEYS[6], ARGV[3], ARGV[4])
+end
+if ARGV[5] ~= '0' then
+    redis.call('hset', KEYS[7], ARGV[3], ARGV[5])
+end
+redis.call('zadd', KEYS[8], due, ARGV[2])
+wakeup_if_head(KEYS[8], ARGV[2])
+return ARGV[3]"""
+
+# Count a failed attempt of ``member`` removed from inflight, retry it in ``lane`` after exponential backoff, or move it to
+# dead letters after max attempts
+RETRY_DELAYED_FUNCTION = DELAYED_MEMBER_FUNCTIONS + """
+local function retry(member, lane, now, max_attempts, backoff, backoff_max, jitter)
+    local identifier = identifier_of(member)
+    local attempts = redis.call('hincrby', KEYS[4], identifier, 1)
+    if max_attempts > 0 and attempts >= max_attempts then
+        redis.call('hdel', KEYS[4], identifier)
+        redis.call('zadd', KEYS[5], now, member)
+        return 0
+    end
+    -- Equal jitter, half fixed and half random
+    local delay = math.min(backoff * 2 ^ (attempts - 1), backoff_max) * (0.5 + jitter / 2)
+    redis.call('zadd', lane, now + delay, member)
+    wakeup_if_head(lane, member)
+    return attempts
+end"""
+
+# KEYS: ..., lanes by priority descending, ``delayed`` only if none; ARGV: now, batch size, keep in flight flag,
+# visibility timeout, max attempts, aging, [lane weights]
+# Move up to batch size due members out of lanes, into inflight until acked if keep in flight flag is 1
+# Return: {items, due of the earliest head after claiming or nil}
+CLAIM_DELAYED_SCRIPT = RETRY_DELAYED_FUNCTION + """
+local now, batch, visibility, aging = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[4]), tonumber(ARGV[6])
+local lanes = {KEYS[1]}
+if #KEYS > 7 then
+    lanes = {unpack(KEYS, 8)}
+end
+if visibility > 0 then
+    -- Claims of crashed or stuck consumers are visible again, as failed attempts due now
+    for _, member in ipairs(redis.call('zrangebyscore', KEYS[2], '-inf', now - visibility, 'limit', 0, batch)) do
+        local lane = lane_of(member)
+        if lane then
+            redis.call('zrem', KEYS[2], member)
+            retry(member, lane, now, tonumber(ARGV[5]), 0, 0, 0)
+        end
+    end
+end
+local members = {}
+local function take(lane, max, num)
+    if num <= 0 then
+        return
+    end
+    local taken = redis.call('zrangebyscore', lane, '-inf', max, 'limit', 0, num)
+    if #taken > 0 then
+        redis.call('zrem', lane, unpack(taken))
+        for _, member in ipairs(taken) do
+            members[#members + 1] = member
+        end
+    end
+end
+if aging > 0 then
+    -- Against starvation, members of lower lanes overdue for aging seconds first
+    for i = #lanes, 2, -1 do
+        take(lanes[i], now - aging, batch - #members)
+    end
+end
+if #ARGV > 6 then
+    -- Weighted, shares of the batch by lane weights
+    local total = 0
+    for i = 7, #ARGV do
+        total = total + tonumber(ARGV[i])
+    end
+    for i, lane in ipairs(lanes) do
+        take(lane, now, math.min(math.ceil(batch * tonumber(ARGV[6 + i] or 0) / total), batch - #members))
+    end
+end
+-- Strict priority for the rest
+for _, lane in ipairs(lanes) do
+    take(lane, now, batch - #members)
+end
+local items = {}
+if #members > 0 then
+    -- Compact members without payloads are dropped
+    for i, item in ipairs(items_of(members)) do
+        if item then
+            items[#items + 1] = item
+        end
+        if ARGV[3] == '1' and item then
+            redis.call('zadd', KEYS[2], now, members[i])
+        else
+            redis.call('hdel', KEYS[7], identifier_of(members[i]))
+            if item ~= members[i] then
+                redis.call('hdel', KEYS[6], members[i])
+            end
+        end
+    end
+end
+local next_due = false
+for _, lane in ipairs(lanes) do
+    local head = redis.call('zrange', lane, 0, 0, 'withscores')
+    if head[2] and (not next_due or tonumber(head[2]) < tonumber(next_due)) then
+        next_due = head[2]
+    end
+end
+if next_due and tonumber(next_due) <= now then
+    -- More due than claimed, chain wake up another consumer
+    redis.call('lpush', KEYS[3], 1)
+    redis.call('ltrim', KEYS[3], 0, 0)
+end
+return {items, next_due}"""
+
+# ARGV: [items]
+# Remove items from inflight, with their attempts, payloads and priorities
+# Return: the number removed from inflight
+ACK_DELAYED_SCRIPT = DELAYED_MEMBER_FUNCTIONS + """
+local acked = 0
+for _, item in ipairs(ARGV) do
+    local member = member_of(item)
+    acked = acked + redis.call('zrem', KEYS[2], member)
+    redis.call('hdel', KEYS[4], identifier_of(member))
+    redis.call('hdel', KEYS[7], identifier_of(member))
+    if member ~= item then
+        redis.call('hdel', KEYS[6], member)
+    end
+end
+return acked"""
+
+# KEYS: ..., lanes; ARGV: due, [items]
+# Move items still in flight back to their lanes, due at due, never the acked, dead or reclaimed ones
+# Return: the number removed from inflight
+NACK_DELAYED_SCRIPT = DELAYED_MEMBER_FUNCTIONS + """
+local nacked = 0
+for i = 2, #ARGV do
+    local member = member_of(ARGV[i])
+    local lane = lane_of(member)
+    if lane and redis.call('zrem', KEYS[2], member) == 1 then
+        redis.call('zadd', lane, ARGV[1], member)
+        nacked = nacked + 1
+    end
+end
+if nacked > 0 then
+    -- Wake up sleeping consumers, instead of after max wait
+    redis.call('lpush', KEYS[3], 1)
+    redis.call('ltrim', KEYS[3], 0, 0)
+end
+return nacked"""
+
+# KEYS: ..., lanes; ARGV: item, now, max attempts, backoff, backoff max, jitter
+# Return: -1 if not in flight or its lane not passed, 0 if dead, else attempts
+FAIL_DELAYED_SCRIPT = RETRY_DELAYED_FUNCTION + """
+local member = member_of(ARGV[1])
+local lane = lane_of(member)
+if not lane or redis.call('zrem', KEYS[2], member) == 0 then
+    return -1
+end
+return retry(member, lane, tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4]), tonumber(ARGV[5]), tonumber(ARGV[6]))"""
+
+# ARGV: start, end
+# Return: {items, scores}
+DEAD_LETTERS_SCRIPT = DELAYED_MEMBER_FUNCTIONS + """
+local members = redis.call('zrange', KEYS[5], ARGV[1], ARGV[2], 'withscores')
+local items, scores = {}, {}
+for i = 1, #members, 2 do
+    items[#items + 1] = members[i]
+    scores[#scores + 1] = members[i + 1]
+end
+return {items_of(items), scores}"""
+
+# KEYS: ..., lanes; ARGV: now, count, [items]
+# Move ``items`` or the first count dead letters back to their lanes, due now, with attempts reset
+REPLAY_DEAD_SCRIPT = DELAYED_MEMBER_FUNCTIONS + """
+local members = {}
+if #ARGV > 2 then
+    for i = 3, #ARGV do
+        members[#members + 1] = member_of(ARGV[i])
+    end
+else
+    members = redis.call('zrange', KEYS[5], 0, tonumber(ARGV[2]) - 1)
+end
+local replayed = 0
+for _, member in ipairs(members) do
+    local lane = lane_of(member)
+    if lane and redis.call('zrem', KEYS[5], member) == 1 then
+        redis.call('zadd', lane, ARGV[1], member)
+        redis.call('hdel', KEYS[4], identifier_of(member))
+        replayed = replayed + 1
+    end
+end
+if replayed > 0 then
+    redis.call('lpush', KEYS[3], 1)
+    redis.call('ltrim', KEYS[3], 0, 0)
+end
+return replayed"""
+
+# KEYS: ..., lanes; ARGV: claimed before
+# Move in flight members claimed before back to their lanes, due at their claimed time
+# Return: the number requeued
+REQUEUE_INFLIGHT_SCRIPT = DELAYED_MEMBER_FUNCTIONS + """
+local members = redis.call('zrangebyscore', KEYS[2], '-inf', ARGV[1], 'withscores')
+local requeued = 0
+for i = 1, #members, 2 do
+    local lane = lane_of(members[i])
+    if lane then
+        redis.call('zrem', KEYS[2], members[i])
+        redis.call('zadd', lane, members[i + 1], members[i])
+        requeued = requeued + 1
+    end
+end
+return requeued"""
+
+
+def delayed_shard_keys(delayed: str, shards: int = 1, shard_ids: Optional[List[int]] = None) -> List[str]:
+    """
+    Return keys of ``delayed`` sharded into ``shards``, only of ``shard_ids`` if set.
+    """
+    if shards <= 1:
+        return [delayed]
+    # Hash tagged, keys of a shard (with ``:inflight`` & ``:wakeup``) are in the same cluster slot, shards spread
+    return ['{{{0}:{1}}}'.format(delayed, shard) for shard in (range(shards) if shard_ids is None else shard_ids)]
+
+
+def _hash_tag_groups(keys: List[str]) -> List[List[str]]:
+    # Keys grouped by hash tag, in order, keys of a group are in the same cluster slot
+    groups = OrderedDict()  # type: Dict[str, List[str]]
+    for key in keys:
+        start = key.find('{')
+        end = key.find('}', start + 1) if start >= 0 else -1
+        groups.setdefault(key[start + 1:end] if end > start + 1 else key, []).append(key)
+    return list(groups.values())
+
+
+def delayed_item_key(delayed: str, shards: int, identifier: str) -> str:
+    """
+    Return the key of the ``delayed`` shard which item ``identifier`` is hashed into.
+    """
+    if shards <= 1:
+        return delayed
+    return delayed_shard_keys(delayed, shards, [zlib.crc32(identifier.encode('utf-8')) % shards])[0]
+
+
+def _delayed_identifier(short_uuid: bool, shards: int = 1, dedup_key: Optional[str] = None) -> str:
+    # With a dedup key, identifiers hashed into the shard of the dedup key, so duplicates meet in one shard
+    while True:
+        identifier = shortuuid.uuid() if short_uuid else uuid.uuid4().hex
+        if not dedup_key or shards <= 1 or zlib.crc32(identifier.encode('utf-8')) % shards == zlib.crc32(dedup_key.encode('utf-8')) % shards:
+            return identifier
+
+
+def _delayed_dedup(dedup_key: Optional[str], dedup_ttl: Optional[float], dedup_policy: str, delay: float) -> List[Any]:
+    # ARGV of dedup ttl in milliseconds & policy
+    if dedup_policy not in DEDUP_POLICIES:
+        raise ValueError('The dedup_policy argument should be one of {0}'.format(', '.join(DEDUP_POLICIES)))
+    if dedup_key and delay <= 0:
+        # Never delayed, nothing pending to deduplicate against
+        raise ValueError('The dedup_key argument should be used with a positive delay')
+    return [int((delay + 3600 if dedup_ttl is None else dedup_ttl) * 1000), dedup_policy] if dedup_key else []
+
+
+def delayed_lane_key(delayed: str, priority: int = 0) -> str:
+    """
+    Return the key of the ``priority`` lane of ``delayed``, ``delayed`` itself for priority 0.
+    """
+    if not priority:
+        return delayed
+    return '{0}:priority:{1}'.format(delayed, priority)
+
+
+def _delayed_lanes(delayed: str, priorities: Optional[List[int]], weights: Optional[Dict[int, float]]) -> Tuple[List[str], List[float]]:
+    # Lane keys by priority descending, with their weights if weighted
+    if not priorities:
+        return [], []
+    priorities = sorted(set(priorities), reverse=True)
+    if weights and (any(weight < 0 for weight in weights.values()) or not sum(weights.get(priority, 0) for priority in priorities)):
+        raise ValueError('The priority_weights argument should be non-negative, and positive for some priorities')
+    return [delayed_lane_key(delayed, priority) for priority in priorities], [weights.get(priority, 0) for priority in priorities] if weights else []
+
+
+def _delayed_chunks(tasks: Iterable[Sequence[Any]], delayed: str, chunk_size: int, short_uuid: bool, shards: int, compact: bool) -> Iterator[Tuple[List[str], Dict[str, Dict[str, str]], Dict[Tuple[str, str], Dict[str, float]], Dict[str, List[str]]]]:
+    # Serialize ``(queue, name[, args[, delay[, priority]]])`` tasks lazily, into chunks of
+    # ``(identifiers, {payload or priority key: {identifier: value}}, {(shard key, lane key): {member: due}}, {queue: [item]})``
+    if chunk_size <= 0:
+        raise ValueError('The chunk_size argument should be positive')
+    identifiers, hsets, zadds, rpushes = [], {}, {}, {}  # type: List[str], Dict[str, Dict[str, str]], Dict[Tuple[str, str], Dict[str, float]], Dict[str, List[str]]
+    for task in tasks:
+        task = tuple(task)
+        # Defaults of the omitted optional ``args``, ``delay`` and ``priority``
+        queue, name, args, delay, priority = task + (None, 0, 0)[len(task) - 2:]
+        identifier = _delayed_identifier(short_uuid)
+        item = json.dumps([identifier, queue, name, args])
+        if delay > 0:
+            key = delayed_item_key(delayed, shards, identifier)
+            zadds.setdefault((key, delayed_lane_key(key, priority)), {})[identifier if compact else item] = mod_time.time() + delay
+            if compact:
+                hsets.setdefault('{0}:payload'.format(key), {})[identifier] = item
+            if priority:
+                hsets.setdefault('{0}:priority'.format(key), {})[identifier] = priority
+        else:
+            rpushes.setdefault(queue, []).append(item)
+        identifiers.append(identifier)
+        if len(identifiers) >= chunk_size:
+            yield identifiers, hsets, zadds, rpushes
+            identifiers, hsets, zadds, rpushes = [], {}, {}, {}
+    if identifiers:
+        yield identifiers, hsets, zadds, rpushes
+
 
 # Get the local ip
 def get_network_ip() -> str:
@@ -62,6 +497,34 @@ def get_network_ip() -> str:
     return ip
 
 
+def render_gvcode(_: Any = None) -> bytes:
+    """
+    Render a graphic verification code, return it packed as a gvcode pool member.
+    """
+    # Module level, so picklable to the worker processes of ``GvcodePool``
+    im, vcode = gvcode.generate()
+    out = io.BytesIO()
+    im.save(out, format='PNG')
+    return pack_gvcode(out.getvalue(), vcode)
+
+
+def pack_gvcode(png: bytes, vcode: str) -> bytes:
+    # One byte code length, code, raw PNG bytes
+    vcode = vcode.encode('utf-8')
+    return bytes([len(vcode)]) + vcode + png
+
+
+def unpack_gvcode(member: bytes) -> Tuple[bytes, str]:
+    """
+    Return ``(png, vcode)`` of a gvcode pool member, also reads members stored as base64 in JSON by previous versions.
+    """
+    if member[:1] == b'{':
+        legacy = json.loads(member)
+        return base64.b64decode(legacy.get('b64str', '')), legacy.get('vcode', '')
+    length = member[0]
+    return member[1 + length:], member[1:1 + length].decode('utf-8')
+
+
 class RedisExtensions(BaseRedisExpires, StrictRedis):
     """
     Extension of [redis-py](https://github.com/andymccurdy/redis-py)'s StrictRedis.
@@ -74,6 +537,14 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         self.max_timestamp = 9999999999999
         self.timezone = kwargs.pop('timezone', None)
         self.poll_queue_continue_flag = True
+        self.lock_metrics = kwargs.pop('lock_metrics', None)
+        self.__lock_acquired_at = OrderedDict()
+        self.__lock_acquired_at_lock = threading.Lock()
+        self.__wakeups = {}  # type: Dict[Tuple[str, ...], Future]
+        self.__scripts = {}
+        self.token_secret = kwargs.pop('token_secret', None)
+        self.token_version_cache = LocalCache(maxsize=10000, ttl=5)
+        self.vcode_black_list_caches = None
         tc.__init__(timezone=self.timezone)
         super(RedisExtensions, self).__init__(*args, **kwargs)
 
@@ -88,6 +559,15 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
     def __uuid(self, short_uuid: bool = False) -> str:
         return shortuuid.uuid() if short_uuid else uuid.uuid4().hex
 
+    def __seconds(self, time: ExpiryT) -> int:
+        return int(time.total_seconds()) if isinstance(time, datetime.timedelta) else int(time)
+
+    def __script(self, script: str) -> Script:
+        # Registered once, run by ``EVALSHA`` instead of sending the source every call
+        if script not in self.__scripts:
+            self.__scripts[script] = self.register_script(script)
+        return self.__scripts[script]
+
     # Keys Section(Delete Relative)
     def delete_keys(self, pattern: str = '*', iter: bool = False, count: Optional[int] = None) -> int:
         """
@@ -795,15 +1275,37 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         ``time`` sets an expire flag on key ``name`` for ``time`` seconds.
 
         ``acquire_timeout`` indicates retry time of acquiring lock.
+
+        Acquire latency, contention, timeouts and hold durations are reported to ``lock_metrics`` if set.
         """
         identifier = self.__uuid(short)
-        end = mod_time.time() + acquire_timeout
+        start = mod_time.time()
+        end = start + acquire_timeout
+        attempts = 0
         while mod_time.time() < end:
+            attempts += 1
             if self.set(self.__lock_key(name), identifier, ex=time, nx=True):
+                if self.lock_metrics:
+                    self.__lock_acquired(name, identifier, start, attempts)
                 return identifier
             mod_time.sleep(.001)
+        if self.lock_metrics:
+            self.lock_metrics.on_acquire(name, mod_time.time() - start, False, attempts > 1)
         return False
 
+    def __lock_acquired(self, name: str, identifier: str, start: float, attempts: int):
+        now = mod_time.time()
+        self.lock_metrics.on_acquire(name, now - start, True, attempts > 1)
+        # Bounded, locks which are never released expire by themselves
+        with self.__lock_acquired_at_lock:
+            self.__lock_acquired_at[identifier] = now
+            while len(self.__lock_acquired_at) > 10000:
+                self.__lock_acquired_at.popitem(last=False)
+
+    def __lock_released(self, identifier: str) -> Optional[float]:
+        with self.__lock_acquired_at_lock:
+            return self.__lock_acquired_at.pop(identifier, None)
+
     def release_lock(self, name: str, identifier: str) -> bool:
         """
         Release lock for ``name``.
@@ -817,13 +1319,44 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
                     pipe.multi()
                     pipe.delete(lock_key)
                     pipe.execute()
+                    if self.lock_metrics:
+                        acquired_at = self.__lock_released(identifier)
+                        self.lock_metrics.on_release(name, acquired_at and mod_time.time() - acquired_at)
                     return True
                 pipe.unwatch()
                 break
             except WatchError:
                 pass
+        if self.lock_metrics:
+            self.__lock_released(identifier)
+            self.lock_metrics.on_lost(name)
         return False
 
+    def lease_lock(self, name: str, lease: float = 10, renew_interval: Optional[float] = None, acquire_timeout: float = 10, blocking: bool = True, on_lost: Optional[Callable] = None):
+        """
+        Return a context-manager lock for ``name`` with a short ``lease``, renewed by a watchdog thread while held.
+
+        ``on_lost`` a callable called with the lock when ownership was lost.
+        """
+        from .locks import LeaseLock
+        return LeaseLock(self, name, lease=lease, renew_interval=renew_interval, acquire_timeout=acquire_timeout, blocking=blocking, on_lost=on_lost)
+
+    def semaphore(self, name: str, limit: int, lease: float = 10, acquire_timeout: float = 10, blocking: bool = True):
+        """
+        Return a fair distributed counting semaphore for ``name``, at most ``limit`` holders at the same time.
+        """
+        from .locks import Semaphore
+        return Semaphore(self, name, limit, lease=lease, acquire_timeout=acquire_timeout, blocking=blocking)
+
+    def rwlock(self, name: str, lease: float = 10, acquire_timeout: float = 10, blocking: bool = True, renew_interval: Optional[float] = None, on_lost: Optional[Callable] = None):
+        """
+        Return a distributed read-write lock for ``name``, many readers share access, renewed by a watchdog thread while held.
+
+        ``on_lost`` a callable called with the lock and the identifier when ownership was lost.
+        """
+        from .locks import ReadWriteLock
+        return ReadWriteLock(self, name, lease=lease, acquire_timeout=acquire_timeout, blocking=blocking, renew_interval=renew_interval, on_lost=on_lost)
+
     def delete_lock(self, name: str) -> ResponseT:
         """
         Delete lock for ``name``.
@@ -844,10 +1377,14 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         return '{0}quota:{1}'.format(KEY_PREFIX, name)
 
     def __quota(self, quota_key: str, amount: int = 10, time: Optional[ExpiryT] = None) -> bool:
-        num = self.incr(quota_key)
-        if num == 1 and time:
-            self.expire(quota_key, time)
-        return num > amount
+        # INCR & EXPIRE atomically, a key without TTL would block forever
+        quota_script = """
+        local num = redis.call('incr', KEYS[1])
+        if num == 1 and tonumber(ARGV[1]) > 0 then
+            redis.call('expire', KEYS[1], ARGV[1])
+        end
+        return num"""
+        return self.__script(quota_script)(keys=[quota_key], args=[self.__seconds(time or 0)]) > amount
 
     def quota(self, name: str, amount: int = 10, time: Optional[ExpiryT] = None) -> bool:
         """
@@ -855,6 +1392,29 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         """
         return self.__quota(self.__quota_key(name), amount=amount, time=time)
 
+    def rate_limiter(self, name: str, limit: int, period: float, algorithm: str = 'gcra', burst: Optional[int] = None):
+        """
+        Return an atomic rate limiter, at most ``limit`` hits per ``period`` seconds.
+
+        ``algorithm`` one of ``fixed_window``, ``sliding_log``, ``sliding_window`` and ``gcra``.
+        """
+        from .ratelimit import RateLimiter
+        return RateLimiter(self, name, limit, period, algorithm=algorithm, burst=burst)
+
+    def leased_rate_limiter(self, name: str, limit: int, period: float, batch: int = 50, lease_time: float = 1):
+        """
+        Return a rate limiter admitting hits locally from ``batch`` permits leased at a time, see ``LeasedRateLimiter``.
+        """
+        from .ratelimit import LeasedRateLimiter
+        return LeasedRateLimiter(self, name, limit, period, batch=batch, lease_time=lease_time)
+
+    def rate_limit_many(self, checks: List[Tuple[Any, str, int]]) -> List[Any]:
+        """
+        Check multiple ``(limiter, identifier, cost)`` in one round trip, return a list of ``RateLimitResult``.
+        """
+        from .ratelimit import hit_many
+        return hit_many(self, checks)
+
     # Quote/UnQuote Section
     def __quote_key(self, name: str) -> str:
         return '{0}quote:{1}'.format(KEY_PREFIX, name)
@@ -917,6 +1477,112 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
             'delta_days': delta_days,
         }
 
+    # SignIns Section(Bitmap Backend)
+    # Per-user per-year bitmaps ``SETBIT`` by day of year, streak/total/longest kept alongside in a hash, updated atomically
+    def __signin_bitmap_key(self, signname: str, year: int) -> str:
+        return '{0}signin:bitmap:{1}:{2}'.format(KEY_PREFIX, signname, year)
+
+    def __signin_stats_key(self, signname: str) -> str:
+        return '{0}signin:stats:{1}'.format(KEY_PREFIX, signname)
+
+    def __signin_bitmap_date(self, ordinal: Optional[str]) -> datetime.date:
+        return datetime.date.fromordinal(int(ordinal)) if int(ordinal or 0) else datetime.date(1988, 6, 15)
+
+    def __signin_bitmap_status(self, stats: List, signin_date: datetime.date, delta_days: Optional[int] = None) -> Dict[str, Any]:
+        last, days, total, longest = [int(x or 0) for x in stats]
+        last_signin_date = self.__signin_bitmap_date(last)
+        if delta_days is None:
+            delta_days = (signin_date - last_signin_date).days
+        return {
+            'signed_today': last == signin_date.toordinal(),
+            'signin_date': last_signin_date.strftime('%Y-%m-%d'),
+            # Uncontinuous
+            'signin_days': days if (signin_date - last_signin_date).days <= 1 else 0,
+            'signin_total_days': total,
+            'signin_longest_days': longest,
+            'delta_days': delta_days,
+        }
+
+    def signin_bitmap(self, signname: str) -> Dict[str, Any]:
+        """
+        Signin today, atomic and idempotent, return the same dict as ``signin``.
+        """
+        signin_script = """
+        local today = tonumber(ARGV[2])
+        local last = tonumber(redis.call('hget', KEYS[2], 'last') or '0')
+        if redis.call('setbit', KEYS[1], ARGV[1], 1) == 0 and last < today then
+            local days = 1
+            if last == today - 1 then
+                days = tonumber(redis.call('hget', KEYS[2], 'days') or '0') + 1
+            end
+            local longest = math.max(tonumber(redis.call('hget', KEYS[2], 'longest') or '0'), days)
+            redis.call('hincrby', KEYS[2], 'total', 1)
+            redis.call('hset', KEYS[2], 'last', today, 'days', days, 'longest', longest)
+        end
+        local stats = redis.call('hmget', KEYS[2], 'last', 'days', 'total', 'longest')
+        table.insert(stats, last)
+        return stats"""
+        signin_date = tc.local_date()
+        *stats, last = self.__script(signin_script)(keys=[self.__signin_bitmap_key(signname, signin_date.year), self.__signin_stats_key(signname)], args=[signin_date.timetuple().tm_yday - 1, signin_date.toordinal()])
+        return self.__signin_bitmap_status(stats, signin_date, delta_days=(signin_date - self.__signin_bitmap_date(last)).days)
+
+    def signin_bitmap_status(self, signname: str) -> Dict[str, Any]:
+        return self.signin_bitmap_status_many([signname])[0]
+
+    def signin_bitmap_status_many(self, signnames: List[str]) -> List[Dict[str, Any]]:
+        """
+        Return signin status of multiple ``signnames`` in one round trip.
+        """
+        pipe = self.pipeline(transaction=False)
+        for signname in signnames:
+            pipe.hmget(self.__signin_stats_key(signname), 'last', 'days', 'total', 'longest')
+        signin_date = tc.local_date()
+        return [self.__signin_bitmap_status(stats, signin_date) for stats in pipe.execute()]
+
+    def signin_bitmap_calendar(self, signname: str, year: Optional[int] = None, month: Optional[int] = None) -> List[bool]:
+        """
+        Return whether signed of each day in ``year``-``month``, Default: this month, in one ``BITFIELD`` call.
+        """
+        today = tc.local_date()
+        year, month = year or today.year, month or today.month
+        first = datetime.date(year, month, 1)
+        ndays = calendar.monthrange(year, month)[1]
+        bits = self.bitfield(self.__signin_bitmap_key(signname, year)).get('u{0}'.format(ndays), first.timetuple().tm_yday - 1).execute()[0]
+        return [bool(bits >> (ndays - 1 - idx) & 1) for idx in range(ndays)]
+
+    def signin_bitmap_year_days(self, signname: str, year: Optional[int] = None) -> int:
+        """
+        Return signin days of ``year``, Default: this year, by ``BITCOUNT``.
+        """
+        return self.bitcount(self.__signin_bitmap_key(signname, year or tc.local_date().year))
+
+    def signin_bitmap_migrate(self, signname: str, delete: bool = False) -> bool:
+        """
+        Migrate ``signin`` JSON record of ``signname`` to the bitmap backend, days of the current streak are marked in bitmaps.
+
+        ``delete`` if set to True, will delete the JSON record after migrated.
+        """
+        name = '{0}signin:info:{1}'.format(KEY_PREFIX, signname)
+        signin_info = self.get_json(name)
+        if not signin_info.get('signin_date'):
+            return False
+        last_signin_date = datetime.datetime.strptime(signin_info['signin_date'], '%Y-%m-%d').date()
+        days = signin_info.get('signin_days', 0)
+        pipe = self.pipeline()
+        for delta in range(days):
+            date = last_signin_date - datetime.timedelta(days=delta)
+            pipe.setbit(self.__signin_bitmap_key(signname, date.year), date.timetuple().tm_yday - 1, 1)
+        pipe.hset(self.__signin_stats_key(signname), mapping={
+            'last': last_signin_date.toordinal(),
+            'days': days,
+            'total': signin_info.get('signin_total_days', 0),
+            'longest': signin_info.get('signin_longest_days', 0),
+        })
+        if delete:
+            pipe.delete(name)
+        pipe.execute()
+        return True
+
     # Token
     def __token_key(self, name: str) -> str:
         return '{0}token:{1}'.format(KEY_PREFIX, name)
@@ -924,7 +1590,46 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
     def __token_buffer_key(self, name: str) -> str:
         return '{0}token:buffer:{1}'.format(KEY_PREFIX, name)
 
-    def token(self, name: str, ex: bool = True, time: int = 1800, buf: bool = True, buf_time: int = 300, short_uuid: bool = True, token_generate_func: Union[type, Callable] = None) -> str:
+    def __token_version_key(self, name: str) -> str:
+        return '{0}token:version:{1}'.format(KEY_PREFIX, name)
+
+    def __token_version(self, name: str) -> int:
+        # Cached process-locally for ``token_version_cache.ttl`` seconds, revocations propagate within it
+        return self.token_version_cache.get_or_set(name, lambda: self.get_int(self.__token_version_key(name)))
+
+    def __token_secret(self) -> bytes:
+        if not self.token_secret:
+            raise ValueError('Signed token should pass `token_secret` when init')
+        return self.token_secret.encode('utf-8') if isinstance(self.token_secret, str) else self.token_secret
+
+    def __token_sign(self, payload: bytes) -> str:
+        secret = self.__token_secret()
+        return base64.urlsafe_b64encode(hmac.new(secret, payload, hashlib.sha256).digest()).rstrip(b'=').decode('ascii')
+
+    def __signed_token(self, name: str, time: Optional[ExpiryT]) -> str:
+        expires = int(mod_time.time()) + self.__seconds(time) if time else 0
+        # Nonce, tokens issued in the same second differ
+        payload = '{0}|{1}|{2}|{3}'.format(name, self.__token_version(name), expires, uuid.uuid4().hex).encode('utf-8')
+        return '{0}.{1}'.format(base64.urlsafe_b64encode(payload).rstrip(b'=').decode('ascii'), self.__token_sign(payload))
+
+    def __signed_token_exists(self, name: str, code: str) -> bool:
+        # Misconfiguration raises as ``token()`` does, not reported as an invalid token
+        self.__token_secret()
+        try:
+            encoded, signature = self.__str(code).rsplit('.', 1)
+            payload = base64.urlsafe_b64decode(encoded + '=' * (-len(encoded) % 4))
+            token_name, version, expires, _ = payload.decode('utf-8').rsplit('|', 3)
+            # Bytes, non-ASCII signatures can't be compared as str
+            signed = hmac.compare_digest(signature.encode('utf-8'), self.__token_sign(payload).encode('utf-8'))
+        except (AttributeError, TypeError, ValueError):
+            return False
+        if not signed or token_name != name:
+            return False
+        if int(expires) and int(expires) < mod_time.time():
+            return False
+        return int(version) == self.__token_version(name)
+
+    def token(self, name: str, ex: bool = True, time: int = 1800, buf: bool = True, buf_time: int = 300, short_uuid: bool = True, token_generate_func: Union[type, Callable] = None, signed: bool = False) -> str:
         """
         Generate token.
 
@@ -937,20 +1642,60 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         ``buf_time`` indicates buffer time of replaced token, which can be represented by an integer or a Python timedelta object, Default: 5 minutes.
 
         ``token_generate_func`` a callable used to generate the token.
+
+        ``signed`` if set to True, will generate HMAC-signed token embedding ``name``, revocation version and expiry,
+        verified locally by ``token_exists(signed=True)``, needs ``token_secret`` when init, ``buf`` is ignored.
         """
+        if signed:
+            return self.__signed_token(name, time if ex else None)
+        # Rotate token & Move previous token into buffer atomically
+        token_script = """
+        local previous = redis.call('get', KEYS[1])
+        if tonumber(ARGV[2]) > 0 then
+            redis.call('set', KEYS[1], ARGV[1], 'ex', ARGV[2])
+        else
+            redis.call('set', KEYS[1], ARGV[1])
+        end
+        if previous and tonumber(ARGV[3]) > 0 then
+            redis.call('set', KEYS[2], previous, 'ex', ARGV[3])
+        end
+        return previous"""
         code = token_generate_func() if token_generate_func else self.__uuid(short_uuid)
-        token_key = self.__token_key(name)
-        buf_code = self.getsetex(token_key, time, code) if ex else self.getset(token_key, code)
-        if buf_code and buf:
-            self.setex(self.__token_buffer_key(name), buf_time, buf_code)
+        self.__script(token_script)(keys=[self.__token_key(name), self.__token_buffer_key(name)], args=[code, self.__seconds(time) if ex else 0, self.__seconds(buf_time) if buf else 0])
         return code
 
-    def token_exists(self, name: str, code: str) -> bool:
+    def token_exists(self, name: str, code: str, signed: bool = False) -> bool:
         """
         Check token code exists or not.
+
+        ``signed`` if set to True, will verify signed token locally, Redis only consulted for the cached revocation version.
         """
+        if signed:
+            return self.__signed_token_exists(name, code)
         return self.__str(code) in self.pipeline().get(self.__token_key(name)).get(self.__token_buffer_key(name)).execute()
 
+    def token_exists_many(self, pairs: List[Tuple[str, str]]) -> List[bool]:
+        """
+        Check token codes of multiple ``(name, code)`` pairs exist or not in one round trip.
+        """
+        if not pairs:
+            return []
+        keys = []
+        for name, _ in pairs:
+            keys.extend([self.__token_key(name), self.__token_buffer_key(name)])
+        codes = self.mget(keys)
+        return [self.__str(code) in codes[2 * idx:2 * idx + 2] for idx, (_, code) in enumerate(pairs)]
+
+    def token_revoke(self, name: str) -> int:
+        """
+        Revoke all signed tokens of ``name`` issued so far, by bumping its version.
+
+        Other processes notice within ``token_version_cache.ttl`` seconds.
+        """
+        version = self.incr(self.__token_version_key(name))
+        self.token_version_cache.delete(name)
+        return version
+
     def token_delete(self, name: str) -> ResponseT:
         """
         Delete token.
@@ -968,57 +1713,202 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         """
         if amount < 0:
             raise ValueError('The amount argument should not be negative')
+        # GET & INCRBY & Limit & EXPIRE atomically
+        counter_script = """
+        local pre_amount = tonumber(redis.call('get', KEYS[1]) or '0')
+        local amount, limit = tonumber(ARGV[1]), tonumber(ARGV[2])
+        if amount == 0 then
+            return {pre_amount, pre_amount}
+        end
+        amount = redis.call('incrby', KEYS[1], amount)
+        if limit > 0 and amount > limit then
+            amount = redis.call('decrby', KEYS[1], amount - limit)
+        end
+        if tonumber(ARGV[3]) > 0 and redis.call('ttl', KEYS[1]) == -1 then
+            redis.call('expire', KEYS[1], ARGV[3])
+        end
+        return {amount, pre_amount}"""
         name = self._counter_key(name, time_part_func=time_part_func)
-        pre_amount = self.get_int(name)
-        if amount == 0:
-            return pre_amount, pre_amount, 0
-        amount = self.incr_limit(name, amount=amount, limit=limit)
-        if amount == 1 and ex:
-            self.expire(name, time)
+        amount, pre_amount = self.__script(counter_script)(keys=[name], args=[amount, limit or 0, self.__seconds(time) if ex else 0])
         return amount, pre_amount, amount - pre_amount
 
-    # Verification Codes Section
-    def __black_list(self, value: str, cate: str = 'phone') -> Union[Awaitable[bool], bool]:
-        black_key = '{0}vcode:{1}:black:list'.format(KEY_PREFIX, cate)
-        return self.sismember(black_key, value)
+    # Counter Section(Time Series)
+    def __timeseries_bucket(self, name: str, granularity: str, dt: datetime.datetime) -> Tuple[str, str]:
+        key_format, field_format, _, _ = TIMESERIES_GRANULARITIES[granularity]
+        return '{0}counter:ts:{1}:{2}:{3}'.format(KEY_PREFIX, name, granularity, dt.strftime(key_format)), dt.strftime(field_format)
+
+    def timeseries_incr(self, name: str, amount: int = 1, ttls: Optional[Dict[str, int]] = None, timestamp: Optional[datetime.datetime] = None) -> Dict[str, int]:
+        """
+        Increment minute/hour/day buckets of ``name`` by ``amount`` in one atomic call, return the new value of each bucket.
+
+        ``ttls`` indicates expire time of each granularity bucket hash, set when the hash is created.
+
+        ``timestamp`` indicates local datetime the buckets are picked by, Default: now.
+        """
+        timeseries_script = """
+        local values = {}
+        for idx, key in ipairs(KEYS) do
+            values[idx] = redis.call('hincrby', key, ARGV[idx * 2], ARGV[1])
+            if redis.call('ttl', key) == -1 then
+                redis.call('expire', key, ARGV[idx * 2 + 1])
+            end
+        end
+        return values"""
+        timestamp = timestamp or tc.local_datetime()
+        keys, args = [], [amount]
+        for granularity, (_, _, _, ttl) in TIMESERIES_GRANULARITIES.items():
+            key, field = self.__timeseries_bucket(name, granularity, timestamp)
+            keys.append(key)
+            args.extend([field, (ttls or {}).get(granularity, ttl)])
+        values = self.__script(timeseries_script)(keys=keys, args=args)
+        return dict(zip(TIMESERIES_GRANULARITIES, values))
+
+    def timeseries_range(self, name: str, start: datetime.datetime, end: datetime.datetime, granularity: str = 'minute') -> List[Tuple[datetime.datetime, int]]:
+        """
+        Return ``(bucket start, value)`` of each ``granularity`` bucket of ``name`` between ``start`` and ``end`` inclusive, in one round trip.
+        """
+        if granularity not in TIMESERIES_GRANULARITIES:
+            raise ValueError('Granularity should be one of {0}'.format(', '.join(TIMESERIES_GRANULARITIES)))
+        step = TIMESERIES_GRANULARITIES[granularity][2]
+        dt = start.replace(second=0, microsecond=0)
+        if granularity != 'minute':
+            dt = dt.replace(minute=0)
+        if granularity == 'day':
+            dt = dt.replace(hour=0)
+        buckets, fields = [], OrderedDict()
+        while dt <= end:
+            key, field = self.__timeseries_bucket(name, granularity, dt)
+            buckets.append(dt)
+            fields.setdefault(key, []).append(field)
+            dt += step
+        pipe = self.pipeline(transaction=False)
+        for key, key_fields in fields.items():
+            pipe.hmget(key, key_fields)
+        values = [int(v or 0) for vals in pipe.execute() for v in vals]
+        return list(zip(buckets, values))
+
+    def timeseries_sum(self, name: str, start: datetime.datetime, end: datetime.datetime, granularity: str = 'minute') -> int:
+        """
+        Return sum of ``granularity`` buckets of ``name`` between ``start`` and ``end`` inclusive, in one round trip.
+        """
+        return sum(value for _, value in self.timeseries_range(name, start, end, granularity=granularity))
+
+    # Counter Section(Unique, HyperLogLog)
+    def _ucounter_key(self, name: str, time_part_func: Optional[Union[type, Callable]] = None) -> str:
+        time_part = time_part_func() if time_part_func else self.__local_ymd(format='%Y%m%d')
+        return '{0}ucounter:{1}:{2}'.format(KEY_PREFIX, name, time_part)
+
+    def ucounter_add(self, name: str, *values: EncodableT, ex: bool = True, time: ExpiryT = 2678400, time_part_func: Optional[Union[type, Callable]] = None, chunk_size: int = 1000) -> bool:
+        """
+        Add ``values`` into unique counter of ``name``, default ``daily``, 12 KB per bucket at most whatever the amount of values.
+
+        ``time`` indicates expire time of the bucket, Default: 31 days, for range counting.
+
+        ``chunk_size`` indicates values amount per ``PFADD``, all chunks are sent in one round trip.
+
+        Return whether the estimated cardinality changed or not.
+        """
+        if not values:
+            return False
+        key = self._ucounter_key(name, time_part_func=time_part_func)
+        pipe = self.pipeline(transaction=False)
+        for idx in range(0, len(values), chunk_size):
+            pipe.pfadd(key, *values[idx:idx + chunk_size])
+        if ex:
+            pipe.expire(key, time)
+        results = pipe.execute()
+        return any(results[:-1] if ex else results)
+
+    def ucounter(self, name: str, time_part_func: Optional[Union[type, Callable]] = None) -> int:
+        """
+        Return estimated unique count of ``name``, default ``daily``.
+        """
+        return self.pfcount(self._ucounter_key(name, time_part_func=time_part_func))
+
+    def ucounter_range(self, name: str, start: datetime.date, end: datetime.date, cache_time: ExpiryT = 0) -> int:
+        """
+        Return estimated unique count of ``name`` over daily buckets between ``start`` and ``end`` inclusive.
+
+        ``cache_time`` if set, will cache the ``PFMERGE`` rollup of the range for ``cache_time`` seconds, else ``PFCOUNT`` on all buckets.
+        """
+        keys = []
+        date = start
+        while date <= end:
+            keys.append(self._ucounter_key(name, time_part_func=lambda: date.strftime('%Y%m%d')))
+            date += datetime.timedelta(days=1)
+        if not keys:
+            return 0
+        if not cache_time:
+            return self.pfcount(*keys)
+        merged_key = '{0}ucounter:{1}:{2}-{3}'.format(KEY_PREFIX, name, start.strftime('%Y%m%d'), end.strftime('%Y%m%d'))
+        if self.exists(merged_key):
+            return self.pfcount(merged_key)
+        return self.pipeline().pfmerge(merged_key, *keys).expire(merged_key, cache_time).pfcount(merged_key).execute()[-1]
+
+    # Bloom Filters Section
+    def bloom_filter(self, name: str, capacity: int = 100000, error_rate: float = 0.001) -> Any:
+        """
+        Return a Bloom filter stored as a Redis bitmap, see ``RedisBloomFilter``.
+        """
+        from .bloom import RedisBloomFilter
+        return RedisBloomFilter(self, name, capacity=capacity, error_rate=error_rate)
 
+    # Verification Codes Section
     def __vcode_key(self, phone: str) -> str:
         return '{0}vcode:{1}'.format(KEY_PREFIX, phone)
 
     def __quota_key(self, value: str, cate: str = 'phone') -> str:
         return '{0}vcode:{1}:quota:{2}'.format(KEY_PREFIX, cate, value)
 
-    def __quota_incr(self, value: str, cate: str = 'phone', quota: int = 10) -> bool:
-        return self.__quota(self.__quota_key(value, cate=cate), amount=quota, time=86400)
-
     def __quota_num(self, value: str, cate: str = 'phone') -> int:
         return int(self.get(self.__quota_key(value, cate=cate)) or 0)
 
-    def __quota_delete(self, value: str, cate: str = 'phone') -> ResponseT:
-        return self.delete(self.__quota_key(value, cate=cate))
-
     def __req_stamp_key(self, value: str, cate: str = 'phone') -> str:
         return '{0}vcode:{1}:req:stamp:{2}'.format(KEY_PREFIX, cate, value)
 
-    def __req_stamp_delete(self, value: str, cate: str = 'phone') -> ResponseT:
-        return self.delete(self.__req_stamp_key(value, cate=cate))
-
     def __black_list_key(self, cate: str = 'phone') -> str:
         return '{0}vcode:{1}:black:list'.format(KEY_PREFIX, cate)
 
+    def __black_list_channel(self, cate: str = 'phone') -> str:
+        return '{0}vcode:{1}:black:list:notify'.format(KEY_PREFIX, cate)
+
+    def vcode_black_list_cache(self, capacity: int = 100000, error_rate: float = 0.001, refresh_interval: float = 60, notify: bool = True, shared: bool = False) -> Dict[str, Any]:
+        """
+        Enable process-local Bloom filter snapshots of the black lists, ``vcode`` only checks the black lists in Redis when probably listed.
+
+        ``refresh_interval`` indicates seconds between rebuilding the snapshots by ``SSCAN``.
+
+        ``notify`` indicates whether subscribe to values added into the black lists by ``vcode``, else missed until rebuilt.
+
+        ``shared`` if set to True, snapshots are also stored in Redis bitmaps, rebuilt by one process per ``refresh_interval``.
+        """
+        from .bloom import RedisBloomFilter, SetBloomCache
+        self.vcode_black_list_cache_close()
+        self.vcode_black_list_caches = {
+            cate: SetBloomCache(
+                self, self.__black_list_key(cate=cate), capacity=capacity, error_rate=error_rate, refresh_interval=refresh_interval,
+                channel=self.__black_list_channel(cate=cate) if notify else None,
+                shared=RedisBloomFilter(self, 'vcode:{0}:black:list'.format(cate), capacity=capacity, error_rate=error_rate) if shared else None,
+            ) for cate in ('phone', 'ipaddr')
+        }
+        return self.vcode_black_list_caches
+
+    def vcode_black_list_cache_close(self):
+        for cache in (self.vcode_black_list_caches or {}).values():
+            cache.close()
+        self.vcode_black_list_caches = None
+
+    def __black_list_probable(self, phone: str, ipaddr: str) -> bool:
+        caches = self.vcode_black_list_caches
+        if not caches:
+            return True
+        return caches['phone'].might_contain(phone) or bool(ipaddr and caches['ipaddr'].might_contain(ipaddr))
+
     def __final_code(self, code: str, ignore_blank: bool = True) -> str:
         final_code = code or ''
         final_code = (final_code.replace(' ', '') if ignore_blank else final_code).lower()
         return final_code
 
-    def __req_interval(self, value: str, cate: str = 'phone', req_interval: int = 60) -> bool:
-        curstamp = tc.utc_timestamp(ms=False)
-        laststamp = int(self.getset(self.__req_stamp_key(value, cate=cate), curstamp) or 0)
-        if curstamp - laststamp < req_interval:
-            self.sadd(self.__black_list_key(cate=cate), value)
-            return True
-        return False
-
     def vcode(self, phone: str, ipaddr: Optional[str] = None, quota: int = 10, req_interval: int = 60, black_list: bool = True, ndigits: int = 6, time: int = 1800, code_cast_func: Union[type, Callable] = str) -> Tuple[Union[str, bool, None], Optional[bool], Optional[bool]]:
         """
         Generate verification code if not reach quota. Return a 3-item tuple: (Verification code, Whether reach quota or not, Whether in black list or not).
@@ -1037,30 +1927,57 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
 
         ``black_list`` - ``redis:extensions:vcode:phone:black:list`` & ``redis:extensions:vcode:ipaddr:black:list``
         """
-        # Black List Check
-        if black_list and (self.__black_list(phone, cate='phone') or (ipaddr and self.__black_list(ipaddr, cate='ipaddr'))):
-            return None, None, True
-        # Quota Check
-        if quota:
-            # Phone Quota
-            if self.__quota_incr(phone, cate='phone', quota=quota):
-                return None, True, None
-            # Ipaddr Quota If `ipaddr`` Isn't ``None``
-            if ipaddr and self.__quota_incr(ipaddr, cate='ipaddr', quota=quota):
-                return None, True, None
-        # Req Interval Check
-        if req_interval:
-            # Phone Interval
-            if self.__req_interval(phone, cate='phone', req_interval=req_interval):
-                return None, False, True
-            # Ipaddr Interval If `ipaddr`` Isn't ``None``
-            if ipaddr and self.__req_interval(ipaddr, cate='ipaddr', req_interval=req_interval):
-                return None, False, True
+        # Black List Check & Quota Check & Req Interval Check & Store Code in one atomic call
+        # 0 - Pass, 1 - In black list, 2 - Reach quota, 3 - Request too frequently (Added into black list)
+        vcode_script = """
+        local phone, ipaddr, quota, req_interval = ARGV[1], ARGV[2], tonumber(ARGV[3]), tonumber(ARGV[4])
+        if ARGV[5] == '1' and (redis.call('sismember', KEYS[1], phone) == 1 or (ipaddr ~= '' and redis.call('sismember', KEYS[2], ipaddr) == 1)) then
+            return 1
+        end
+        local function overtop(quota_key)
+            local num = redis.call('incr', quota_key)
+            if num == 1 then
+                redis.call('expire', quota_key, 86400)
+            end
+            return num > quota
+        end
+        if quota > 0 and (overtop(KEYS[3]) or (ipaddr ~= '' and overtop(KEYS[4]))) then
+            return 2
+        end
+        local function frequent(stamp_key, black_key, value)
+            local laststamp = tonumber(redis.call('getset', stamp_key, ARGV[8]) or '0')
+            if tonumber(ARGV[8]) - laststamp < req_interval then
+                if redis.call('sadd', black_key, value) == 1 then
+                    redis.call('publish', black_key .. ':notify', value)
+                end
+                return true
+            end
+            return false
+        end
+        if req_interval > 0 and (frequent(KEYS[5], KEYS[1], phone) or (ipaddr ~= '' and frequent(KEYS[6], KEYS[2], ipaddr))) then
+            return 3
+        end
+        redis.call('set', KEYS[7], ARGV[6], 'ex', ARGV[7])
+        -- Delete vcode exists quota key
+        redis.call('del', KEYS[8])
+        return 0"""
         code = mod_vcode.digits(ndigits=ndigits, code_cast_func=code_cast_func)
-        self.setex(self.__vcode_key(phone), time, code)
-        # Delete vcode exists quota key
-        self.__quota_delete(phone, cate='exists')
-        return code, False, False
+        ipaddr = ipaddr or ''
+        # Skip black lists check in Redis when definitely not listed
+        black_list = black_list and self.__black_list_probable(phone, ipaddr)
+        keys = [
+            self.__black_list_key(cate='phone'), self.__black_list_key(cate='ipaddr'),
+            self.__quota_key(phone, cate='phone'), self.__quota_key(ipaddr, cate='ipaddr'),
+            self.__req_stamp_key(phone, cate='phone'), self.__req_stamp_key(ipaddr, cate='ipaddr'),
+            self.__vcode_key(phone), self.__quota_key(phone, cate='exists'),
+        ]
+        args = [phone, ipaddr, quota or 0, req_interval or 0, int(bool(black_list)), code, self.__seconds(time), tc.utc_timestamp(ms=False)]
+        return {
+            0: (code, False, False),
+            1: (None, None, True),
+            2: (None, True, None),
+            3: (None, False, True),
+        }[self.__script(vcode_script)(keys=keys, args=args)]
 
     def vcode_quota(self, phone: Optional[str] = None, ipaddr: Optional[str] = None) -> Union[int, Tuple[int]]:
         if phone and not ipaddr:
@@ -1073,15 +1990,32 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         """
         Check verification code exists or not.
         """
-        exists = self.get(self.__vcode_key(phone)) == self.__final_code(self.__str(code), ignore_blank=ignore_blank)
-        # Delete req stamp when vcode exists
-        if exists:
-            self.__req_stamp_delete(phone, cate='phone')
-            ipaddr and self.__req_stamp_delete(ipaddr, cate='ipaddr')
-        # Deleted when exists or not quota(default 3) times in a row
-        if not keep and (exists or self.__quota_incr(phone, cate='exists', quota=quota - 1)):
-            self.vcode_delete(phone)
-        return exists
+        # Check & Delete req stamps when exists & Delete code when exists or not quota(default 3) times in a row, in one atomic call
+        vcode_exists_script = """
+        local exists = redis.call('get', KEYS[1]) == ARGV[1]
+        if exists then
+            redis.call('del', KEYS[2])
+            if ARGV[4] == '1' then
+                redis.call('del', KEYS[3])
+            end
+        end
+        if ARGV[2] ~= '1' then
+            local delete = exists
+            if not delete then
+                local num = redis.call('incr', KEYS[4])
+                if num == 1 then
+                    redis.call('expire', KEYS[4], 86400)
+                end
+                delete = num > tonumber(ARGV[3])
+            end
+            if delete then
+                redis.call('del', KEYS[1])
+            end
+        end
+        return exists and 1 or 0"""
+        keys = [self.__vcode_key(phone), self.__req_stamp_key(phone, cate='phone'), self.__req_stamp_key(ipaddr or '', cate='ipaddr'), self.__quota_key(phone, cate='exists')]
+        args = [self.__final_code(self.__str(code), ignore_blank=ignore_blank), int(keep), quota - 1, int(bool(ipaddr))]
+        return bool(self.__script(vcode_exists_script)(keys=keys, args=args))
 
     def vcode_delete(self, phone: str) -> ResponseT:
         """
@@ -1090,13 +2024,6 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         return self.delete(self.__vcode_key(phone))
 
     # Graphic Verification Codes Section
-    def __gvcode_str(self) -> str:
-        b64str, vcode = gvcode.base64()
-        return json.dumps({
-            'b64str': b64str,
-            'vcode': vcode,
-        })
-
     def _gvcode_key(self) -> str:
         return '{0}graphic:vcode'.format(KEY_PREFIX)
 
@@ -1106,7 +2033,7 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
     def gvcode_add(self, num: int = 10) -> ResponseIntT:
         if num <= 0:
             raise ValueError('The num argument should be positive')
-        gvcodes = (self.__gvcode_str() for _ in range(num))
+        gvcodes = (render_gvcode() for _ in range(num))
         return self.sadd(self._gvcode_key(), *gvcodes)
 
     def gvcode_initial(self, num: int = 10) -> ResponseIntT:
@@ -1120,7 +2047,11 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
     def gvcode_cut(self, num: int = 10) -> int:
         if num <= 0:
             raise ValueError('The num argument should be positive')
-        return self.multi_spop(self._gvcode_key(), num=self.__gvcode_cut_num(num=num))[-1]
+        cut_num = self.__gvcode_cut_num(num=num)
+        if not cut_num:
+            return 0
+        # Binary members, never decoded
+        return len(self.execute_command('SPOP', self._gvcode_key(), cut_num, **{NEVER_DECODE: True}))
 
     def gvcode_refresh(self, num: int = 10) -> int:
         if num <= 0:
@@ -1128,40 +2059,116 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         cut_num = self.__gvcode_cut_num(num=num)
         return cut_num and self.gvcode_cut(num=cut_num), self.gvcode_add(num=num)
 
-    def __gvcode_b64str(self) -> Dict[str, Any]:
-        return json.loads(self.srandmember(self._gvcode_key()) or '{}')
+    def gvcode_pool(self, low: int = 100, high: int = 1000, chunk_size: int = 100, workers: Optional[int] = None, interval: float = 1) -> Any:
+        """
+        Return a background maintainer of the gvcode pool, see ``GvcodePool``.
+        """
+        from .captcha import GvcodePool
+        return GvcodePool(self, low=low, high=high, chunk_size=chunk_size, workers=workers, interval=interval)
 
-    def gvcode_b64str(self, name: str, time: int = 1800, data_uri_scheme: bool = False) -> str:
-        gvcode = self.__gvcode_b64str()
-        if not gvcode:
+    def __gvcode_random(self, refresh: bool = True) -> Tuple[bytes, str]:
+        gvcode = self.execute_command('SRANDMEMBER', self._gvcode_key(), **{NEVER_DECODE: True})
+        if not gvcode and refresh:
             self.gvcode_refresh()
-            gvcode = self.__gvcode_b64str()
-            if not gvcode:
-                logger.warning('Gvcode not found, exec gvcode_add or gvcode_refresh first')
-        b64str, vcode = gvcode.get('b64str', ''), gvcode.get('vcode', '')
-        self.setex(self.__gvcode_key(name), time, vcode)
+            gvcode = self.execute_command('SRANDMEMBER', self._gvcode_key(), **{NEVER_DECODE: True})
+        if not gvcode:
+            logger.warning('Gvcode not found, exec gvcode_add or gvcode_refresh first')
+            return b'', ''
+        return unpack_gvcode(gvcode)
+
+    def gvcode_b64str(self, name: str, time: int = 1800, data_uri_scheme: bool = False, refresh: bool = True) -> str:
+        """
+        Pick a random gvcode from the pool, store its code as ``name`` and return its base64 string.
+
+        ``refresh`` if set to True, will render gvcodes inline when the pool is empty, set to False when the pool is
+        maintained by ``gvcode_pool``, keeps rendering off the request path.
+        """
+        png, vcode = self.__gvcode_random(refresh=refresh)
+        # Never store an empty code when the pool is empty, which ``gvcode_exists(name, '')`` would pass
+        if vcode:
+            self.set(self.__gvcode_key(name), vcode, ex=time)
+        b64str = base64.b64encode(png).decode('utf-8')
         return '{0}{1}'.format('data:image/png;base64,' if data_uri_scheme else '', b64str)
 
+    def gvcode_bytes(self, name: str, time: int = 1800, refresh: bool = True) -> bytes:
+        """
+        Like ``gvcode_b64str``, but return the raw PNG bytes, for serving as ``image/png`` without encoding.
+        """
+        png, vcode = self.__gvcode_random(refresh=refresh)
+        if vcode:
+            self.set(self.__gvcode_key(name), vcode, ex=time)
+        return png
+
     def gvcode_exists(self, name: str, code: str, ignore_blank: bool = True) -> bool:
-        return (self.get(self.__gvcode_key(name)) or '').lower() == self.__final_code(code, ignore_blank=ignore_blank)
+        vcode = self.get(self.__gvcode_key(name))
+        return bool(vcode) and vcode.lower() == self.__final_code(code, ignore_blank=ignore_blank)
 
     # Delay Tasks Section
     def __queue_key(self, queue: str) -> str:
         return '{0}queue:{1}'.format(KEY_PREFIX, queue)
 
-    def execute_later(self, queue: str, name: str, args: Dict[str, Any] = None, delayed: str = KEY_PREFIX + 'delayed:default', delay: int = 0, short_uuid: bool = False, enable_queue: bool = False) -> str:
+    def execute_later(self, queue: str, name: str, args: Dict[str, Any] = None, delayed: str = KEY_PREFIX + 'delayed:default', delay: int = 0, short_uuid: bool = False, enable_queue: bool = False, shards: int = 1, compact: bool = False, priority: int = 0, dedup_key: Optional[str] = None, dedup_ttl: Optional[float] = None, dedup_policy: str = 'keep') -> str:
         """
         Producer of delay execute.
+
+        ``shards`` indicates the number of shards of ``delayed``, items are hashed into shards by identifier.
+        Should be the same as consumers.
+
+        ``compact`` if set to True, the ``delayed`` member is only the identifier, with the item in ``delayed:payload``,
+        fetched only when claimed and deleted when acked. Consumers handle both, queues can be migrated gradually.
+
+        ``priority`` indicates the priority lane, higher first when claimed by consumers of ``priorities`` including it.
+
+        ``dedup_key`` if set, enqueue a delayed item only if no item of the same ``dedup_key`` is pending or in flight, return the
+        identifier of that one instead, for idempotent producers. The dedup key expires after ``dedup_ttl`` seconds,
+        ``delay`` plus one hour if not set. If pending, ``dedup_policy`` indicates ``keep`` it as is, ``replace`` it by
+        this one, or reschedule it to the ``earliest`` or ``latest`` due of both. Dead or consumed ones are no duplicates.
+        Raise ``ValueError`` if ``delay`` is not positive.
         """
-        identifier = self.__uuid(short_uuid)
+        dedup = _delayed_dedup(dedup_key, dedup_ttl, dedup_policy, delay)
+        identifier = _delayed_identifier(short_uuid, shards, dedup_key if delay > 0 else None)
         item = json.dumps([identifier, queue, name, args])
         if delay > 0:
-            self.zadd(delayed, {item: mod_time.time() + delay})
+            keys = self._delayed_keys(delayed_item_key(delayed, shards, identifier))
+            keys.append(delayed_lane_key(keys[0], priority))
+            if dedup_key:
+                keys.append('{0}:dedup:{1}'.format(keys[0], dedup_key))
+            identifier = self.__script(ENQUEUE_DELAYED_SCRIPT)(keys=keys, args=[mod_time.time() + delay, identifier if compact else item, identifier, item if compact else '', priority] + dedup)
+            # Of the duplicate if deduplicated
+            return identifier.decode('utf-8') if isinstance(identifier, bytes) else identifier
         else:
             if enable_queue:
                 self.rpush(self.__queue_key(queue), item)
         return identifier
 
+    def execute_later_many(self, tasks: Iterable[Sequence[Any]], delayed: str = KEY_PREFIX + 'delayed:default', chunk_size: int = 1000, short_uuid: bool = False, enable_queue: bool = False, shards: int = 1, compact: bool = False) -> Iterator[str]:
+        """
+        Bulk producer of delay execute, ``tasks`` is an iterable of ``(queue, name[, args[, delay[, priority]]])``.
+
+        Tasks are serialized lazily and written by a pipeline of multi-member ``ZADD``/``RPUSH`` every ``chunk_size`` tasks,
+        one round trip per chunk. Identifiers are yielded once their chunk is written, so memory is bounded by
+        ``chunk_size`` whatever the number of tasks.
+
+        Nothing is written until iterated, e.g. ``for identifier in r.execute_later_many(tasks): ...`` or
+        ``collections.deque(r.execute_later_many(tasks), maxlen=0)``.
+
+        ``compact`` as ``execute_later``.
+        """
+        for identifiers, hsets, zadds, rpushes in _delayed_chunks(tasks, delayed, chunk_size, short_uuid, shards, compact):
+            pipe = self.pipeline(transaction=False)
+            # Payloads and priorities before members, never claimed without
+            for key, mapping in hsets.items():
+                pipe.hset(key, mapping=mapping)
+            for (key, lane), mapping in zadds.items():
+                pipe.zadd(lane, mapping)
+                # Wake up sleeping consumers once per lane, instead of per item
+                pipe.lpush(self._wakeup_key(key), 1).ltrim(self._wakeup_key(key), 0, 0)
+            if enable_queue:
+                for queue, items in rpushes.items():
+                    pipe.rpush(self.__queue_key(queue), *items)
+            pipe.execute()
+            yield from identifiers
+
     def __callable_func(self, f: Union[str, Callable]) -> Optional[Callable]:
         if callable(f):
             return f
@@ -1173,18 +2180,175 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
             logger.error(e)
             return None
 
+    def _inflight_key(self, delayed: str) -> str:
+        return '{0}:inflight'.format(delayed)
+
+    def _wakeup_key(self, delayed: str) -> str:
+        return '{0}:wakeup'.format(delayed)
+
+    def _delayed_keys(self, delayed: str, priorities: Optional[List[int]] = None) -> List[str]:
+        # With lanes of ``priorities``, the only lanes items are moved back to
+        return [delayed, self._inflight_key(delayed), self._wakeup_key(delayed), '{0}:attempts'.format(delayed), '{0}:dead'.format(delayed), '{0}:payload'.format(delayed), '{0}:priority'.format(delayed)] + _delayed_lanes(delayed, priorities, None)[0]
+
+    def claim_delayed(self, delayed: str = KEY_PREFIX + 'delayed:default', batch_size: int = 100, inflight: bool = True, with_next_due: bool = False, visibility_timeout: Optional[float] = None, max_attempts: Optional[int] = None, priorities: Optional[List[int]] = None, priority_weights: Optional[Dict[int, float]] = None, priority_aging: Optional[float] = None) -> Union[List[str], Tuple[List[str], Optional[float]]]:
+        """
+        Claim up to ``batch_size`` due items of ``delayed`` atomically, in one round trip.
+
+        ``inflight`` if set to True, claimed items are kept in ``delayed:inflight`` until ``ack_delayed``, else removed.
+
+        ``with_next_due`` if set to True, will return ``(items, next due timestamp or None)``.
+
+        ``visibility_timeout`` indicates seconds after which items in flight are claimable again, as failed attempts.
+        Should be longer than callbacks run, else they may run twice.
+
+        ``max_attempts`` indicates the attempts after which items are moved to ``delayed:dead``, see ``fail_delayed``.
+
+        ``priorities`` indicates the priority lanes claimed, strictly higher first, ``[0]`` if not set.
+
+        ``priority_weights`` indicates weights by priority, if set, lanes get shares of ``batch_size`` by weights first,
+        then strictly. ``priority_aging`` indicates seconds after which overdue items of lower lanes are claimed first,
+        against starvation.
+        """
+        if batch_size <= 0:
+            raise ValueError('The batch_size argument should be positive')
+        lanes, weights = _delayed_lanes(delayed, priorities, priority_weights)
+        items, next_due = self.__script(CLAIM_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed) + lanes, args=[mod_time.time(), batch_size, int(inflight), visibility_timeout or 0, max_attempts or 0, priority_aging or 0] + weights)
+        if with_next_due:
+            return items, next_due and float(next_due)
+        return items
+
+    def wait_delayed(self, delayed: Union[str, List[str]] = KEY_PREFIX + 'delayed:default', next_due: Optional[float] = None, max_wait: float = 1) -> bool:
+        """
+        Sleep until ``next_due`` but at most ``max_wait`` seconds, woken up early by ``execute_later`` of an earlier item.
+
+        ``delayed`` can be a list of shard keys, woken up by any of them. Shards of different hash tags are waited on at
+        once by one ``BLPOP`` per cluster slot, in background threads.
+
+        Return True if woken up.
+        """
+        timeout = max_wait if next_due is None else min(max(next_due - mod_time.time(), 0), max_wait)
+        if timeout <= 0:
+            return False
+        # ``BLPOP`` timeouts may fire up to 1/hz seconds (100 ms by default) late, sleep the last 100 ms locally
+        if timeout <= .1:
+            mod_time.sleep(timeout)
+            return False
+        delayeds = [delayed] if isinstance(delayed, str) else delayed
+        groups = _hash_tag_groups([self._wakeup_key(key) for key in delayeds])
+        if len(groups) == 1:
+            return bool(self.blpop(groups[0], timeout=timeout - .1))
+        return self.__wait_wakeups(groups, timeout - .1)
+
+    def __blpop_in_background(self, keys: List[str], timeout: float) -> Future:
+        future = Future()  # type: Future
+
+        def run():
+            try:
+                future.set_result(bool(self.blpop(keys, timeout=timeout)))
+            except Exception as e:
+                future.set_exception(e)
+
+        threading.Thread(target=run, name='delayed-wakeup', daemon=True).start()
+        return future
+
+    def __wait_wakeups(self, groups: List[List[str]], timeout: float) -> bool:
+        # No multi-slot ``BLPOP``, one per cluster slot at once in background threads. Ones not returned are left running,
+        # waited on by the next call instead of started again
+        end = mod_time.monotonic() + timeout
+        while True:
+            woken = False
+            for group, future in list(self.__wakeups.items()):
+                if future.done() and self.__wakeups.pop(group, None) is future:
+                    woken = future.result() or woken
+            remaining = end - mod_time.monotonic()
+            if woken or remaining <= 0:
+                return woken
+            for keys in groups:
+                if tuple(keys) not in self.__wakeups:
+                    self.__wakeups[tuple(keys)] = self.__blpop_in_background(keys, remaining)
+            futures = [self.__wakeups.get(tuple(keys)) for keys in groups]
+            wait([future for future in futures if future], timeout=remaining, return_when=FIRST_COMPLETED)
+
+    def ack_delayed(self, delayed: str, *items: str) -> ResponseT:
+        """
+        Remove consumed ``items`` from ``delayed:inflight``, with their attempts and payloads.
+        """
+        return self.__script(ACK_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed), args=items)
+
+    def fail_delayed(self, delayed: str, item: str, max_attempts: Optional[int] = None, backoff: float = 1, backoff_max: float = 3600, priorities: Optional[List[int]] = None) -> int:
+        """
+        Count a failed attempt of ``item`` in flight, retry it after exponential backoff from ``backoff`` seconds,
+        at most ``backoff_max`` seconds, with jitter. After ``max_attempts`` attempts, moved to ``delayed:dead`` instead.
+
+        ``priorities`` indicates the priority lanes items may be retried in, ``[0]`` if not set, as claimed by.
+
+        Return -1 if not in flight or not of ``priorities``, 0 if moved to dead letters, else the attempts.
+        """
+        return self.__script(FAIL_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed, priorities), args=[item, mod_time.time(), max_attempts or 0, backoff, backoff_max, random.random()])
+
+    def dead_letters(self, delayed: str = KEY_PREFIX + 'delayed:default', start: int = 0, end: int = -1, withscores: bool = False, shards: int = 1) -> ResponseZ:
+        """
+        Return dead letters of ``delayed`` from ``start`` to ``end`` of each shard, oldest first, scores are the time of death.
+        """
+        letters = []  # type: List[Tuple[str, float]]
+        for key in delayed_shard_keys(delayed, shards):
+            items, scores = self.__script(DEAD_LETTERS_SCRIPT)(keys=self._delayed_keys(key), args=[start, end])
+            letters.extend((item, float(score)) for item, score in zip(items, scores) if item)
+        return letters if withscores else [item for item, _ in letters]
+
+    def replay_dead_letters(self, delayed: str = KEY_PREFIX + 'delayed:default', items: Optional[List[str]] = None, num: int = 100, shards: int = 1, priorities: Optional[List[int]] = None) -> int:
+        """
+        Move ``items``, or the oldest ``num`` of each shard, of dead letters back to ``delayed``, due now with attempts reset.
+
+        ``priorities`` indicates the priority lanes items may be moved back to, ``[0]`` if not set, others are skipped.
+        """
+        if items is not None:
+            sharded = {}  # type: Dict[str, List[str]]
+            for item in items:
+                sharded.setdefault(delayed_item_key(delayed, shards, json.loads(item)[0]), []).append(item)
+        else:
+            sharded = {key: [] for key in delayed_shard_keys(delayed, shards)}
+        replayed = 0
+        for key, shard_items in sharded.items():
+            replayed += self.__script(REPLAY_DEAD_SCRIPT)(keys=self._delayed_keys(key, priorities), args=[mod_time.time(), num] + shard_items)
+        return replayed
+
+    def nack_delayed(self, delayed: str, *items: str, delay: float = 0, priorities: Optional[List[int]] = None) -> ResponseT:
+        """
+        Move claimed ``items`` from ``delayed:inflight`` back to ``delayed``, due after ``delay`` seconds.
+        Items not in flight any more, e.g. acked, or not of ``priorities`` (``[0]`` if not set), are skipped.
+        """
+        return self.__script(NACK_DELAYED_SCRIPT)(keys=self._delayed_keys(delayed, priorities), args=[mod_time.time() + delay] + list(items))
+
+    def requeue_inflight(self, delayed: str = KEY_PREFIX + 'delayed:default', older_than: float = 0, priorities: Optional[List[int]] = None) -> int:
+        """
+        Move claimed but not acked items back to ``delayed``, for consumers which exited before acking.
+        Items not of ``priorities``, ``[0]`` if not set, are kept in flight.
+
+        ``older_than`` indicates seconds since claimed, items claimed later are kept in flight. Should be longer than
+        callbacks run if other consumers are running, else their items may run twice, all items if 0.
+        """
+        return self.__script(REQUEUE_INFLIGHT_SCRIPT)(keys=self._delayed_keys(delayed, priorities), args=[mod_time.time() - older_than])
+
     def release_poll_queue_lock(self, delayed: str, final_logger: Optional[logging.Logger] = None) -> ResponseT:
+        # Items are claimed atomically, without item locks since
+        warnings.warn(
+            f"{self.__class__.__name__}.release_poll_queue_lock() is deprecated, items are claimed without locks.",
+            DeprecationWarning,
+            stacklevel=2,
+        )
         if not delayed:
             return
         item = self.zrange(delayed, 0, 0, withscores=True)
         if not item:
             return
-        item = item[0][0]
-        identifier, queue, name, args = json.loads(item)
-        final_logger.info('  * Release lock: {0}'.format(identifier))
+        member = item[0][0]
+        # Compact members are identifiers, no need to decode
+        identifier = json.loads(member)[0] if member[:1] in ('[', b'[') else member
+        (final_logger or logger).info('  * Release lock: {0}'.format(identifier))
         return self.delete_lock(identifier)
 
-    def __release_lock_when_launch(self, release_lock_when_launch: bool, release_lock_eth0_inet_addr: Optional[str], final_process_lock_key: str, delayed: str, final_logger: Optional[logging.Logger]):
+    def __release_lock_when_launch(self, release_lock_when_launch: bool, release_lock_eth0_inet_addr: Optional[str], final_process_lock_key: str, delayeds: List[str], final_logger: Optional[logging.Logger], priorities: Optional[List[int]] = None, requeue_after: Optional[float] = None):
         if not release_lock_when_launch:
             return
         if not release_lock_eth0_inet_addr:
@@ -1197,19 +2361,20 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         final_logger.info('>>> Release process lock start')
         self.delete_lock(final_process_lock_key)
         final_logger.info('>>> Release process lock end')
-        final_logger.info('>>> Release item lock start')
-        self.release_poll_queue_lock(delayed, final_logger=final_logger)
-        final_logger.info('>>> Release item lock end')
+        if requeue_after is None:
+            # Items of other consumers may still be running, see ``requeue_inflight``
+            final_logger.warning('>>> Requeue all inflight items, pass `visibility_timeout` or `task_timeout` to keep ones of running consumers')
+        final_logger.info('>>> Requeue inflight items: {0}'.format(sum(self.requeue_inflight(key, older_than=requeue_after or 0, priorities=priorities) for key in delayeds)))
 
     # Signal Handler
     def __signal_handler(self, signum, frame):
         self.poll_queue_continue_flag = False
 
-    def poll_queue(self, callbacks: Dict[str, Callable] = {}, delayed: str = KEY_PREFIX + 'delayed:default', enable_auto_zrem: bool = False, enable_queue: bool = False, enable_process_lock: bool = False, process_lock_key: Optional[str] = None, release_lock_when_launch: bool = True, release_lock_eth0_inet_addr: Optional[str] = None, release_lock_when_error: bool = True, delayed_logger: Optional[logging.Logger] = None, unlocked_warning_func: Optional[Callable] = None):
+    def poll_queue(self, callbacks: Dict[str, Callable] = {}, delayed: str = KEY_PREFIX + 'delayed:default', enable_auto_zrem: bool = False, enable_queue: bool = False, enable_process_lock: bool = False, process_lock_key: Optional[str] = None, release_lock_when_launch: bool = True, release_lock_eth0_inet_addr: Optional[str] = None, release_lock_when_error: bool = True, delayed_logger: Optional[logging.Logger] = None, unlocked_warning_func: Optional[Callable] = None, batch_size: int = 100, executor: Optional[str] = None, max_workers: int = 10, queue_concurrency: Optional[Dict[str, int]] = None, task_timeout: Optional[float] = None, drain_timeout: Optional[float] = 30, max_wait: float = 1, shards: int = 1, shard_ids: Optional[List[int]] = None, max_attempts: Optional[int] = None, retry_backoff: float = 1, retry_backoff_max: float = 3600, visibility_timeout: Optional[float] = None, priorities: Optional[List[int]] = None, priority_weights: Optional[Dict[int, float]] = None, priority_aging: Optional[float] = None):
         """
         Consumer of delay execute.
 
-        ``unlocked_warning_func`` indicates callback function when ``acquire_lock`` fail.
+        ``unlocked_warning_func`` is deprecated, items are claimed atomically without locks, never called.
 
         ``enable_auto_zrem`` indicates whether enable auto zrem or not. ``True`` for at most once, ``False`` for at least once.
 
@@ -1219,12 +2384,47 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
 
         ``process_lock_key`` indicates acquire process lock key.
 
-        ``release_lock_when_launch`` indicates whether release lock when launch or not. This is for ``restart``.
+        ``release_lock_when_launch`` indicates whether release lock when launch or not. This is for ``restart``. Items in
+        flight longer than ``visibility_timeout``, or ``task_timeout`` if not set, are requeued too, all items if neither
+        is set, which may run items of other running consumers twice.
 
         ``release_lock_eth0_inet_addr`` indicates eth0 inet addr, which can release lock when ``release_lock_when_launch``.
 
-        ``release_lock_when_error`` indicates whether release lock when error or not.
+        ``release_lock_when_error`` indicates whether release lock when error or not. ``False`` for keeping the item in flight,
+        requeued by ``visibility_timeout`` or when launch, see ``release_lock_when_launch``.
+
+        ``batch_size`` indicates the maximum number of due items claimed in one round trip.
+
+        ``executor`` indicates ``thread`` or ``process`` to run callbacks concurrently in a pool, ``None`` for inline.
+
+        ``max_workers``, ``queue_concurrency`` and ``task_timeout`` configure the pool, see ``DelayedExecutor``.
+
+        ``drain_timeout`` indicates seconds waiting for callbacks in flight when stopped by signal. Items claimed but
+        not started are requeued for at least once, started for at most once.
+
+        ``max_wait`` indicates the maximum seconds sleeping when nothing is due, see ``wait_delayed``. Also bounds the
+        latency of stopping by signal.
+
+
+        ``shards`` indicates the number of shards of ``delayed``, same as producers. Shards are claimed round-robin.
+
+        ``shard_ids`` indicates the shards owned by this consumer, all shards if not set.
+
+        ``max_attempts`` if set, failed items are retried after exponential backoff from ``retry_backoff`` seconds, at most
+        ``retry_backoff_max`` seconds, moved to dead letters after ``max_attempts`` attempts, see ``fail_delayed``. Instead of
+        ``release_lock_when_error``, at least once only.
+
+        ``visibility_timeout`` if set, items in flight longer are claimed again as failed attempts, e.g. of crashed consumers.
+
+        ``priorities``, ``priority_weights`` and ``priority_aging`` indicate the priority lanes claimed, see ``claim_delayed``.
         """
+        if unlocked_warning_func is not None:
+            warnings.warn(
+                f"{self.__class__.__name__}.poll_queue() unlocked_warning_func is deprecated, items are claimed without locks.",
+                DeprecationWarning,
+                stacklevel=2,
+            )
+
         # signal.SIGKILL, `KILL -9`, unblockable
         for signum in [signal.SIGHUP, signal.SIGINT, signal.SIGTERM, signal.SIGTSTP]:
             signal.signal(signum, self.__signal_handler)
@@ -1239,9 +2439,25 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
         for k, v in callbacks.items():
             final_logger.info('  * {0}: {1}'.format(k, v))
 
-        self.__release_lock_when_launch(release_lock_when_launch, release_lock_eth0_inet_addr, final_process_lock_key, delayed, final_logger)
+        delayeds = delayed_shard_keys(delayed, shards, shard_ids)
+
+        self.__release_lock_when_launch(release_lock_when_launch, release_lock_eth0_inet_addr, final_process_lock_key, delayeds, final_logger, priorities=priorities, requeue_after=task_timeout if visibility_timeout is None else visibility_timeout)
+
+        def finish(item: str, queue: str, ok: bool):
+            key = delayed_item_key(delayed, shards, json.loads(item)[0])
+            if not ok and max_attempts and not enable_auto_zrem:
+                self.fail_delayed(key, item, max_attempts=max_attempts, backoff=retry_backoff, backoff_max=retry_backoff_max, priorities=priorities)
+                return
+            self.__poll_queue_finish(key, item, queue, ok, enable_auto_zrem, enable_queue, release_lock_when_error)
+
+        pool = None
+        if executor:
+            from .executor import DelayedExecutor
+            pool = DelayedExecutor(finish, kind=executor, max_workers=max_workers, queue_concurrency=queue_concurrency, task_timeout=task_timeout, final_logger=final_logger)
 
         process_lock = None
+        # Round-robin over shards, sleep only when none is due
+        cursor, idles, next_dues = 0, 0, []
         while self.poll_queue_continue_flag:
             if enable_process_lock:
                 # Release process lock
@@ -1253,45 +2469,87 @@ class RedisExtensions(BaseRedisExpires, StrictRedis):
                 if not process_lock:
                     continue
 
-            item = self.zrange(delayed, 0, 0, withscores=True)
+            claim_size = batch_size
+            if pool:
+                pool.poll()
+                # Backpressure, claim no more than the pool can start
+                claim_size = min(batch_size, pool.capacity())
+                if not claim_size:
+                    # Until a callback returns, instead of polling
+                    pool.wait(max_wait)
+                    continue
 
-            if not item or item[0][1] > mod_time.time():
-                mod_time.sleep(.01)
-                continue
+            # At most once 最多消费一次, claimed items are removed
+            # At least once 最少消费一次, claimed items are kept in flight until consumed
+            items, next_due = self.claim_delayed(delayeds[cursor], batch_size=claim_size, inflight=not enable_auto_zrem, with_next_due=True, visibility_timeout=visibility_timeout, max_attempts=max_attempts, priorities=priorities, priority_weights=priority_weights, priority_aging=priority_aging)
+            cursor = (cursor + 1) % len(delayeds)
 
-            final_logger.info(item)
+            if not items:
+                idles += 1
+                if next_due is not None:
+                    next_dues.append(next_due)
+                if idles < len(delayeds):
+                    continue
+                wait_due = min(next_dues) if next_dues else None
+                if pool and pool.running:
+                    # Until a callback returns, or the head is due, whichever first
+                    pool.wait(max_wait, wakeup=lambda: self.wait_delayed(delayeds, next_due=wait_due, max_wait=max_wait))
+                else:
+                    # Sleep until the head is due, instead of polling
+                    self.wait_delayed(delayeds, next_due=wait_due, max_wait=max_wait)
+                idles, next_dues = 0, []
+                continue
 
-            item = item[0][0]
-            identifier, queue, name, args = json.loads(item)
+            idles, next_dues = 0, []
+
+            if enable_auto_zrem and enable_queue:
+                self.__delayed_enqueue(items)
+
+            for item in items:
+                final_logger.info(item)
+                identifier, queue, name, args = json.loads(item)
+                if queue not in callbacks:
+                    finish(item, queue, True)
+                elif pool:
+                    pool.submit(item, queue, callbacks[queue], name, args)
+                else:
+                    finish(item, queue, self.__poll_queue_call(callbacks[queue], name, args, final_logger))
+
+        # Graceful drain, when stopped by signal
+        if pool:
+            unstarted = pool.drain(timeout=drain_timeout, run_pending=enable_auto_zrem)
+            if unstarted and not enable_auto_zrem:
+                self.__nack_sharded(delayed, shards, unstarted, priorities)
+
+    def __nack_sharded(self, delayed: str, shards: int, items: List[str], priorities: Optional[List[int]]):
+        sharded = {}  # type: Dict[str, List[str]]
+        for item in items:
+            sharded.setdefault(delayed_item_key(delayed, shards, json.loads(item)[0]), []).append(item)
+        for key, shard_items in sharded.items():
+            self.nack_delayed(key, *shard_items, priorities=priorities)
+
+    def __delayed_enqueue(self, items: List[str]):
+        pipe = self.pipeline(transaction=False)
+        for item in items:
+            pipe.rpush(self.__queue_key(json.loads(item)[1]), item)
+        pipe.execute()
+
+    def __poll_queue_call(self, callback: Callable, name: str, args: Any, final_logger: logging.Logger) -> bool:
+        try:
+            callback(name, args)
+        except Exception as e:
+            final_logger.error(e)
+            return False
+        return True
 
-            item_lock = self.acquire_lock(identifier)
-            if not item_lock:
-                # Call ``unlocked_warning_func`` if exists when ``acquire_lock`` fail
-                if unlocked_warning_func:
-                    unlocked_warning_func(queue, name, args)
-                continue
+    def __poll_queue_finish(self, delayed: str, item: str, queue: str, ok: bool, enable_auto_zrem: bool, enable_queue: bool, release_lock_when_error: bool):
+        if not ok and not release_lock_when_error:
+            return
 
-            # At most once 最多消费一次
-            if enable_auto_zrem and self.zrem(delayed, item):
-                if enable_queue:
-                    self.rpush(self.__queue_key(queue), item)
-                self.release_lock(identifier, item_lock)
-
-            # Callbacks
-            if queue in callbacks:
-                try:
-                    callbacks[queue](name, args)
-                except Exception as e:
-                    final_logger.error(e)
-                    if not release_lock_when_error:
-                        continue
-
-            # At least once 最少消费一次
-            if not enable_auto_zrem and self.zrem(delayed, item):
-                if enable_queue:
-                    self.rpush(self.__queue_key(queue), item)
-
-            self.release_lock(identifier, item_lock)
+        # At least once 最少消费一次
+        if not enable_auto_zrem and self.ack_delayed(delayed, item):
+            if enable_queue:
+                self.rpush(self.__queue_key(queue), item)
 
     # HotKey Section
     def hotkey(self, gfunc: Optional[Callable] = None, gargs: Optional[Dict[str, Any]] = None, gkwargs: Optional[Dict[str, Any]] = None, sfunc: Optional[Callable] = None, sargs: Optional[Dict[str, Any]] = None, skwargs: Optional[Dict[str, Any]] = None, update_timeout: int = 1000, short_uuid: bool = False):
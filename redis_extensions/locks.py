@@ -0,0 +1,739 @@
+import asyncio
+import random
+import threading
+import time as mod_time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator, List, Optional
+
+from redis.exceptions import LockNotOwnedError, RedisError
+
+from .extensions import KEY_PREFIX, SERVER_NOW, logger
+
+
+# Extend the lease only if ``ARGV[1]`` still owns the lock
+RENEW_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0"""
+
+# Delete the lock only if ``ARGV[1]`` still owns the lock
+RELEASE_LOCK_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0"""
+
+# KEYS: holders, waiters, seen, ticket; ARGV: identifier, limit, lease ms, wait ttl ms
+ACQUIRE_SEMAPHORE_SCRIPT = SERVER_NOW + """
+local lease, wait_ttl = tonumber(ARGV[3]), tonumber(ARGV[4])
+redis.call('zremrangebyscore', KEYS[1], '-inf', now)
+for _, stale in ipairs(redis.call('zrangebyscore', KEYS[3], '-inf', now - wait_ttl)) do
+    redis.call('zrem', KEYS[2], stale)
+    redis.call('zrem', KEYS[3], stale)
+end
+local function acquire()
+    if redis.call('zscore', KEYS[1], ARGV[1]) then
+        redis.call('zadd', KEYS[1], now + lease, ARGV[1])
+        return 1
+    end
+    if not redis.call('zscore', KEYS[2], ARGV[1]) then
+        redis.call('zadd', KEYS[2], redis.call('incr', KEYS[4]), ARGV[1])
+    end
+    redis.call('zadd', KEYS[3], now, ARGV[1])
+    local free = tonumber(ARGV[2]) - redis.call('zcard', KEYS[1])
+    if free > 0 and redis.call('zrank', KEYS[2], ARGV[1]) < free then
+        redis.call('zrem', KEYS[2], ARGV[1])
+        redis.call('zrem', KEYS[3], ARGV[1])
+        redis.call('zadd', KEYS[1], now + lease, ARGV[1])
+        return 1
+    end
+    return 0
+end
+local acquired = acquire()
+-- Only ever extend, never expire keys under live holders of a longer lease
+local ttl = math.max(lease, wait_ttl) * 2
+for _, key in ipairs(KEYS) do
+    if redis.call('pttl', key) < ttl then
+        redis.call('pexpire', key, ttl)
+    end
+end
+return acquired"""
+
+# KEYS: holders; ARGV: identifier, lease ms
+RENEW_SEMAPHORE_SCRIPT = SERVER_NOW + """
+local deadline = redis.call('zscore', KEYS[1], ARGV[1])
+if deadline and tonumber(deadline) > now then
+    local lease = tonumber(ARGV[2])
+    redis.call('zadd', KEYS[1], now + lease, ARGV[1])
+    -- Outlive the new deadline, never expired under live holders
+    if redis.call('pttl', KEYS[1]) < lease * 2 then
+        redis.call('pexpire', KEYS[1], lease * 2)
+    end
+    return 1
+end
+return 0"""
+
+# KEYS: holders
+# Return: the number of holders not expired, by the server clock
+HOLDERS_SEMAPHORE_SCRIPT = SERVER_NOW + """
+return redis.call('zcount', KEYS[1], now, '+inf')"""
+
+# KEYS: holders, waiters, seen, channel; ARGV: identifier
+RELEASE_SEMAPHORE_SCRIPT = """
+local released = redis.call('zrem', KEYS[1], ARGV[1])
+redis.call('zrem', KEYS[2], ARGV[1])
+redis.call('zrem', KEYS[3], ARGV[1])
+if released == 1 then
+    redis.call('publish', KEYS[4], 1)
+end
+return released"""
+
+# KEYS: readers, writer, writer waiting; ARGV: identifier, lease ms
+ACQUIRE_READ_SCRIPT = SERVER_NOW + """
+redis.call('zremrangebyscore', KEYS[1], '-inf', now)
+if redis.call('exists', KEYS[2]) == 1 or redis.call('exists', KEYS[3]) == 1 then
+    return 0
+end
+redis.call('zadd', KEYS[1], now + tonumber(ARGV[2]), ARGV[1])
+if redis.call('pttl', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 1"""
+
+# KEYS: readers, writer, writer waiting; ARGV: identifier, lease ms, wait ttl ms
+ACQUIRE_WRITE_SCRIPT = SERVER_NOW + """
+redis.call('zremrangebyscore', KEYS[1], '-inf', now)
+local writer, waiting = redis.call('get', KEYS[2]), redis.call('get', KEYS[3])
+if writer == ARGV[1] then
+    redis.call('pexpire', KEYS[2], ARGV[2])
+    return 1
+end
+if writer or (waiting and waiting ~= ARGV[1]) then
+    return 0
+end
+if redis.call('zcard', KEYS[1]) > 0 then
+    -- Block new readers, prevent writer starvation
+    redis.call('set', KEYS[3], ARGV[1], 'px', ARGV[3])
+    return 0
+end
+redis.call('set', KEYS[2], ARGV[1], 'px', ARGV[2])
+redis.call('del', KEYS[3])
+return 1"""
+
+# KEYS: readers, channel; ARGV: identifier
+RELEASE_READ_SCRIPT = """
+local released = redis.call('zrem', KEYS[1], ARGV[1])
+if released == 1 and redis.call('zcard', KEYS[1]) == 0 then
+    redis.call('publish', KEYS[2], 1)
+end
+return released"""
+
+# KEYS: writer, writer waiting, channel; ARGV: identifier
+RELEASE_WRITE_SCRIPT = """
+if redis.call('get', KEYS[2]) == ARGV[1] then
+    redis.call('del', KEYS[2])
+end
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    redis.call('del', KEYS[1])
+    redis.call('publish', KEYS[3], 1)
+    return 1
+end
+return 0"""
+
+
+def lock_key(name: str) -> str:
+    return '{0}lock:{1}'.format(KEY_PREFIX, name)
+
+
+def _watchdog(stop: threading.Event, renew: Callable[[], bool], lease: float, renew_interval: float, lose: Callable[[], None]):
+    """
+    Call ``renew`` every ``renew_interval`` until ``stop`` is set, then ``lose`` once the lease could not be renewed.
+    """
+    renewed_at = mod_time.monotonic()
+    while not stop.wait(renew_interval):
+        try:
+            renewed = renew()
+        except RedisError as e:
+            # Keep retrying until the lease must have elapsed on the server
+            logger.error(e)
+            renewed = mod_time.monotonic() - renewed_at < lease
+            if renewed:
+                continue
+        if not renewed:
+            if not stop.is_set():
+                lose()
+            return
+        renewed_at = mod_time.monotonic()
+
+
+class BaseLeaseLock(object):
+
+    def __init__(self, redis: Any, name: str, lease: float = 10, renew_interval: Optional[float] = None, acquire_timeout: float = 10, blocking: bool = True, on_lost: Optional[Callable] = None):
+        """
+        ``lease`` indicates expire time of the lock in seconds, keep it short for fast failover.
+
+        ``renew_interval`` indicates interval of renewing the lease, Default: a third of ``lease``.
+
+        ``acquire_timeout`` indicates retry time of acquiring lock, ignored when ``blocking`` is False.
+
+        ``on_lost`` a callable called with the lock when ownership was lost.
+        """
+        if lease <= 0:
+            raise ValueError('The lease argument should be positive')
+        self.redis = redis
+        self.name = name
+        self.key = lock_key(name)
+        self.lease = lease
+        self.renew_interval = renew_interval or lease / 3.0
+        self.acquire_timeout = acquire_timeout
+        self.blocking = blocking
+        self.on_lost = on_lost
+        self.identifier = None
+        self.lost = False
+        self.metrics = getattr(redis, 'lock_metrics', None)
+        self.acquired_at = None
+
+    @property
+    def lease_ms(self) -> int:
+        return int(self.lease * 1000)
+
+    def _acquired(self, start: float, acquired: bool, attempts: int):
+        now = mod_time.time()
+        if acquired:
+            self.acquired_at = now
+        if self.metrics:
+            self.metrics.on_acquire(self.name, now - start, acquired, attempts > 1)
+
+    def _released(self):
+        if self.metrics:
+            self.metrics.on_release(self.name, self.acquired_at and mod_time.time() - self.acquired_at)
+
+    def _lose(self):
+        self.lost = True
+        logger.warning('Lock lost: {0}'.format(self.name))
+        if self.metrics:
+            self.metrics.on_lost(self.name)
+        if self.on_lost:
+            self.on_lost(self)
+
+    def ensure_owned(self):
+        """
+        Raise ``LockNotOwnedError`` if ownership was lost, for checkpoints in long tasks.
+        """
+        if self.lost or not self.identifier:
+            raise LockNotOwnedError('Lock {0} is no longer owned'.format(self.name))
+
+
+class LeaseLock(BaseLeaseLock):
+    """
+    Lock with a short lease, renewed by a background thread while the holder is alive.
+
+    Usage::
+
+        with r.lease_lock('name', lease=5) as lock:
+            ...
+            lock.ensure_owned()
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(LeaseLock, self).__init__(*args, **kwargs)
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def acquire(self) -> bool:
+        identifier = uuid.uuid4().hex
+        start = mod_time.time()
+        end = start + (self.acquire_timeout if self.blocking else 0)
+        attempts = 0
+        while True:
+            attempts += 1
+            if self.redis.set(self.key, identifier, px=self.lease_ms, nx=True):
+                break
+            if mod_time.time() >= end:
+                self._acquired(start, False, attempts)
+                return False
+            mod_time.sleep(.001)
+        self._acquired(start, True, attempts)
+        self.identifier, self.lost = identifier, False
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=_watchdog, args=(self.__stop, self.renew, self.lease, self.renew_interval, self._lose), name='lease-lock:{0}'.format(self.name), daemon=True)
+        self.__thread.start()
+        return True
+
+    def renew(self) -> bool:
+        return bool(self.redis.eval(RENEW_LOCK_SCRIPT, 1, self.key, self.identifier, self.lease_ms))
+
+    def release(self) -> bool:
+        """
+        Stop renewing and release the lock, return False if ownership was lost.
+        """
+        self.__stop.set()
+        if self.__thread and self.__thread is not threading.current_thread():
+            self.__thread.join()
+        self.__thread = None
+        if not self.identifier:
+            return False
+        identifier, self.identifier = self.identifier, None
+        if self.lost:
+            return False
+        released = bool(self.redis.eval(RELEASE_LOCK_SCRIPT, 1, self.key, identifier))
+        if released:
+            self._released()
+        elif self.metrics:
+            self.metrics.on_lost(self.name)
+        return released
+
+    def __enter__(self) -> 'LeaseLock':
+        if not self.acquire():
+            raise LockNotOwnedError('Cannot acquire lock {0}'.format(self.name))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class AsyncLeaseLock(BaseLeaseLock):
+    """
+    Asyncio variant of ``LeaseLock`` for ``redis.asyncio`` clients, renewed by an asyncio task.
+
+    Usage::
+
+        async with AsyncLeaseLock(r, 'name', lease=5) as lock:
+            ...
+    """
+
+    def __init__(self, *args, **kwargs):
+        super(AsyncLeaseLock, self).__init__(*args, **kwargs)
+        self.__task = None
+
+    async def acquire(self) -> bool:
+        identifier = uuid.uuid4().hex
+        start = mod_time.time()
+        end = start + (self.acquire_timeout if self.blocking else 0)
+        attempts = 0
+        while True:
+            attempts += 1
+            if await self.redis.set(self.key, identifier, px=self.lease_ms, nx=True):
+                break
+            if mod_time.time() >= end:
+                self._acquired(start, False, attempts)
+                return False
+            await asyncio.sleep(.001)
+        self._acquired(start, True, attempts)
+        self.identifier, self.lost = identifier, False
+        self.__task = asyncio.ensure_future(self.__watchdog())
+        return True
+
+    async def renew(self) -> bool:
+        return bool(await self.redis.eval(RENEW_LOCK_SCRIPT, 1, self.key, self.identifier, self.lease_ms))
+
+    async def __watchdog(self):
+        renewed_at = mod_time.monotonic()
+        while True:
+            await asyncio.sleep(self.renew_interval)
+            try:
+                renewed = await self.renew()
+            except RedisError as e:
+                logger.error(e)
+                renewed = mod_time.monotonic() - renewed_at < self.lease
+                if renewed:
+                    continue
+            if not renewed:
+                self._lose()
+                return
+            renewed_at = mod_time.monotonic()
+
+    async def release(self) -> bool:
+        if self.__task:
+            self.__task.cancel()
+            try:
+                await self.__task
+            except asyncio.CancelledError:
+                pass
+            self.__task = None
+        if not self.identifier:
+            return False
+        identifier, self.identifier = self.identifier, None
+        if self.lost:
+            return False
+        released = bool(await self.redis.eval(RELEASE_LOCK_SCRIPT, 1, self.key, identifier))
+        if released:
+            self._released()
+        elif self.metrics:
+            self.metrics.on_lost(self.name)
+        return released
+
+    async def __aenter__(self) -> 'AsyncLeaseLock':
+        if not await self.acquire():
+            raise LockNotOwnedError('Cannot acquire lock {0}'.format(self.name))
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        await self.release()
+
+
+RedlockLease = namedtuple('RedlockLease', ['name', 'identifier', 'validity'])
+
+
+class Redlock(object):
+    """
+    Quorum-based lock across independent Redis instances, see https://redis.io/docs/manual/patterns/distributed-locks/
+
+    Instances are locked and released in parallel, acquire returns as soon as a majority granted the lock.
+
+    Usage::
+
+        with Redlock([r1, r2, r3]) as rl:
+            with rl.lock('name', ttl=10) as lease:
+                ...
+    """
+
+    clock_drift_factor = 0.01
+
+    def __init__(self, clients: List[Any], retry_count: int = 3, retry_delay: float = 0.2, lock_metrics: Optional[Any] = None):
+        """
+        ``clients`` indicates ``RedisExtensions`` clients of independent instances.
+
+        ``lock_metrics`` indicates ``LockMetricsSink`` reported to, Default: ``lock_metrics`` of the first client.
+
+        ``retry_count`` indicates times of retrying when the quorum not reached.
+
+        ``retry_delay`` indicates max random delay in seconds between two retries.
+        """
+        if not clients:
+            raise ValueError('The clients argument should not be empty')
+        self.clients = clients
+        self.quorum = len(clients) // 2 + 1
+        self.retry_count = retry_count
+        self.retry_delay = retry_delay
+        self.executor = ThreadPoolExecutor(max_workers=len(clients), thread_name_prefix='redlock')
+        self.metrics = lock_metrics or getattr(clients[0], 'lock_metrics', None)
+
+    def __set(self, client: Any, key: str, identifier: str, ttl_ms: int) -> bool:
+        try:
+            return bool(client.set(key, identifier, px=ttl_ms, nx=True))
+        except RedisError as e:
+            logger.error(e)
+            return False
+
+    def __delete(self, client: Any, key: str, identifier: str) -> bool:
+        try:
+            return bool(client.eval(RELEASE_LOCK_SCRIPT, 1, key, identifier))
+        except RedisError as e:
+            logger.error(e)
+            return False
+
+    def __acquire_once(self, key: str, identifier: str, ttl_ms: int) -> bool:
+        futures = [self.executor.submit(self.__set, client, key, identifier, ttl_ms) for client in self.clients]
+        granted = denied = 0
+        for future in as_completed(futures):
+            if future.result():
+                granted += 1
+            else:
+                denied += 1
+            # Bounded by the slowest quorum member, stragglers finish in background
+            if granted >= self.quorum:
+                return True
+            if denied > len(self.clients) - self.quorum:
+                break
+        # Let stragglers finish, so that the following release covers them
+        wait(futures)
+        return False
+
+    def acquire(self, name: str, ttl: float = 10, retry_count: Optional[int] = None, retry_delay: Optional[float] = None) -> Optional[RedlockLease]:
+        """
+        Acquire lock for ``name`` on a majority of instances, return ``RedlockLease`` or None.
+
+        ``ttl`` indicates expire time of the lock in seconds, ``RedlockLease.validity`` is what is left of it after acquiring and clock drift.
+        """
+        key, identifier, ttl_ms = lock_key(name), uuid.uuid4().hex, int(ttl * 1000)
+        drift = ttl * self.clock_drift_factor + 0.002
+        retry_count = self.retry_count if retry_count is None else retry_count
+        retry_delay = self.retry_delay if retry_delay is None else retry_delay
+        begin = mod_time.time()
+        for attempt in range(retry_count + 1):
+            start = mod_time.monotonic()
+            if self.__acquire_once(key, identifier, ttl_ms):
+                validity = ttl - (mod_time.monotonic() - start) - drift
+                if validity > 0:
+                    if self.metrics:
+                        self.metrics.on_acquire(name, mod_time.time() - begin, True, attempt > 0)
+                    return RedlockLease(name, identifier, validity)
+            self.__release(key, identifier)
+            if attempt < retry_count:
+                mod_time.sleep(random.uniform(0, retry_delay))
+        if self.metrics:
+            self.metrics.on_acquire(name, mod_time.time() - begin, False, True)
+        return None
+
+    def __release(self, key: str, identifier: str) -> int:
+        futures = [self.executor.submit(self.__delete, client, key, identifier) for client in self.clients]
+        return sum(future.result() for future in futures)
+
+    def release(self, lease: RedlockLease) -> int:
+        """
+        Release ``lease`` on all instances in parallel, return the number of instances released.
+        """
+        released = self.__release(lock_key(lease.name), lease.identifier)
+        if self.metrics:
+            if released >= self.quorum:
+                self.metrics.on_release(lease.name, None)
+            else:
+                self.metrics.on_lost(lease.name)
+        return released
+
+    def lock(self, name: str, ttl: float = 10, retry_count: Optional[int] = None, retry_delay: Optional[float] = None) -> '_RedlockContext':
+        return _RedlockContext(self, name, ttl, retry_count, retry_delay)
+
+    def close(self):
+        """
+        Shut down the worker threads, call when done with the instance.
+        """
+        self.executor.shutdown()
+
+    def __enter__(self) -> 'Redlock':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class _RedlockContext(object):
+
+    def __init__(self, redlock: Redlock, name: str, ttl: float, retry_count: Optional[int], retry_delay: Optional[float]):
+        self.redlock = redlock
+        self.args = (name, ttl, retry_count, retry_delay)
+        self.lease = None
+
+    def __enter__(self) -> RedlockLease:
+        self.lease = self.redlock.acquire(*self.args)
+        if not self.lease:
+            raise LockNotOwnedError('Cannot acquire lock {0} on a quorum'.format(self.args[0]))
+        return self.lease
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.redlock.release(self.lease)
+
+
+def wait_acquire(redis: Any, channel: str, attempt: Callable[[], bool], blocking: bool = True, acquire_timeout: float = 10, retry_interval: float = 0.1, name: Optional[str] = None) -> bool:
+    """
+    Call ``attempt`` until it succeeds, waiting on ``channel`` notifications between two attempts.
+
+    ``retry_interval`` bounds each wait, in case a notification is missed or a holder lease expires.
+
+    ``name`` indicates lock name reported to ``redis.lock_metrics`` if set.
+    """
+    metrics = name and getattr(redis, 'lock_metrics', None)
+    start = mod_time.time()
+    if attempt():
+        if metrics:
+            metrics.on_acquire(name, mod_time.time() - start, True, False)
+        return True
+    acquired = blocking and _wait_notified(redis, channel, attempt, start + acquire_timeout, retry_interval)
+    if metrics:
+        metrics.on_acquire(name, mod_time.time() - start, acquired, True)
+    return acquired
+
+
+def _wait_notified(redis: Any, channel: str, attempt: Callable[[], bool], end: float, retry_interval: float) -> bool:
+    pubsub = redis.pubsub(ignore_subscribe_messages=True)
+    try:
+        pubsub.subscribe(channel)
+        while True:
+            # Released between the failed attempt and the subscription
+            if attempt():
+                return True
+            remaining = end - mod_time.time()
+            if remaining <= 0:
+                return False
+            pubsub.get_message(timeout=min(remaining, retry_interval))
+    finally:
+        pubsub.close()
+
+
+class Semaphore(object):
+    """
+    Distributed counting semaphore, at most ``limit`` holders, admitted in FIFO order.
+
+    Holders are kept in a sorted set scored by lease deadline, stale holders and waiters are evicted on acquiring.
+
+    Usage::
+
+        with r.semaphore('exports', limit=50):
+            ...
+    """
+
+    def __init__(self, redis: Any, name: str, limit: int, lease: float = 10, acquire_timeout: float = 10, blocking: bool = True, wait_ttl: float = 1, retry_interval: float = 0.1):
+        """
+        ``lease`` indicates seconds a holder is kept without ``renew``.
+
+        ``wait_ttl`` indicates seconds a waiter keeps its place in line without retrying, must be larger than ``retry_interval``.
+        """
+        if limit <= 0:
+            raise ValueError('The limit argument should be positive')
+        self.redis = redis
+        self.name = name
+        self.limit = limit
+        self.lease = lease
+        self.acquire_timeout = acquire_timeout
+        self.blocking = blocking
+        self.wait_ttl = wait_ttl
+        self.retry_interval = retry_interval
+        self.key = '{0}semaphore:{1}'.format(KEY_PREFIX, name)
+        self.keys = [self.key, self.key + ':waiters', self.key + ':seen', self.key + ':ticket']
+        self.channel = self.key + ':notify'
+        self.identifier = None
+        self.acquired_at = None
+
+    def __attempt(self, identifier: str) -> bool:
+        return bool(self.redis.eval(ACQUIRE_SEMAPHORE_SCRIPT, 4, *self.keys, identifier, self.limit, int(self.lease * 1000), int(self.wait_ttl * 1000)))
+
+    def acquire(self) -> bool:
+        identifier = uuid.uuid4().hex
+        if wait_acquire(self.redis, self.channel, lambda: self.__attempt(identifier), blocking=self.blocking, acquire_timeout=self.acquire_timeout, retry_interval=self.retry_interval, name=self.key[len(KEY_PREFIX):]):
+            self.identifier, self.acquired_at = identifier, mod_time.time()
+            return True
+        # Give up the place in line
+        self.redis.eval(RELEASE_SEMAPHORE_SCRIPT, 4, *self.keys[:3], self.channel, identifier)
+        return False
+
+    def renew(self) -> bool:
+        return bool(self.identifier) and bool(self.redis.eval(RENEW_SEMAPHORE_SCRIPT, 1, self.key, self.identifier, int(self.lease * 1000)))
+
+    def release(self) -> bool:
+        if not self.identifier:
+            return False
+        identifier, self.identifier = self.identifier, None
+        released = bool(self.redis.eval(RELEASE_SEMAPHORE_SCRIPT, 4, *self.keys[:3], self.channel, identifier))
+        metrics = getattr(self.redis, 'lock_metrics', None)
+        if metrics:
+            name = self.key[len(KEY_PREFIX):]
+            if released:
+                metrics.on_release(name, mod_time.time() - self.acquired_at)
+            else:
+                metrics.on_lost(name)
+        return released
+
+    def holders(self) -> int:
+        return self.redis.eval(HOLDERS_SEMAPHORE_SCRIPT, 1, self.key)
+
+    def __enter__(self) -> 'Semaphore':
+        if not self.acquire():
+            raise LockNotOwnedError('Cannot acquire semaphore {0}'.format(self.name))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+class ReadWriteLock(object):
+    """
+    Distributed read-write lock, readers share access, a waiting writer blocks new readers.
+
+    ``reading`` and ``writing`` renew the lease by a watchdog thread while held.
+
+    Usage::
+
+        rw = r.rwlock('name')
+        with rw.reading():
+            ...
+        with rw.writing():
+            ...
+    """
+
+    def __init__(self, redis: Any, name: str, lease: float = 10, acquire_timeout: float = 10, blocking: bool = True, wait_ttl: float = 1, retry_interval: float = 0.1, renew_interval: Optional[float] = None, on_lost: Optional[Callable] = None):
+        """
+        ``lease`` indicates seconds a reader or writer is kept without ``renew_read``/``renew_write``.
+
+        ``renew_interval`` indicates interval of renewing the lease while held, Default: a third of ``lease``.
+
+        ``on_lost`` a callable called with the lock and the identifier when ownership was lost.
+        """
+        if lease <= 0:
+            raise ValueError('The lease argument should be positive')
+        self.redis = redis
+        self.name = name
+        self.lease = lease
+        self.renew_interval = renew_interval or lease / 3.0
+        self.on_lost = on_lost
+        self.acquire_timeout = acquire_timeout
+        self.blocking = blocking
+        self.wait_ttl = wait_ttl
+        self.retry_interval = retry_interval
+        key = '{0}rwlock:{1}'.format(KEY_PREFIX, name)
+        self.readers_key, self.writer_key, self.waiting_key = key + ':readers', key + ':writer', key + ':writer:waiting'
+        self.channel = key + ':notify'
+        self.metrics_name = key[len(KEY_PREFIX):]
+
+    def acquire_read(self) -> Optional[str]:
+        identifier = uuid.uuid4().hex
+
+        def attempt():
+            return self.redis.eval(ACQUIRE_READ_SCRIPT, 3, self.readers_key, self.writer_key, self.waiting_key, identifier, int(self.lease * 1000))
+
+        if wait_acquire(self.redis, self.channel, attempt, blocking=self.blocking, acquire_timeout=self.acquire_timeout, retry_interval=self.retry_interval, name=self.metrics_name + ':read'):
+            return identifier
+        return None
+
+    def renew_read(self, identifier: str) -> bool:
+        return bool(self.redis.eval(RENEW_SEMAPHORE_SCRIPT, 1, self.readers_key, identifier, int(self.lease * 1000)))
+
+    def release_read(self, identifier: str) -> bool:
+        return bool(self.redis.eval(RELEASE_READ_SCRIPT, 2, self.readers_key, self.channel, identifier))
+
+    def acquire_write(self) -> Optional[str]:
+        identifier = uuid.uuid4().hex
+
+        def attempt():
+            return self.redis.eval(ACQUIRE_WRITE_SCRIPT, 3, self.readers_key, self.writer_key, self.waiting_key, identifier, int(self.lease * 1000), int(self.wait_ttl * 1000))
+
+        if wait_acquire(self.redis, self.channel, attempt, blocking=self.blocking, acquire_timeout=self.acquire_timeout, retry_interval=self.retry_interval, name=self.metrics_name + ':write'):
+            return identifier
+        self.release_write(identifier)
+        return None
+
+    def renew_write(self, identifier: str) -> bool:
+        return bool(self.redis.eval(RENEW_LOCK_SCRIPT, 1, self.writer_key, identifier, int(self.lease * 1000)))
+
+    def release_write(self, identifier: str) -> bool:
+        return bool(self.redis.eval(RELEASE_WRITE_SCRIPT, 3, self.writer_key, self.waiting_key, self.channel, identifier))
+
+    def __lose(self, identifier: str):
+        logger.warning('Lock lost: {0}'.format(self.name))
+        metrics = getattr(self.redis, 'lock_metrics', None)
+        if metrics:
+            metrics.on_lost(self.metrics_name)
+        if self.on_lost:
+            self.on_lost(self, identifier)
+
+    @contextmanager
+    def __held(self, identifier: str, renew: Callable[[str], bool], release: Callable[[str], bool]) -> Iterator[str]:
+        stop = threading.Event()
+        thread = threading.Thread(target=_watchdog, args=(stop, lambda: renew(identifier), self.lease, self.renew_interval, lambda: self.__lose(identifier)), name='rwlock:{0}'.format(self.name), daemon=True)
+        thread.start()
+        try:
+            yield identifier
+        finally:
+            stop.set()
+            thread.join()
+            release(identifier)
+
+    @contextmanager
+    def reading(self) -> Iterator[str]:
+        identifier = self.acquire_read()
+        if not identifier:
+            raise LockNotOwnedError('Cannot acquire read lock {0}'.format(self.name))
+        with self.__held(identifier, self.renew_read, self.release_read):
+            yield identifier
+
+    @contextmanager
+    def writing(self) -> Iterator[str]:
+        identifier = self.acquire_write()
+        if not identifier:
+            raise LockNotOwnedError('Cannot acquire write lock {0}'.format(self.name))
+        with self.__held(identifier, self.renew_write, self.release_write):
+            yield identifier
@@ -0,0 +1,118 @@
+import bisect
+import threading
+from typing import Any, Dict, Optional, Sequence
+
+
+class LockMetricsSink(object):
+    """
+    Callback interface of lock instrumentation, subclass and override the events you need.
+
+    Pass an instance as ``lock_metrics`` to ``RedisExtensions``, instrumentation is disabled when it's None.
+    """
+
+    def on_acquire(self, name: str, wait: float, acquired: bool, contended: bool):
+        """
+        Called when acquiring ``name`` finished after ``wait`` seconds, ``acquired`` is False when timed out.
+
+        ``contended`` indicates whether the first attempt failed and had to wait.
+        """
+
+    def on_release(self, name: str, held: Optional[float]):
+        """
+        Called when ``name`` was released after being held ``held`` seconds, None when unknown.
+        """
+
+    def on_lost(self, name: str):
+        """
+        Called when ownership of ``name`` was lost before releasing.
+        """
+
+
+class Histogram(object):
+
+    def __init__(self, buckets: Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            'buckets': dict(zip([str(b) for b in self.buckets] + ['+inf'], self.counts)),
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+        }
+
+
+class InMemoryLockMetrics(LockMetricsSink):
+    """
+    Thread-safe in-memory aggregator of lock metrics per lock name.
+
+    Usage::
+
+        metrics = InMemoryLockMetrics()
+        r = RedisExtensions(host='localhost', port=6379, db=0, lock_metrics=metrics)
+        ...
+        metrics.snapshot(reset=True)
+    """
+
+    buckets = (.001, .005, .01, .05, .1, .5, 1, 5, 10, 60)
+
+    def __init__(self, buckets: Optional[Sequence[float]] = None):
+        self.buckets = tuple(buckets or self.buckets)
+        self.__lock = threading.Lock()
+        self.__stats = {}
+
+    def __stat(self, name: str) -> Dict[str, Any]:
+        stat = self.__stats.get(name)
+        if stat is None:
+            stat = self.__stats[name] = {
+                'acquires': 0,
+                'waits': 0,
+                'timeouts': 0,
+                'releases': 0,
+                'lost': 0,
+                'acquire_latency': Histogram(self.buckets),
+                'hold_duration': Histogram(self.buckets),
+            }
+        return stat
+
+    def on_acquire(self, name: str, wait: float, acquired: bool, contended: bool):
+        with self.__lock:
+            stat = self.__stat(name)
+            stat['acquires' if acquired else 'timeouts'] += 1
+            stat['waits'] += contended
+            stat['acquire_latency'].observe(wait)
+
+    def on_release(self, name: str, held: Optional[float]):
+        with self.__lock:
+            stat = self.__stat(name)
+            stat['releases'] += 1
+            if held is not None:
+                stat['hold_duration'].observe(held)
+
+    def on_lost(self, name: str):
+        with self.__lock:
+            self.__stat(name)['lost'] += 1
+
+    def snapshot(self, reset: bool = False) -> Dict[str, Dict[str, Any]]:
+        """
+        Return metrics per lock name, ``reset`` if set to True, will reset after taking the snapshot atomically.
+        """
+        with self.__lock:
+            stats = {name: {k: v.snapshot() if isinstance(v, Histogram) else v for k, v in stat.items()} for name, stat in self.__stats.items()}
+            if reset:
+                self.__stats = {}
+        return stats
+
+    def reset(self):
+        with self.__lock:
+            self.__stats = {}
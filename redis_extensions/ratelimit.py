@@ -0,0 +1,266 @@
+import threading
+import time as mod_time
+import uuid
+from collections import namedtuple
+from typing import Any, Iterable, List, Optional, Tuple
+
+from .extensions import KEY_PREFIX, SERVER_NOW
+
+
+# All scripts: KEYS[1] limiter key; ARGV: limit, period ms, cost, [burst | unique]
+# Return: {allowed, remaining, retry after ms, reset after ms}
+
+# Window starts at the first hit, INCRBY & PEXPIRE atomically
+FIXED_WINDOW_SCRIPT = """
+local limit, period, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local current = tonumber(redis.call('get', KEYS[1]) or '0')
+local ttl = redis.call('pttl', KEYS[1])
+if ttl < 0 then
+    ttl = period
+end
+if current + cost > limit then
+    return {0, math.max(limit - current, 0), ttl, ttl}
+end
+current = redis.call('incrby', KEYS[1], cost)
+if current == cost then
+    redis.call('pexpire', KEYS[1], period)
+end
+return {1, limit - current, 0, ttl}"""
+
+# Sorted set of hit timestamps within the last period
+SLIDING_LOG_SCRIPT = SERVER_NOW + """
+local limit, period, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+redis.call('zremrangebyscore', KEYS[1], '-inf', now - period)
+local count = redis.call('zcard', KEYS[1])
+if count + cost > limit then
+    local retry_after = period
+    if count + cost - limit <= count then
+        local expiring = redis.call('zrange', KEYS[1], count + cost - limit - 1, count + cost - limit - 1, 'withscores')
+        retry_after = tonumber(expiring[2]) + period - now
+    end
+    local newest = redis.call('zrange', KEYS[1], -1, -1, 'withscores')
+    return {0, math.max(limit - count, 0), retry_after, newest[2] and tonumber(newest[2]) + period - now or 0}
+end
+for i = 1, cost do
+    redis.call('zadd', KEYS[1], now, ARGV[4] .. ':' .. i)
+end
+redis.call('pexpire', KEYS[1], period)
+return {1, limit - count - cost, 0, period}"""
+
+# Hash of two fixed window counters, the previous one weighted by its overlap with the sliding window
+SLIDING_WINDOW_SCRIPT = SERVER_NOW + """
+local limit, period, cost = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local window = math.floor(now / period)
+local elapsed = now - window * period
+local current = tonumber(redis.call('hget', KEYS[1], window) or '0')
+local previous = tonumber(redis.call('hget', KEYS[1], window - 1) or '0')
+local estimated = previous * (period - elapsed) / period + current
+if estimated + cost > limit then
+    local retry_after
+    if limit - current - cost >= 0 then
+        -- Within this window, once enough of the previous window slid out
+        retry_after = math.ceil((1 - (limit - current - cost) / previous) * period - elapsed)
+    else
+        -- Within the next window, once enough of this window slid out
+        retry_after = period - elapsed + math.max(math.ceil((1 - (limit - cost) / current) * period), 0)
+    end
+    return {0, math.max(math.floor(limit - estimated), 0), retry_after, 2 * period - elapsed}
+end
+redis.call('hincrby', KEYS[1], window, cost)
+redis.call('hdel', KEYS[1], window - 2)
+redis.call('pexpire', KEYS[1], 2 * period)
+return {1, math.floor(limit - estimated - cost), 0, 2 * period - elapsed}"""
+
+# Generic cell rate algorithm, stores the theoretical arrival time only
+GCRA_SCRIPT = SERVER_NOW + """
+local limit, period, cost, burst = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3]), tonumber(ARGV[4])
+local emission = period / limit
+local tolerance = emission * burst
+local tat = math.max(tonumber(redis.call('get', KEYS[1]) or '0'), now)
+local new_tat = tat + emission * cost
+local allow_at = new_tat - tolerance
+if now < allow_at then
+    return {0, math.max(math.floor((now - (tat - tolerance)) / emission), 0), math.ceil(allow_at - now), math.ceil(tat - now)}
+end
+redis.call('set', KEYS[1], string.format('%.3f', new_tat), 'px', math.ceil(new_tat - now))
+return {1, math.floor((now - allow_at) / emission), 0, math.ceil(new_tat - now)}"""
+
+# KEYS[1] window hash {id, n}; ARGV: limit, period ms, batch, new window id
+# Return: {granted permits, window ttl ms, window id}
+LEASE_PERMITS_SCRIPT = """
+local limit, period, batch = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local ttl = redis.call('pttl', KEYS[1])
+if ttl < 0 then
+    redis.call('del', KEYS[1])
+    redis.call('hset', KEYS[1], 'id', ARGV[4], 'n', 0)
+    redis.call('pexpire', KEYS[1], period)
+    ttl = period
+end
+local current = tonumber(redis.call('hget', KEYS[1], 'n'))
+local granted = math.min(batch, limit - current)
+if granted > 0 then
+    redis.call('hincrby', KEYS[1], 'n', granted)
+else
+    granted = 0
+end
+return {granted, ttl, redis.call('hget', KEYS[1], 'id')}"""
+
+# KEYS[1] window hash {id, n}; ARGV: window id, unused permits
+RETURN_PERMITS_SCRIPT = """
+if redis.call('hget', KEYS[1], 'id') == ARGV[1] then
+    local current = tonumber(redis.call('hget', KEYS[1], 'n'))
+    return redis.call('hset', KEYS[1], 'n', math.max(current - tonumber(ARGV[2]), 0))
+end
+return 0"""
+
+SCRIPTS = {
+    'fixed_window': FIXED_WINDOW_SCRIPT,
+    'sliding_log': SLIDING_LOG_SCRIPT,
+    'sliding_window': SLIDING_WINDOW_SCRIPT,
+    'gcra': GCRA_SCRIPT,
+}
+
+
+RateLimitResult = namedtuple('RateLimitResult', ['allowed', 'remaining', 'retry_after', 'reset_after'])
+
+
+class RateLimiter(object):
+    """
+    Atomic rate limiter, at most ``limit`` hits per ``period`` seconds, each check is a single ``EVALSHA``.
+
+    ``algorithm`` one of:
+        ``fixed_window`` - counter reset every ``period`` from the first hit, cheapest, allows 2x bursts at boundaries.
+        ``sliding_log`` - exact, stores a timestamp per hit, memory grows with ``limit``.
+        ``sliding_window`` - approximated sliding window from two fixed window counters.
+        ``gcra`` - generic cell rate algorithm (token bucket), smooth, ``burst`` hits allowed at once.
+
+    Usage::
+
+        limiter = r.rate_limiter('api', limit=100, period=60)
+        result = limiter.hit(user_id)
+        if not result.allowed:
+            retry in result.retry_after seconds
+    """
+
+    def __init__(self, redis: Any, name: str, limit: int, period: float, algorithm: str = 'gcra', burst: Optional[int] = None):
+        if algorithm not in SCRIPTS:
+            raise ValueError('Algorithm should be one of {0}'.format(', '.join(SCRIPTS)))
+        if limit <= 0 or period <= 0:
+            raise ValueError('The limit and period arguments should be positive')
+        self.redis = redis
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.algorithm = algorithm
+        self.burst = burst or limit
+        self.script = redis.register_script(SCRIPTS[algorithm])
+
+    def key(self, identifier: str = '') -> str:
+        return '{0}ratelimit:{1}:{2}:{3}'.format(KEY_PREFIX, self.algorithm, self.name, identifier)
+
+    def _args(self, cost: int) -> List:
+        # Would never be allowed, and leaves nothing to slide out of an empty window for retry_after
+        if cost > (self.burst if self.algorithm == 'gcra' else self.limit):
+            raise ValueError('The cost argument should not exceed the limit, or the burst of gcra')
+        args = [self.limit, int(self.period * 1000), cost]
+        if self.algorithm == 'gcra':
+            args.append(self.burst)
+        elif self.algorithm == 'sliding_log':
+            args.append(uuid.uuid4().hex)
+        return args
+
+    @staticmethod
+    def _result(res: List) -> RateLimitResult:
+        allowed, remaining, retry_after, reset_after = res
+        return RateLimitResult(bool(allowed), int(remaining), int(retry_after) / 1000.0, int(reset_after) / 1000.0)
+
+    def hit(self, identifier: str = '', cost: int = 1) -> RateLimitResult:
+        """
+        Consume ``cost`` hits of ``identifier`` if allowed, rejected hits are not counted.
+
+        Raise ``ValueError`` if ``cost`` could never be allowed.
+        """
+        return self._result(self.script(keys=[self.key(identifier)], args=self._args(cost)))
+
+    def reset(self, identifier: str = '') -> int:
+        return self.redis.delete(self.key(identifier))
+
+
+def hit_many(redis: Any, checks: Iterable[Tuple[RateLimiter, str, int]]) -> List[RateLimitResult]:
+    """
+    Check multiple ``(limiter, identifier, cost)`` in one round trip, each check is atomic by itself.
+    """
+    checks = list(checks)
+    pipe = redis.pipeline(transaction=False)
+    for limiter, identifier, cost in checks:
+        limiter.script(keys=[limiter.key(identifier)], args=limiter._args(cost), client=pipe)
+    return [RateLimiter._result(res) for res in pipe.execute()]
+
+
+class LeasedRateLimiter(object):
+    """
+    Hybrid rate limiter, at most ``limit`` hits per ``period`` seconds across processes, admitted locally.
+
+    Each process leases ``batch`` permits at a time from a fixed window in Redis and admits hits from the lease
+    without round trips, unused permits are returned when the lease expires after ``lease_time`` seconds.
+
+    Never over-admits, the tradeoff is under-admission while permits are parked in other processes:
+    larger ``batch`` for fewer round trips, smaller ``batch`` and ``lease_time`` for better accuracy.
+
+    Usage::
+
+        limiter = r.leased_rate_limiter('api', limit=10000, period=60, batch=50)
+        if limiter.acquire():
+            ...
+    """
+
+    def __init__(self, redis: Any, name: str, limit: int, period: float, batch: int = 50, lease_time: float = 1):
+        if limit <= 0 or period <= 0 or batch <= 0:
+            raise ValueError('The limit, period and batch arguments should be positive')
+        self.redis = redis
+        self.name = name
+        self.limit = limit
+        self.period = period
+        self.batch = batch
+        self.lease_time = lease_time
+        self.key = '{0}ratelimit:leased:{1}'.format(KEY_PREFIX, name)
+        self.lease_script = redis.register_script(LEASE_PERMITS_SCRIPT)
+        self.return_script = redis.register_script(RETURN_PERMITS_SCRIPT)
+        self.__lock = threading.Lock()
+        self.__permits = 0
+        self.__window = None
+        self.__exhausted = False
+        self.__expires_at = 0
+
+    def __return(self):
+        if self.__permits and self.__window:
+            self.return_script(keys=[self.key], args=[self.__window, self.__permits])
+        self.__permits = 0
+
+    def __lease(self, cost: int):
+        self.__return()
+        batch = max(self.batch, cost)
+        granted, ttl, window = self.lease_script(keys=[self.key], args=[self.limit, int(self.period * 1000), batch, uuid.uuid4().hex])
+        self.__permits, self.__window, self.__exhausted = int(granted), window, int(granted) < batch
+        # Exhausted windows are also cached locally, until the lease or window expires
+        self.__expires_at = mod_time.monotonic() + min(self.lease_time, int(ttl) / 1000.0)
+
+    def acquire(self, cost: int = 1) -> bool:
+        """
+        Admit ``cost`` hits from the local lease, lease new permits from Redis when expired or insufficient.
+        """
+        with self.__lock:
+            if mod_time.monotonic() >= self.__expires_at or (self.__permits < cost and not self.__exhausted):
+                self.__lease(cost)
+            if self.__permits < cost:
+                return False
+            self.__permits -= cost
+            return True
+
+    def close(self):
+        """
+        Return unused permits, call on shutdown.
+        """
+        with self.__lock:
+            self.__return()
+            self.__expires_at = 0
@@ -31,7 +31,7 @@ setup(
     packages=['redis_extensions'],
     py_modules=[],
     python_requires='>=3.7',
-    install_requires=['TimeConvert', 'redis>=4.0.2', 'shortuuid'],
+    install_requires=['TimeConvert', 'redis>=4.2.0', 'shortuuid'],
     extras_require=EXTRAS_REQUIRE,
 
     classifiers=[
@@ -0,0 +1,103 @@
+import threading
+import time
+
+import redis_extensions as redis
+
+
+class TestRedisBloom(object):
+
+    def test_bloom_filter(self):
+        bloom = redis.BloomFilter(capacity=1000, error_rate=0.01)
+        bloom.add(*range(1000))
+        assert all(i in bloom for i in range(1000))
+        false_positives = sum(i in bloom for i in range(1000, 11000))
+        assert false_positives < 300
+        copy = redis.BloomFilter.from_bytes(bloom.to_bytes(), capacity=1000, error_rate=0.01)
+        assert all(str(i) in copy for i in range(1000))
+
+    def test_redis_bloom_filter(self, r):
+        bloom = r.bloom_filter('a', capacity=1000, error_rate=0.01)
+        assert bloom.add('a', 'b') == 2
+        assert bloom.add('a') == 0
+        assert 'a' in bloom
+        assert bloom.contains_many(['a', 'b', 'c']) == [True, True, False]
+        # Same bit layout with the process-local filter
+        local = bloom.snapshot()
+        assert 'a' in local and 'b' in local and 'c' not in local
+        local.add('c')
+        bloom.store(local)
+        assert 'c' in bloom
+        assert bloom.clear()
+
+    def test_set_bloom_cache(self, r):
+        r.sadd('s', *range(100))
+        cache = redis.SetBloomCache(r, 's', capacity=1000, refresh_interval=0.2, channel='s:notify')
+        try:
+            assert cache.might_contain(1)
+            assert not cache.might_contain('a')
+            # Added on notification
+            r.sadd('s', 'a')
+            r.publish('s:notify', 'a')
+            time.sleep(0.2)
+            assert cache.might_contain('a')
+            # Rebuilt after refresh interval, once in background while stale ones served
+            r.sadd('s', 'b')
+            assert not cache.might_contain('b')
+            time.sleep(0.2)
+            r.config_resetstat()
+            threads = [threading.Thread(target=cache.might_contain, args=('b', )) for _ in range(10)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            time.sleep(0.1)
+            assert cache.might_contain('b')
+            assert r.info('commandstats')['cmdstat_sscan']['calls'] == 1
+        finally:
+            cache.close()
+
+    def test_set_bloom_cache_rebuild(self, r, monkeypatch):
+        r.sadd('s', *range(100))
+        cache = redis.SetBloomCache(r, 's', capacity=1000, refresh_interval=0.2, channel='s:notify')
+        errors = []
+        monkeypatch.setattr(threading, 'excepthook', errors.append)
+        scan = r.sscan_iter
+
+        def sscan_iter(*args, **kwargs):
+            yield from scan(*args, **kwargs)
+            # Published after scanned, before the snapshot swapped
+            r.sadd('s', 'c')
+            r.publish('s:notify', 'c')
+            time.sleep(0.2)
+
+        try:
+            # Published without a snapshot, kept for the first one
+            r.sadd('s', 'a')
+            r.publish('s:notify', 'a')
+            time.sleep(0.1)
+            monkeypatch.setattr(r, 'sscan_iter', sscan_iter)
+            assert 'c' in cache.refresh()
+            assert cache.might_contain('a')
+            # Stored with at least 1 second of ``SET EX``
+            redis.SetBloomCache(r, 's', refresh_interval=0.2, shared=r.bloom_filter('s')).refresh()
+            assert r.ttl('r:bloom:s') == 1
+        finally:
+            cache.close()
+        assert not errors
+
+    def test_vcode_black_list_cache(self, r):
+        phone, ipaddr = '18888888888', 'localhost'
+        r.vcode_black_list_cache(refresh_interval=60, shared=True)
+        try:
+            code, overtop, blacklist = r.vcode(phone, ipaddr=ipaddr)
+            assert code and not blacklist
+            assert r.exists('r:bloom:vcode:phone:black:list')
+            # Request too frequently, published into the local snapshots
+            assert r.vcode(phone, ipaddr=ipaddr) == (None, False, True)
+            time.sleep(0.2)
+            assert r.vcode_black_list_caches['phone'].might_contain(phone)
+            # And into the shared copy, for snapshots loaded later
+            assert phone in r.vcode_black_list_caches['phone'].shared
+            assert r.vcode(phone, ipaddr=ipaddr, req_interval=0) == (None, None, True)
+        finally:
+            r.vcode_black_list_cache_close()
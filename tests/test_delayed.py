@@ -0,0 +1,586 @@
+import asyncio
+import json
+import os
+import signal
+import threading
+import time
+
+import pytest
+
+import redis_extensions as redis
+from redis_extensions.extensions import _hash_tag_groups, get_network_ip
+
+
+def _poll_queue(r, seconds=0.5, **kwargs):
+    # Stopped like by ``SIGTERM``
+    threading.Timer(seconds, setattr, (r, 'poll_queue_continue_flag', False)).start()
+    r.poll_queue(**kwargs)
+    r.poll_queue_continue_flag = True
+
+
+class TestRedisDelayed(object):
+
+    delayed = 'r:delayed:default'
+
+    def test_claim_delayed(self, r):
+        for i in range(5):
+            r.execute_later('q', 'n', {'i': i}, delay=0.001)
+        r.execute_later('q', 'n', {'i': 5}, delay=60)
+        time.sleep(0.01)
+        items = r.claim_delayed(batch_size=3)
+        assert [json.loads(item)[3]['i'] for item in items] == [0, 1, 2]
+        assert r.zcard(self.delayed) == 3
+        assert r.zcard('r:delayed:default:inflight') == 3
+        assert r.ack_delayed(self.delayed, *items) == 3
+        # At most once, not kept in flight
+        assert len(r.claim_delayed(batch_size=3, inflight=False)) == 2
+        assert r.zcard('r:delayed:default:inflight') == 0
+        assert r.claim_delayed() == []
+
+    def test_nack_delayed(self, r):
+        r.execute_later('q', 'n', delay=0.001)
+        r.execute_later('q', 'n', delay=0.001)
+        time.sleep(0.01)
+        acked, nacked = r.claim_delayed()
+        assert r.ack_delayed(self.delayed, acked) == 1
+        # Acked ones never requeued
+        assert r.nack_delayed(self.delayed, acked, nacked) == 1
+        assert r.zrange(self.delayed, 0, -1) == [nacked]
+        assert r.lpop('r:delayed:default:wakeup')
+        assert r.nack_delayed(self.delayed, nacked) == 0
+        assert not r.exists('r:delayed:default:wakeup')
+
+    def test_requeue_inflight(self, r):
+        r.execute_later('q', 'n', delay=0.001)
+        time.sleep(0.01)
+        assert len(r.claim_delayed()) == 1
+        # Claimed lately, may still be running
+        assert r.requeue_inflight(older_than=60) == 0
+        assert r.requeue_inflight() == 1
+        assert r.zcard(self.delayed) == 1
+        assert not r.exists('r:delayed:default:inflight')
+        # When launch, only ones claimed before the timeout
+        r.execute_later('q', 'n', delay=0.001)
+        time.sleep(0.01)
+        assert len(r.claim_delayed()) == 2
+        time.sleep(0.2)
+        r.execute_later('q', 'n', delay=0.001)
+        time.sleep(0.01)
+        assert len(r.claim_delayed()) == 1
+        r.poll_queue_continue_flag = False
+        r.poll_queue(release_lock_eth0_inet_addr=get_network_ip(), task_timeout=0.1)
+        assert r.zcard(self.delayed) == 2
+        assert r.zcard('r:delayed:default:inflight') == 1
+        # All without timeouts, as crashed consumers left them
+        r.poll_queue(release_lock_eth0_inet_addr=get_network_ip())
+        r.poll_queue_continue_flag = True
+        assert r.zcard(self.delayed) == 3
+        assert not r.exists('r:delayed:default:inflight')
+        with pytest.warns(DeprecationWarning):
+            r.release_poll_queue_lock(self.delayed)
+
+    def test_poll_queue(self, r):
+        consumed = []
+        for i in range(10):
+            r.execute_later('q', 'n', {'i': i}, delay=0.001)
+        r.execute_later('error', 'n', delay=0.001)
+        time.sleep(0.01)
+
+        def error(name, args):
+            raise ValueError(name)
+
+        _poll_queue(r, callbacks={'q': lambda name, args: consumed.append(args['i']), 'error': error}, enable_queue=True, release_lock_when_error=False, batch_size=3)
+        assert consumed == list(range(10))
+        assert r.llen('r:queue:q') == 10
+        assert not r.exists(self.delayed)
+        # Kept in flight when failed
+        assert r.zcard('r:delayed:default:inflight') == 1
+
+    def test_poll_queue_at_most_once(self, r):
+        consumed = []
+        for i in range(10):
+            r.execute_later('q', 'n', {'i': i}, delay=0.001)
+        time.sleep(0.01)
+        _poll_queue(r, callbacks={'q': lambda name, args: consumed.append(args['i'])}, enable_auto_zrem=True, enable_queue=True)
+        assert consumed == list(range(10))
+        assert r.llen('r:queue:q') == 10
+        assert not r.exists(self.delayed)
+        assert not r.exists('r:delayed:default:inflight')
+
+    def test_poll_queue_wakeup(self, r):
+        consumed = []
+
+        def produce():
+            time.sleep(0.2)
+            r.execute_later('q', 'n', {'at': time.time() + 0.05}, delay=0.05)
+            r.execute_later('q', 'n', {'at': time.time() + 0.3}, delay=0.3)
+            time.sleep(0.5)
+            r.poll_queue_continue_flag = False
+            r.lpush('r:delayed:default:wakeup', 1)
+
+        def callback(name, args):
+            consumed.append(time.time() - args['at'])
+
+        threading.Thread(target=produce).start()
+        r.config_resetstat()
+        start = time.time()
+        # Sleeps up to 5 seconds when idle, woken up by the producer
+        r.poll_queue(callbacks={'q': callback}, max_wait=5)
+        r.poll_queue_continue_flag = True
+        assert time.time() - start < 1
+        assert len(consumed) == 2
+        assert all(0 <= latency < 0.05 for latency in consumed)
+        # Claims only when woken up or due, instead of every 10 ms
+        assert r.info('commandstats')['cmdstat_evalsha']['calls'] < 20
+
+    def test_poll_queue_executor(self, r):
+        running, peaks = [], []
+        lock = threading.Lock()
+
+        def slow(name, args):
+            with lock:
+                running.append(args['i'])
+                peaks.append(len(running))
+            time.sleep(0.1)
+            with lock:
+                running.remove(args['i'])
+
+        for i in range(8):
+            r.execute_later('slow', 'n', {'i': i}, delay=0.001)
+        time.sleep(0.01)
+        start = time.time()
+        _poll_queue(r, seconds=0.5, callbacks={'slow': slow}, executor='thread', max_workers=4, queue_concurrency={'slow': 2}, max_wait=0.1)
+        assert max(peaks) == 2
+        assert len(peaks) == 8
+        assert time.time() - start < 1
+        assert not r.exists(self.delayed)
+        assert not r.exists('r:delayed:default:inflight')
+
+    def test_poll_queue_executor_wait(self, r):
+        consumed = []
+        r.execute_later('slow', 'n', delay=0.001)
+        time.sleep(0.01)
+        r.config_resetstat()
+        threading.Timer(0.3, r.execute_later, ('slow', 'n'), {'delay': 0.001}).start()
+        _poll_queue(r, seconds=1, callbacks={'slow': lambda name, args: (time.sleep(0.8), consumed.append(time.time()))}, executor='thread', max_wait=0.5)
+        # Claims while a callback runs only when woken up or due, instead of every 10 ms
+        assert r.info('commandstats')['cmdstat_evalsha']['calls'] < 15
+        # Woken up by the new item, while the first one still runs
+        assert len(consumed) == 2 and consumed[1] - consumed[0] < 0.5
+
+    def test_poll_queue_executor_drain(self, r):
+        consumed = []
+
+        def slow(name, args):
+            time.sleep(0.3)
+            consumed.append(args['i'])
+
+        for i in range(4):
+            r.execute_later('slow', 'n', {'i': i}, delay=0.001)
+        time.sleep(0.01)
+        # Stopped within ``max_wait``
+        _poll_queue(r, seconds=0.1, callbacks={'slow': slow}, executor='thread', max_workers=2, queue_concurrency={'slow': 1}, task_timeout=5, max_wait=0.05)
+        # Running one finished, claimed but not started one requeued, others never claimed by backpressure
+        assert len(consumed) == 1
+        assert r.zcard(self.delayed) == 3
+        assert not r.exists('r:delayed:default:inflight')
+
+    def test_poll_queue_executor_timeout(self, r):
+        r.execute_later('slow', 'n', delay=0.001)
+        time.sleep(0.01)
+        _poll_queue(r, seconds=0.3, callbacks={'slow': lambda name, args: time.sleep(0.5)}, executor='thread', task_timeout=0.1, release_lock_when_error=False, drain_timeout=1)
+        # Handled as failed, kept in flight
+        assert r.zcard('r:delayed:default:inflight') == 1
+
+    def test_execute_later_many(self, r):
+        tasks = (('q', 'n', {'i': i}, 0.001 if i % 2 else 0) for i in range(25))
+        r.config_resetstat()
+        identifiers = r.execute_later_many(tasks, chunk_size=10, enable_queue=True, shards=2)
+        # Lazy, written when iterated
+        assert not r.exists('r:queue:q')
+        assert len(list(identifiers)) == 25
+        # One round trip per chunk
+        assert r.info('commandstats')['cmdstat_zadd']['calls'] <= 6
+        assert r.llen('r:queue:q') == 13
+        keys = redis.delayed_shard_keys(self.delayed, 2)
+        assert sum(r.zcard(key) for key in keys) == 12
+        # Optional args and delay omitted
+        assert len(list(r.execute_later_many([('q', 'n'), ('q', 'n', {'i': 25})], enable_queue=True))) == 2
+        assert [json.loads(item)[3] for item in r.lrange('r:queue:q', -2, -1)] == [None, {'i': 25}]
+        time.sleep(0.01)
+        consumed = []
+        _poll_queue(r, seconds=0.2, callbacks={'q': lambda name, args: consumed.append(args['i'])}, shards=2, max_wait=0.1)
+        assert sorted(consumed) == list(range(1, 25, 2))
+
+    def test_compact(self, r):
+        identifier = r.execute_later('q', 'n', {'i': 0}, delay=0.001, compact=True)
+        r.execute_later('q', 'n', {'i': 1}, delay=0.002)
+        # Member is only the identifier
+        assert r.zrange(self.delayed, 0, 0) == [identifier]
+        assert json.loads(r.hget('r:delayed:default:payload', identifier)) == [identifier, 'q', 'n', {'i': 0}]
+        time.sleep(0.01)
+        # Mixed with full items
+        items = r.claim_delayed()
+        assert [json.loads(item)[3]['i'] for item in items] == [0, 1]
+        assert r.zscore('r:delayed:default:inflight', identifier)
+        assert r.fail_delayed(self.delayed, items[0], max_attempts=1) == 0
+        assert r.dead_letters() == items[:1]
+        assert r.replay_dead_letters(items=items[:1]) == 1
+        assert r.claim_delayed() == items[:1]
+        assert r.ack_delayed(self.delayed, *items) == 2
+        assert not r.exists('r:delayed:default:payload', 'r:delayed:default:inflight')
+        # Late nacks never requeue acked compact items, as full items
+        assert r.nack_delayed(self.delayed, *items) == 0
+        assert not r.exists(self.delayed)
+        # At most once
+        list(r.execute_later_many([('q', 'n', None, 0.001)] * 3, compact=True, shards=2))
+        time.sleep(0.01)
+        consumed = []
+        _poll_queue(r, seconds=0.2, callbacks={'q': lambda name, args: consumed.append(name)}, enable_auto_zrem=True, shards=2, max_wait=0.1)
+        assert consumed == ['n'] * 3
+        assert not r.exists(*['{0}:payload'.format(key) for key in redis.delayed_shard_keys(self.delayed, 2)])
+
+    def test_priority(self, r):
+        for i in range(5):
+            r.execute_later('bulk', 'n', {'i': i}, delay=0.001)
+        r.execute_later('reset', 'n', {'i': 5}, delay=0.002, priority=10, compact=True)
+        list(r.execute_later_many([('reset', 'n', {'i': 6}, 0.002, 10)]))
+        assert r.zcard(redis.delayed_lane_key(self.delayed, 10)) == 2
+        time.sleep(0.01)
+        # Not claimed by consumers of other lanes
+        assert r.claim_delayed(batch_size=1, priorities=[5]) == []
+        # Strict priority, one call across lanes
+        r.config_resetstat()
+        items, next_due = r.claim_delayed(batch_size=3, priorities=[0, 10], with_next_due=True)
+        assert [json.loads(item)[3]['i'] for item in items] == [5, 6, 0]
+        assert next_due < time.time()
+        assert r.info('commandstats')['cmdstat_evalsha']['calls'] == 1
+        # Lanes not passed are never touched, left in flight
+        assert r.fail_delayed(self.delayed, items[0], backoff=0) == -1
+        assert r.nack_delayed(self.delayed, items[1]) == 0
+        assert r.requeue_inflight() == 1
+        assert r.zcard('r:delayed:default:inflight') == 2
+        # Retried in their lane
+        assert r.fail_delayed(self.delayed, items[0], backoff=0, priorities=[0, 10]) == 1
+        assert r.zcard(redis.delayed_lane_key(self.delayed, 10)) == 1
+        assert r.ack_delayed(self.delayed, items[1]) == 1
+        assert r.hlen('r:delayed:default:priority') == 1
+        consumed = []
+        _poll_queue(r, seconds=0.2, callbacks={'bulk': lambda name, args: consumed.append(args['i']), 'reset': lambda name, args: consumed.append(args['i'])}, priorities=[0, 10], max_wait=0.1)
+        # Requeued due at its claimed time, after the others
+        assert consumed == [5, 1, 2, 3, 4, 0]
+        assert not r.exists('r:delayed:default:priority', 'r:delayed:default:payload')
+
+    def test_priority_weights_aging(self, r):
+        for i in range(4):
+            r.execute_later('bulk', 'n', {'i': i}, delay=0.001)
+            r.execute_later('reset', 'n', {'i': i}, delay=0.001, priority=1)
+        time.sleep(0.01)
+        items = r.claim_delayed(batch_size=4, priorities=[0, 1], priority_weights={1: 3, 0: 1})
+        assert [json.loads(item)[1] for item in items] == ['reset'] * 3 + ['bulk']
+        # Overdue lower lanes first
+        items = r.claim_delayed(batch_size=3, priorities=[0, 1], priority_aging=0.005)
+        assert [json.loads(item)[1] for item in items] == ['bulk'] * 3
+        with pytest.raises(ValueError):
+            r.claim_delayed(priorities=[0, 1], priority_weights={2: 1})
+
+    def test_dedup(self, r):
+        identifier = r.execute_later('q', 'n', {'v': 1}, delay=60, dedup_key='user:1')
+        # Keep
+        assert r.execute_later('q', 'n', {'v': 2}, delay=30, dedup_key='user:1') == identifier
+        assert r.zcard(self.delayed) == 1
+        # Earliest & latest, rescheduled
+        assert r.execute_later('q', 'n', {'v': 2}, delay=120, dedup_key='user:1', dedup_policy='earliest') == identifier
+        assert r.execute_later('q', 'n', {'v': 2}, delay=30, dedup_key='user:1', dedup_policy='earliest') == identifier
+        assert r.zscore(self.delayed, r.zrange(self.delayed, 0, 0)[0]) < time.time() + 31
+        assert r.execute_later('q', 'n', {'v': 2}, delay=90, dedup_key='user:1', dedup_policy='latest') == identifier
+        assert r.zscore(self.delayed, r.zrange(self.delayed, 0, 0)[0]) > time.time() + 89
+        assert json.loads(r.zrange(self.delayed, 0, 0)[0])[3] == {'v': 1}
+        # Replace
+        replaced = r.execute_later('q', 'n', {'v': 3}, delay=0.001, dedup_key='user:1', dedup_policy='replace', compact=True)
+        assert replaced != identifier
+        assert r.zrange(self.delayed, 0, -1) == [replaced]
+        time.sleep(0.01)
+        items = r.claim_delayed()
+        assert json.loads(items[0])[3] == {'v': 3}
+        # In flight
+        assert r.execute_later('q', 'n', delay=60, dedup_key='user:1', dedup_policy='replace') == replaced
+        assert r.ack_delayed(self.delayed, *items) == 1
+        assert r.execute_later('q', 'n', delay=60, dedup_key='user:1') != replaced
+        assert r.pttl('r:delayed:default:dedup:user:1') > 3600 * 1000
+        # Pending in another lane, kept
+        prioritized = r.execute_later('q', 'n', delay=60, dedup_key='user:2', priority=5)
+        assert r.execute_later('q', 'n', delay=30, dedup_key='user:2', dedup_policy='replace') == prioritized
+        assert r.zrange(redis.delayed_lane_key(self.delayed, 5), 0, -1, withscores=True)[0][1] > time.time() + 59
+        # Dead in a lane not passed, no duplicate
+        dead = r.execute_later('q', 'n', delay=0.001, dedup_key='user:3', priority=5)
+        time.sleep(0.01)
+        assert r.fail_delayed(self.delayed, r.claim_delayed(priorities=[5])[0], max_attempts=1, priorities=[5]) == 0
+        assert r.execute_later('q', 'n', delay=60, dedup_key='user:3') != dead
+        with pytest.raises(ValueError):
+            r.execute_later('q', 'n', delay=60, dedup_key='user:1', dedup_policy='first')
+        with pytest.raises(ValueError):
+            r.execute_later('q', 'n', dedup_key='user:1')
+
+    def test_dedup_sharded(self, r):
+        identifiers = {r.execute_later('q', 'n', delay=60, dedup_key='user:1', shards=4, dedup_ttl=1) for _ in range(10)}
+        assert len(identifiers) == 1
+        assert sum(r.zcard(key) for key in redis.delayed_shard_keys(self.delayed, 4)) == 1
+
+    def test_fail_delayed(self, r):
+        r.execute_later('q', 'n', delay=0.001)
+        time.sleep(0.01)
+        item = r.claim_delayed()[0]
+        now = time.time()
+        # Exponential backoff with jitter, 1 then 2 seconds
+        assert r.fail_delayed(self.delayed, item, max_attempts=3, backoff=1) == 1
+        assert 0.5 <= r.zscore(self.delayed, item) - now <= 1.1
+        assert r.fail_delayed(self.delayed, item, max_attempts=3) == -1
+        r.zadd(self.delayed, {item: 0})
+        assert r.claim_delayed() == [item]
+        assert r.fail_delayed(self.delayed, item, max_attempts=3, backoff=1) == 2
+        assert 1 <= r.zscore(self.delayed, item) - now <= 2.1
+        r.zadd(self.delayed, {item: 0})
+        assert r.claim_delayed() == [item]
+        # Dead after max attempts
+        assert r.fail_delayed(self.delayed, item, max_attempts=3) == 0
+        assert not r.exists(self.delayed, 'r:delayed:default:inflight', 'r:delayed:default:attempts')
+        assert r.dead_letters() == [item]
+        assert r.replay_dead_letters() == 1
+        assert r.dead_letters() == []
+        assert r.claim_delayed() == [item]
+        assert r.ack_delayed(self.delayed, item) == 1
+
+    def test_visibility_timeout(self, r):
+        r.execute_later('q', 'n', delay=0.001)
+        time.sleep(0.01)
+        item = r.claim_delayed(visibility_timeout=0.1)[0]
+        assert r.claim_delayed(visibility_timeout=0.1) == []
+        time.sleep(0.1)
+        # Claimed again as a failed attempt
+        assert r.claim_delayed(visibility_timeout=0.1) == [item]
+        assert r.hget('r:delayed:default:attempts', json.loads(item)[0]) == '1'
+        time.sleep(0.1)
+        assert r.claim_delayed(visibility_timeout=0.1, max_attempts=2) == []
+        assert r.dead_letters() == [item]
+
+    def test_poll_queue_retry(self, r):
+        calls = {'flaky': 0, 'error': 0}
+
+        def flaky(name, args):
+            calls[name] += 1
+            if name == 'error' or calls[name] < 2:
+                raise ValueError(name)
+
+        r.execute_later('flaky', 'flaky', delay=0.001)
+        r.execute_later('error', 'error', delay=0.001)
+        time.sleep(0.01)
+        _poll_queue(r, seconds=0.6, callbacks={'flaky': flaky, 'error': flaky}, max_attempts=3, retry_backoff=0.1, max_wait=0.1)
+        assert calls == {'flaky': 2, 'error': 3}
+        assert not r.exists(self.delayed, 'r:delayed:default:inflight', 'r:delayed:default:attempts')
+        # Failed 3 times, dead
+        assert [json.loads(item)[1] for item in r.dead_letters()] == ['error']
+
+    # Asyncio Section
+
+    def test_async_poll_queue(self, r):
+        async def run():
+            async with redis.AsyncRedisExtensions(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                running, peaks, consumed = set(), [], []
+
+                async def callback(name, args):
+                    running.add(args['i'])
+                    peaks.append(len(running))
+                    await asyncio.sleep(0.1)
+                    running.discard(args['i'])
+                    consumed.append(args['i'])
+
+                for i in range(200):
+                    await client.execute_later('q', 'n', {'i': i}, delay=0.001)
+                r.execute_later('sync', 'n', delay=0.001)
+                await asyncio.sleep(0.01)
+                asyncio.get_running_loop().call_later(0.5, setattr, client, 'poll_queue_continue_flag', False)
+                start = time.time()
+                await client.poll_queue(callbacks={'q': callback, 'sync': lambda name, args: consumed.append(name)}, concurrency=100, max_wait=0.1)
+                assert time.time() - start < 1
+                assert max(peaks) == 100
+                assert set(consumed) == set(range(200)) | {'n'}
+                assert not await client.exists(self.delayed, 'r:delayed:default:inflight')
+
+        asyncio.run(run())
+
+    def test_async_poll_queue_cancel(self, r):
+        async def run():
+            async with redis.AsyncRedisExtensions(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                for i in range(3):
+                    await client.execute_later('q', 'n', {'i': i}, delay=0.001)
+                await asyncio.sleep(0.01)
+
+                async def callback(name, args):
+                    await asyncio.sleep(10)
+
+                consumer = asyncio.ensure_future(client.poll_queue(callbacks={'q': callback}))
+                await asyncio.sleep(0.1)
+                assert await client.zcard('r:delayed:default:inflight') == 3
+                consumer.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await consumer
+                # Cancelled ones requeued
+                assert await client.zcard(self.delayed) == 3
+                assert not await client.exists('r:delayed:default:inflight')
+                # Timed out ones kept in flight
+                asyncio.get_running_loop().call_later(0.3, setattr, client, 'poll_queue_continue_flag', False)
+                await client.poll_queue(callbacks={'q': callback}, task_timeout=0.1, release_lock_when_error=False)
+                assert await client.zcard('r:delayed:default:inflight') == 3
+                # Blocking ones keep running, left in flight instead of requeued
+                assert await client.requeue_inflight() == 3
+                client.poll_queue_continue_flag = True
+                consumer = asyncio.ensure_future(client.poll_queue(callbacks={'q': lambda name, args: time.sleep(0.2)}))
+                await asyncio.sleep(0.1)
+                consumer.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await consumer
+                assert not await client.exists(self.delayed)
+                assert await client.zcard('r:delayed:default:inflight') == 3
+
+        asyncio.run(run())
+
+    def test_async_execute_later_many(self, r):
+        async def run():
+            async with redis.AsyncRedisExtensions(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                identifiers = [identifier async for identifier in client.execute_later_many((('q', 'n', None, 60) for _ in range(25)), chunk_size=10)]
+                assert len(set(identifiers)) == 25
+                assert await client.zcard(self.delayed) == 25
+                # Optional args, delay and priority omitted
+                identifiers = [identifier async for identifier in client.execute_later_many([('q', 'n'), ('q', 'n', None), ('q', 'n', None, 60), ('q', 'n', None, 60, 10)], enable_queue=True)]
+                assert len(identifiers) == 4
+                assert await client.llen('r:queue:q') == 2
+                assert await client.zcard(self.delayed) == 26
+                assert await client.zcard(redis.delayed_lane_key(self.delayed, 10)) == 1
+
+        asyncio.run(run())
+
+    def test_async_poll_queue_retry(self, r):
+        async def run():
+            async with redis.AsyncRedisExtensions(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                calls = []
+
+                async def error(name, args):
+                    calls.append(name)
+                    raise ValueError(name)
+
+                assert await client.execute_later('error', 'n', delay=0.001, dedup_key='error') == await client.execute_later('error', 'n', delay=0.001, dedup_key='error')
+                await asyncio.sleep(0.01)
+                asyncio.get_running_loop().call_later(0.5, setattr, client, 'poll_queue_continue_flag', False)
+                await client.poll_queue(callbacks={'error': error}, max_attempts=2, retry_backoff=0.1, max_wait=0.1)
+                assert len(calls) == 2
+                assert not await client.exists(self.delayed, 'r:delayed:default:inflight')
+                assert await client.zcard('r:delayed:default:dead') == 1
+
+        asyncio.run(run())
+
+    # Shards Section
+
+    def test_sharded(self, r):
+        consumed = []
+        for i in range(40):
+            r.execute_later('q', 'n', {'i': i}, delay=0.001, shards=4)
+        keys = redis.delayed_shard_keys(self.delayed, 4)
+        assert keys[0] == '{r:delayed:default:0}'
+        # Spread over shards
+        assert all(r.zcard(key) for key in keys)
+        counts = [r.zcard(key) for key in keys]
+        assert sum(counts) == 40
+        time.sleep(0.01)
+        # Owning shards 0 & 1
+        _poll_queue(r, seconds=0.3, callbacks={'q': lambda name, args: consumed.append(args['i'])}, shards=4, shard_ids=[0, 1], batch_size=3, max_wait=0.1)
+        assert len(consumed) == counts[0] + counts[1]
+        assert not r.exists(*keys[:2])
+        assert [r.zcard(key) for key in keys[2:]] == counts[2:]
+        # Round-robin over all shards
+        _poll_queue(r, seconds=0.3, callbacks={'q': lambda name, args: consumed.append(args['i'])}, shards=4, max_wait=0.1)
+        assert sorted(consumed) == list(range(40))
+        assert not r.exists(*keys)
+        assert not r.exists(*['{0}:inflight'.format(key) for key in keys])
+
+    def test_sharded_wakeup(self, r):
+        consumed = []
+
+        def produce():
+            time.sleep(0.2)
+            for i in range(4):
+                r.execute_later('q', 'n', {'at': time.time() + 0.05}, delay=0.05, shards=4)
+            time.sleep(0.3)
+            r.poll_queue_continue_flag = False
+            r.lpush('{r:delayed:default:0}:wakeup', 1)
+
+        threading.Thread(target=produce).start()
+        r.poll_queue(callbacks={'q': lambda name, args: consumed.append(time.time() - args['at'])}, max_wait=5, shards=4)
+        r.poll_queue_continue_flag = True
+        assert len(consumed) == 4
+        assert all(0 <= latency < 0.05 for latency in consumed)
+
+    def test_sharded_hash_tags(self, r, monkeypatch):
+        commands = []
+        execute_command = r.execute_command
+
+        def record(*args, **options):
+            commands.append(args)
+            return execute_command(*args, **options)
+
+        monkeypatch.setattr(r, 'execute_command', record)
+        for i in range(8):
+            r.execute_later('q', 'n', {'i': i}, delay=0.001, shards=4, priority=i % 2, dedup_key=str(i), compact=bool(i % 3))
+        time.sleep(0.01)
+
+        def fail(name, args):
+            raise ValueError(args['i'])
+
+        _poll_queue(r, seconds=0.5, callbacks={'q': fail}, shards=4, max_wait=0.2, priorities=[0, 1], max_attempts=1, visibility_timeout=1)
+        assert r.replay_dead_letters(shards=4, priorities=[0, 1]) == 8
+        assert sum(r.requeue_inflight(key) for key in redis.delayed_shard_keys(self.delayed, 4)) == 0
+        # Every command of many keys in one cluster slot
+        multi = [args[3:3 + int(args[2])] if args[0] == 'EVALSHA' else args[1:-1] for args in commands if args[0] in ('EVALSHA', 'BLPOP')]
+        assert any(args[0] == 'BLPOP' for args in commands)
+        assert all(len(_hash_tag_groups(keys)) == 1 for keys in multi)
+
+    def test_async_sharded_wakeup(self):
+        async def run():
+            async with redis.AsyncRedisExtensions(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                consumed = []
+
+                async def callback(name, args):
+                    consumed.append(time.time() - args['at'])
+
+                async def produce():
+                    await asyncio.sleep(0.2)
+                    for i in range(4):
+                        await client.execute_later('q', 'n', {'at': time.time() + 0.05}, delay=0.05, shards=4)
+                    await asyncio.sleep(0.3)
+                    client.poll_queue_continue_flag = False
+
+                producer = asyncio.ensure_future(produce())
+                await client.poll_queue(callbacks={'q': callback}, max_wait=5, shards=4)
+                await producer
+                assert len(consumed) == 4
+                assert all(0 <= latency < 0.05 for latency in consumed)
+
+        asyncio.run(run())
+
+    def test_async_poll_queue_signals(self):
+        async def run():
+            async with redis.AsyncRedisExtensions(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                # Host application's handlers untouched by default
+                handler = signal.getsignal(signal.SIGTERM)
+                asyncio.get_running_loop().call_later(0.1, lambda: consumed.append(signal.getsignal(signal.SIGTERM)))
+                asyncio.get_running_loop().call_later(0.2, client.stop)
+                consumed = []
+                await client.poll_queue(max_wait=0.1)
+                assert consumed == [handler]
+                # Opt-in
+                client.poll_queue_continue_flag = True
+                asyncio.get_running_loop().call_later(0.1, os.kill, os.getpid(), signal.SIGTERM)
+                await asyncio.wait_for(client.poll_queue(max_wait=0.1, handle_signals=True), 1)
+                assert signal.getsignal(signal.SIGTERM) == handler
+
+        asyncio.run(run())
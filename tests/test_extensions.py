@@ -1,7 +1,9 @@
+import datetime
 import json
 import time
 
 import pytest
+from TimeConvert import TimeConvert as tc
 
 
 class TestRedisExtensionsCommands(object):
@@ -665,6 +667,49 @@ class TestRedisExtensionsCommands(object):
         identifier = r.quote(lurl)
         assert r.unquote(identifier) == lurl
 
+    # SignIns Section
+
+    def test_signin_bitmap(self, r):
+        status = r.signin_bitmap_status('a')
+        assert not status['signed_today']
+        assert status['signin_days'] == 0
+        status = r.signin_bitmap('a')
+        assert status['signed_today']
+        assert status['delta_days'] > 1
+        assert (status['signin_days'], status['signin_total_days'], status['signin_longest_days']) == (1, 1, 1)
+        # Duplicate Signin
+        status = r.signin_bitmap('a')
+        assert status['delta_days'] == 0
+        assert status['signin_total_days'] == 1
+        assert r.signin_bitmap_status('a') == status
+        assert r.signin_bitmap_year_days('a') == 1
+        today = tc.local_date()
+        assert r.signin_bitmap_calendar('a')[today.day - 1]
+        assert sum(r.signin_bitmap_calendar('a')) == 1
+
+    def test_signin_bitmap_continuous(self, r):
+        yesterday = tc.local_date() - datetime.timedelta(days=1)
+        r.hset('r:signin:stats:a', mapping={'last': yesterday.toordinal(), 'days': 3, 'total': 5, 'longest': 3})
+        assert r.signin_bitmap_status('a')['signin_days'] == 3
+        status = r.signin_bitmap('a')
+        assert status['delta_days'] == 1
+        assert (status['signin_days'], status['signin_total_days'], status['signin_longest_days']) == (4, 6, 4)
+        r.hset('r:signin:stats:b', mapping={'last': yesterday.toordinal() - 1, 'days': 3, 'total': 5, 'longest': 3})
+        assert r.signin_bitmap_status('b')['signin_days'] == 0
+        status = r.signin_bitmap('b')
+        assert (status['signin_days'], status['signin_total_days'], status['signin_longest_days']) == (1, 6, 3)
+        assert [x['signin_days'] for x in r.signin_bitmap_status_many(['a', 'b', 'c'])] == [4, 1, 0]
+
+    def test_signin_bitmap_migrate(self, r):
+        assert not r.signin_bitmap_migrate('a')
+        r.signin('a')
+        assert r.signin_bitmap_migrate('a', delete=True)
+        assert not r.exists('r:signin:info:a')
+        status = r.signin_bitmap_status('a')
+        assert status['signed_today']
+        assert (status['signin_days'], status['signin_total_days'], status['signin_longest_days']) == (1, 1, 1)
+        assert r.signin_bitmap('a')['signin_total_days'] == 1
+
     # Token Section
 
     def test_token(self, r):
@@ -681,6 +726,50 @@ class TestRedisExtensionsCommands(object):
         assert not r.token_exists('a', token2)
         assert not r.token_exists('a', u'中文')
 
+    def test_token_rotate(self, r):
+        token = r.token('a', time=100)
+        token2 = r.token('a', time=100, buf_time=10)
+        assert r.get('r:token:a') == token2
+        assert r.get('r:token:buffer:a') == token
+        assert 0 < r.ttl('r:token:a') <= 100
+        assert 0 < r.ttl('r:token:buffer:a') <= 10
+        r.token('a', ex=False, buf=False)
+        assert r.ttl('r:token:a') == -1
+        assert r.get('r:token:buffer:a') == token
+
+    def test_token_exists_many(self, r):
+        token = r.token('a')
+        token2 = r.token('a')
+        token3 = r.token('b')
+        assert r.token_exists_many([('a', token), ('a', token2), ('b', token3), ('b', token), ('c', token)]) == [True, True, True, False, False]
+        assert r.token_exists_many([]) == []
+
+    def test_token_signed(self, r):
+        with pytest.raises(ValueError):
+            r.token('a', signed=True)
+        with pytest.raises(ValueError):
+            r.token_exists('a', 'invalid', signed=True)
+        r.token_secret = 'secret'
+        token = r.token('a', signed=True)
+        assert not r.keys('r:token:*')
+        assert r.token_exists('a', token, signed=True)
+        assert not r.token_exists('b', token, signed=True)
+        assert not r.token_exists('a', token[:-1], signed=True)
+        assert not r.token_exists('a', 'invalid', signed=True)
+        assert not r.token_exists('a', token.rsplit('.', 1)[0] + '.签名', signed=True)
+        # Unique in the same second
+        assert r.token('a', signed=True) != r.token('a', signed=True)
+        # Expired
+        assert not r.token_exists('a', r.token('a', time=-1, signed=True), signed=True)
+        assert r.token_exists('a', r.token('a', ex=False, signed=True), signed=True)
+        # Revoked
+        assert r.token_revoke('a') == 1
+        assert not r.token_exists('a', token, signed=True)
+        assert r.token_exists('a', r.token('a', signed=True), signed=True)
+        # Another secret
+        r.token_secret = b'another'
+        assert not r.token_exists('a', token, signed=True)
+
     def test_token_delete(self, r):
         token = r.token('a')
         assert r.token_exists('a', token)
@@ -703,6 +792,43 @@ class TestRedisExtensionsCommands(object):
         with pytest.raises(ValueError):
             r.multi_rpop('a', -1)
 
+        assert r.counter('b', amount=5) == (5, 0, 5)
+        assert r.ttl(r._counter_key('b')) > 0
+
+    def test_timeseries(self, r):
+        # Frozen, so that all increments land in the same buckets across an hour boundary
+        now = tc.local_datetime()
+        assert r.timeseries_incr('a', timestamp=now) == {'minute': 1, 'hour': 1, 'day': 1}
+        assert r.timeseries_incr('a', amount=2, timestamp=now) == {'minute': 3, 'hour': 3, 'day': 3}
+        assert r.timeseries_incr('a', ttls={'minute': 60}, timestamp=now)
+        assert len(r.keys('r:counter:ts:a:*')) == 3
+        assert r.ttl('r:counter:ts:a:minute:{0}'.format(now.strftime('%Y%m%d%H'))) > 86400
+        start, end = now - datetime.timedelta(minutes=90), now + datetime.timedelta(minutes=1)
+        buckets = r.timeseries_range('a', start, end)
+        assert len(buckets) in (91, 92)
+        assert sum(value for _, value in buckets) == 4
+        assert r.timeseries_sum('a', start, end, granularity='hour') == 4
+        assert r.timeseries_sum('a', start, end, granularity='day') == 4
+        assert r.timeseries_sum('a', start, now - datetime.timedelta(minutes=2)) == 0
+        with pytest.raises(ValueError):
+            r.timeseries_sum('a', start, end, granularity='week')
+
+    def test_ucounter(self, r):
+        assert not r.ucounter_add('a')
+        assert r.ucounter_add('a', *range(2500), chunk_size=1000)
+        assert not r.ucounter_add('a', 1, 2)
+        assert 2400 < r.ucounter('a') < 2600
+        assert r.ttl(r._ucounter_key('a')) > 86400
+        today = tc.local_date()
+        yesterday = today - datetime.timedelta(days=1)
+        r.ucounter_add('a', *range(2000, 3000), time_part_func=lambda: yesterday.strftime('%Y%m%d'))
+        assert 2900 < r.ucounter_range('a', yesterday, today) < 3100
+        count = r.ucounter_range('a', yesterday, today, cache_time=60)
+        assert 2900 < count < 3100
+        assert r.exists('r:ucounter:a:{0}-{1}'.format(yesterday.strftime('%Y%m%d'), today.strftime('%Y%m%d')))
+        assert r.ucounter_range('a', yesterday, today, cache_time=60) == count
+        assert r.ucounter_range('a', today, yesterday) == 0
+
     # HotKey Section
 
     def test_hotkey(self, r):
@@ -1,3 +1,4 @@
+import base64
 import json
 import time
 
@@ -23,6 +24,22 @@ class TestRedisExtensionsCommands(object):
         code, overtop, blacklist = r.vcode(phone, quota=0, req_interval=0, ndigits=4)
         assert len(code) == 4
 
+    def test_vcode_black_list(self, r):
+        phone = '18888888888'
+        ipaddr = 'localhost'
+        code, overtop, blacklist = r.vcode(phone, ipaddr=ipaddr)
+        assert code and not overtop and not blacklist
+        assert r.get('r:vcode:' + phone) == code
+        # Request too frequently, added into black list
+        code, overtop, blacklist = r.vcode(phone, ipaddr=ipaddr)
+        assert (code, overtop, blacklist) == (None, False, True)
+        assert r.sismember('r:vcode:phone:black:list', phone)
+        code, overtop, blacklist = r.vcode(phone, ipaddr=ipaddr, req_interval=0)
+        assert (code, overtop, blacklist) == (None, None, True)
+        assert r.vcode_quota(phone, ipaddr=ipaddr) == (2, 2)
+        code, overtop, blacklist = r.vcode(phone, ipaddr=ipaddr, req_interval=0, black_list=False)
+        assert code and not overtop and not blacklist
+
     def test_vcode_quota(self, r):
         phone = '18888888888'
         ipaddr = 'localhost'
@@ -93,6 +110,43 @@ class TestRedisExtensionsCommands(object):
         assert isinstance(b64str, str)
         assert r.exists(self.__gvcode_test_key())
 
+    def test_gvcode_b64str_no_refresh(self, r):
+        assert r.gvcode_b64str('a', refresh=False) == ''
+        assert not r.scard(r._gvcode_key())
+        # No code to pass with an empty one
+        assert not r.exists(self.__gvcode_test_key())
+        assert not r.gvcode_exists('a', '')
+
+    def test_gvcode_pool(self, r):
+        pool = r.gvcode_pool(low=5, high=20, chunk_size=3, workers=2)
+        assert pool.maintain() == 20
+        assert r.scard(r._gvcode_key()) == 20
+        assert pool.maintain() == 0
+        r.gvcode_cut(18)
+        with pool:
+            time.sleep(3)
+        assert r.scard(r._gvcode_key()) >= 20
+        assert r.gvcode_b64str('a', refresh=False)
+
+    def test_gvcode_bytes_drained(self, r):
+        r.gvcode_add(num=2)
+        # Drained
+        r.delete(r._gvcode_key())
+        assert r.gvcode_bytes('a', refresh=False) == b''
+        assert not r.exists(self.__gvcode_test_key())
+        assert not r.gvcode_exists('a', '')
+
+    def test_gvcode_bytes(self, r):
+        png = r.gvcode_bytes('a')
+        assert png.startswith(b'\x89PNG')
+        code = r.get(self.__gvcode_test_key())
+        assert len(code) == 4
+        # Members stored as base64 in JSON by previous versions
+        r.delete(r._gvcode_key())
+        r.sadd(r._gvcode_key(), json.dumps({'b64str': base64.b64encode(png).decode('utf-8'), 'vcode': code}))
+        assert r.gvcode_b64str('b') == base64.b64encode(png).decode('utf-8')
+        assert r.gvcode_exists('b', code)
+
     def test_gvcode_exists(self, r):
         b64str = r.gvcode_b64str('a')
         code = r.get(self.__gvcode_test_key())
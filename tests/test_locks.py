@@ -0,0 +1,246 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from redis.asyncio import Redis as AsyncRedis
+from redis.exceptions import LockNotOwnedError
+
+import redis_extensions as redis
+
+from .conftest import _get_client
+
+
+class TestRedisLocks(object):
+
+    # Lease Lock Section
+
+    def test_lease_lock(self, r):
+        with r.lease_lock('a', lease=1) as lock:
+            assert r.get('r:lock:a') == lock.identifier
+            assert not r.acquire_lock('a', acquire_timeout=0.05)
+            # Outlive the lease, renewed by the watchdog
+            time.sleep(1.5)
+            assert r.get('r:lock:a') == lock.identifier
+            lock.ensure_owned()
+        assert not r.exists('r:lock:a')
+
+    def test_lease_lock_blocking(self, r):
+        with r.lease_lock('a', lease=1):
+            assert not r.lease_lock('a', blocking=False).acquire()
+            with pytest.raises(LockNotOwnedError):
+                with r.lease_lock('a', acquire_timeout=0.05):
+                    pass
+
+    def test_lease_lock_lost(self, r):
+        losts = []
+        lock = r.lease_lock('a', lease=1, renew_interval=0.1, on_lost=losts.append)
+        assert lock.acquire()
+        r.delete('r:lock:a')
+        time.sleep(0.3)
+        assert lock.lost
+        assert losts == [lock]
+        with pytest.raises(LockNotOwnedError):
+            lock.ensure_owned()
+        assert not lock.release()
+        # Failed release isn't reported as lost
+        lock = r.lease_lock('a', lease=10, on_lost=losts.append)
+        assert lock.acquire()
+        r.set('r:lock:a', 'other')
+        assert not lock.release()
+        assert len(losts) == 1
+
+    # Redlock Section
+
+    def test_redlock(self, request, r):
+        clients = [r] + [_get_client(redis.RedisExtensions, request, db=db, decode_responses=True) for db in (10, 11)]
+        rl = redis.Redlock(clients, retry_count=0)
+        lease = rl.acquire('a', ttl=10)
+        assert lease.validity > 9
+        assert all(client.get('r:lock:a') == lease.identifier for client in clients)
+        assert not rl.acquire('a')
+        assert rl.release(lease) == 3
+        assert not any(client.exists('r:lock:a') for client in clients)
+        rl.close()
+
+    def test_redlock_close(self, request, r):
+        clients = [r] + [_get_client(redis.RedisExtensions, request, db=db, decode_responses=True) for db in (10, 11)]
+        before = threading.active_count()
+        with redis.Redlock(clients, retry_count=0) as rl:
+            with rl.lock('a', ttl=10):
+                assert threading.active_count() > before
+        assert threading.active_count() == before
+        with pytest.raises(RuntimeError):
+            rl.acquire('a')
+
+    def test_redlock_quorum(self, request, r):
+        clients = [r] + [_get_client(redis.RedisExtensions, request, db=db, decode_responses=True) for db in (10, 11)]
+        rl = redis.Redlock(clients, retry_count=0)
+        # Minority held by another owner
+        clients[0].set('r:lock:a', 'other')
+        with rl.lock('a', ttl=10) as lease:
+            assert clients[1].get('r:lock:a') == lease.identifier
+        assert clients[0].get('r:lock:a') == 'other'
+        # Majority held by another owner
+        clients[1].set('r:lock:a', 'other')
+        assert not rl.acquire('a')
+        assert not clients[2].exists('r:lock:a')
+        rl.close()
+
+    # Semaphore Section
+
+    def test_semaphore(self, r):
+        sem1, sem2, sem3 = [r.semaphore('a', limit=2, blocking=False) for _ in range(3)]
+        assert sem1.acquire()
+        assert sem2.acquire()
+        assert not sem3.acquire()
+        assert sem1.holders() == 2
+        assert sem1.renew()
+        assert sem1.release()
+        assert sem3.acquire()
+        assert not sem1.release()
+
+    def test_semaphore_renew_ttl(self, r):
+        sem = r.semaphore('a', limit=1, lease=10, blocking=False)
+        assert sem.acquire()
+        r.pexpire('r:semaphore:a', 100)
+        assert sem.renew()
+        # Holders key outlives the renewed lease
+        assert r.pttl('r:semaphore:a') > 10000
+        assert sem.holders() == 1
+
+    def test_semaphore_acquire_ttl(self, r):
+        assert r.semaphore('a', limit=2, lease=10).acquire()
+        assert r.semaphore('a', limit=2, lease=0.1).acquire()
+        # A shorter lease never shortens the TTL under longer leases
+        assert r.pttl('r:semaphore:a') > 10000
+        assert r.pttl('r:semaphore:a:ticket') > 10000
+
+    def test_semaphore_stale_holder(self, r):
+        assert r.semaphore('a', limit=1, lease=0.1).acquire()
+        time.sleep(0.2)
+        with r.semaphore('a', limit=1, acquire_timeout=0.5) as sem:
+            assert sem.holders() == 1
+
+    def test_semaphore_fifo(self, r):
+        holder = r.semaphore('a', limit=1)
+        assert holder.acquire()
+        first = r.semaphore('a', limit=1, blocking=False)
+        assert not first.acquire()
+        r.zadd('r:semaphore:a:waiters', {'w1': 0})
+        r.zadd('r:semaphore:a:seen', {'w1': int(time.time() * 1000)})
+        holder.release()
+        # ``w1`` waits ahead in line
+        assert not first.acquire()
+
+    def test_semaphore_wait_notification(self, r):
+        holder = r.semaphore('a', limit=1)
+        assert holder.acquire()
+        threading.Timer(0.2, holder.release).start()
+        start = time.time()
+        with r.semaphore('a', limit=1, acquire_timeout=5):
+            assert time.time() - start < 1
+
+    # Read-Write Lock Section
+
+    def test_rwlock(self, r):
+        rw = r.rwlock('a', acquire_timeout=0.2)
+        reader1 = rw.acquire_read()
+        reader2 = rw.acquire_read()
+        assert reader1 and reader2
+        assert not rw.acquire_write()
+        assert not r.exists('r:rwlock:a:writer:waiting')
+        # Waiting writer blocks new readers
+        writers = []
+        writer = threading.Thread(target=lambda: writers.append(r.rwlock('a', acquire_timeout=5).acquire_write()))
+        writer.start()
+        time.sleep(0.1)
+        assert not rw.acquire_read()
+        assert rw.release_read(reader1)
+        assert rw.release_read(reader2)
+        writer.join()
+        assert r.get('r:rwlock:a:writer') == writers[0]
+        assert rw.release_write(writers[0])
+        with rw.writing():
+            assert not rw.acquire_read()
+        with rw.reading():
+            pass
+
+    def test_rwlock_renew(self, r):
+        losts = []
+        rw = r.rwlock('a', lease=1, blocking=False, on_lost=lambda lock, identifier: losts.append(identifier))
+        with rw.reading() as reader:
+            time.sleep(1.5)
+            # Readers outlive the lease while held
+            assert not rw.acquire_write()
+            assert rw.renew_read(reader)
+        with rw.writing() as writer:
+            time.sleep(1.5)
+            assert not rw.acquire_read()
+            assert rw.renew_write(writer)
+        assert not losts
+        assert not rw.renew_read(reader)
+        assert not rw.renew_write(writer)
+
+    def test_rwlock_lost(self, r):
+        losts = []
+        rw = r.rwlock('a', lease=1, renew_interval=0.1, on_lost=lambda lock, identifier: losts.append(identifier))
+        with rw.writing() as writer:
+            r.delete('r:rwlock:a:writer')
+            time.sleep(0.3)
+        assert losts == [writer]
+
+    # Metrics Section
+
+    def test_lock_metrics(self, r):
+        metrics = redis.InMemoryLockMetrics()
+        r.lock_metrics = metrics
+        identifier = r.acquire_lock('a')
+        assert not r.acquire_lock('a', acquire_timeout=0.05)
+        assert r.release_lock('a', identifier)
+        assert not r.release_lock('a', identifier)
+        with r.lease_lock('b', lease=1):
+            pass
+        with r.semaphore('c', limit=1):
+            pass
+        stats = metrics.snapshot(reset=True)
+        assert stats['a']['acquires'] == 1
+        assert stats['a']['timeouts'] == 1
+        assert stats['a']['waits'] == 1
+        assert stats['a']['releases'] == 1
+        assert stats['a']['lost'] == 1
+        assert stats['a']['acquire_latency']['count'] == 2
+        assert stats['a']['hold_duration']['count'] == 1
+        assert stats['b']['releases'] == 1
+        assert stats['semaphore:c']['acquires'] == 1
+        assert metrics.snapshot() == {}
+
+    def test_lock_metrics_threads(self, r):
+        metrics = redis.InMemoryLockMetrics()
+        r.lock_metrics = metrics
+        errors = []
+
+        def run(i):
+            try:
+                for _ in range(50):
+                    r.release_lock(str(i), r.acquire_lock(str(i)))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i, )) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert not errors
+        assert sum(stat['releases'] for stat in metrics.snapshot().values()) == 400
+
+    def test_async_lease_lock(self, r):
+        async def run():
+            async with AsyncRedis(host='localhost', port=6379, db=9, decode_responses=True) as client:
+                async with redis.AsyncLeaseLock(client, 'a', lease=1) as lock:
+                    await asyncio.sleep(1.5)
+                    assert await client.get('r:lock:a') == lock.identifier
+                assert not await client.exists('r:lock:a')
+
+        asyncio.run(run())
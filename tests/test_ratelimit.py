@@ -0,0 +1,72 @@
+import time
+
+import pytest
+
+from redis_extensions.ratelimit import LEASE_PERMITS_SCRIPT
+
+
+class TestRedisRateLimit(object):
+
+    @pytest.mark.parametrize('algorithm', ['fixed_window', 'sliding_log', 'sliding_window', 'gcra'])
+    def test_rate_limiter(self, r, algorithm):
+        limiter = r.rate_limiter('a', limit=3, period=1, algorithm=algorithm)
+        results = [limiter.hit('x') for _ in range(4)]
+        assert [res.allowed for res in results] == [True, True, True, False]
+        assert [res.remaining for res in results[:3]] == [2, 1, 0]
+        assert results[-1].remaining == 0
+        assert 0 < results[-1].retry_after <= 2
+        # Other identifiers are independent
+        assert limiter.hit('y').allowed
+        time.sleep(results[-1].retry_after + 0.05)
+        assert limiter.hit('x').allowed
+        assert limiter.reset('x')
+
+    def test_rate_limiter_cost(self, r):
+        limiter = r.rate_limiter('a', limit=5, period=10, algorithm='gcra')
+        assert limiter.hit(cost=5).allowed
+        result = limiter.hit(cost=2)
+        assert not result.allowed
+        assert 3 < result.retry_after <= 4
+        assert r.pttl(limiter.key()) > 0
+
+    @pytest.mark.parametrize('algorithm', ['fixed_window', 'sliding_log', 'sliding_window', 'gcra'])
+    def test_rate_limiter_cost_over_limit(self, r, algorithm):
+        limiter = r.rate_limiter('a', limit=3, period=1, algorithm=algorithm)
+        with pytest.raises(ValueError):
+            limiter.hit(cost=4)
+        with pytest.raises(ValueError):
+            r.rate_limit_many([(limiter, 'x', 4)])
+        assert not r.exists(limiter.key())
+        assert limiter.hit(cost=3).allowed
+        # Burst of gcra allows more at once
+        assert r.rate_limiter('b', limit=3, period=1, burst=5).hit(cost=5).allowed
+
+    def test_rate_limiter_invalid(self, r):
+        with pytest.raises(ValueError):
+            r.rate_limiter('a', limit=1, period=1, algorithm='leaky')
+        with pytest.raises(ValueError):
+            r.rate_limiter('a', limit=0, period=1)
+
+    def test_rate_limit_many(self, r):
+        per_second = r.rate_limiter('a', limit=1, period=1, algorithm='sliding_window')
+        per_minute = r.rate_limiter('b', limit=10, period=60, algorithm='fixed_window')
+        first, second = r.rate_limit_many([(per_second, 'x', 1), (per_minute, 'x', 1)])
+        assert first.allowed and second.allowed
+        first, second = r.rate_limit_many([(per_second, 'x', 1), (per_minute, 'x', 1)])
+        assert not first.allowed
+        assert second.remaining == 8
+
+    def test_leased_rate_limiter(self, r):
+        limiter1 = r.leased_rate_limiter('a', limit=30, period=10, batch=10, lease_time=0.2)
+        limiter2 = r.leased_rate_limiter('a', limit=30, period=10, batch=10, lease_time=0.2)
+        r.script_load(LEASE_PERMITS_SCRIPT)
+        r.config_resetstat()
+        assert sum(limiter1.acquire() for _ in range(25)) == 25
+        assert r.info('commandstats')['cmdstat_evalsha']['calls'] == 3
+        # Never over-admits, 5 permits parked in ``limiter1``
+        assert sum(limiter2.acquire() for _ in range(10)) == 0
+        limiter1.close()
+        assert sum(limiter2.acquire() for _ in range(10)) == 0
+        time.sleep(0.25)
+        assert sum(limiter2.acquire() for _ in range(10)) == 5
+        assert not limiter1.acquire(cost=10)